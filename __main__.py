@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Commands for clusters that are already running.
+
+clusterdock itself only hands ``start`` to a topology, so these are run with
+``python -m topology_clusterdock_de_cdh5120 <command>`` from the directory containing the topology.
+"""
+
+import argparse
+import importlib
+import logging
+
+from clusterdock.config import defaults
+
+from . import bench, history, pool, reset, sampler, status, validate
+
+logger = logging.getLogger('clusterdock.{}'.format(__name__))
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m {}'.format(__package__),
+                                     description='Manage a running {} cluster'.format(__package__))
+    parser.add_argument('--verbose', '-v',
+                        help='Increase logging verbosity',
+                        action='store_true')
+    parser.add_argument('-n', '--network',
+                        help='Docker network of the cluster',
+                        default=defaults['DEFAULT_NETWORK'],
+                        metavar='nw')
+    command_subparsers = parser.add_subparsers(dest='command')
+    command_subparsers.required = True
+
+    expand_parser = command_subparsers.add_parser(
+        'expand', help='Add secondary and edge nodes to the cluster'
+    )
+    expand_parser.add_argument('--secondaries',
+                               help='Number of secondary nodes to add',
+                               type=int,
+                               default=0,
+                               metavar='n')
+    expand_parser.add_argument('--edges',
+                               help='Number of edge nodes to add',
+                               type=int,
+                               default=0,
+                               metavar='n')
+    expand_parser.add_argument('--change-hostfile',
+                               help='Add host-file entries for the new nodes on the docker guest',
+                               action='store_true')
+
+    shrink_parser = command_subparsers.add_parser(
+        'shrink', help='Decommission and remove secondary nodes from the cluster'
+    )
+    shrink_parser.add_argument('nodes',
+                               help='Hostnames of the secondary nodes to remove',
+                               nargs='+',
+                               metavar='node')
+
+    command_subparsers.add_parser(
+        'pause', help='Quiesce the cluster and freeze its containers'
+    )
+    command_subparsers.add_parser(
+        'resume', help='Thaw a paused cluster and wait until it is ready'
+    )
+
+    reset_parser = command_subparsers.add_parser(
+        'reset', help='Reset the data of the cluster in place, without restarting services'
+    )
+    reset_parser.add_argument('--services',
+                              help='Services to reset (default is all of them)',
+                              nargs='+',
+                              choices=list(reset.RESETTABLE_SERVICES),
+                              metavar='service')
+    reset_parser.add_argument('--hdfs-roots',
+                              help='HDFS directories whose contents are deleted '
+                                   '(default is {})'.format(' '.join(reset.DEFAULT_HDFS_ROOTS)),
+                              nargs='+',
+                              metavar='path')
+    reset_parser.add_argument('--hbase-mode',
+                              help='Whether to drop or truncate HBase tables',
+                              choices=reset.HBASE_MODES,
+                              default='drop',
+                              metavar='mode')
+    reset_parser.add_argument('--hbase-namespaces',
+                              help='HBase namespaces to reset (default is all but hbase)',
+                              nargs='+',
+                              metavar='namespace')
+    reset_parser.add_argument('--keep-tsdb-tables',
+                              help="Leave OpenTSDB's tsdb* tables in HBase alone",
+                              action='store_true')
+
+    reconfigure_parser = command_subparsers.add_parser(
+        'reconfigure', help='Change configs and restart only the roles they affect'
+    )
+    reconfigure_parser.add_argument('changes',
+                                    help='Config changes, e.g. hdfs:dfs_replication=2 or '
+                                         'hbase/hbase-REGIONSERVER-BASE:hbase_regionserver_'
+                                         'handler_count=60',
+                                    nargs='*',
+                                    metavar='change')
+    reconfigure_parser.add_argument('--file',
+                                    help='JSON file mapping services (or service/role config '
+                                         'group) to configs',
+                                    metavar='path')
+    reconfigure_parser.add_argument('--no-restart',
+                                    help='Apply the changes but only show what would be restarted',
+                                    action='store_true')
+
+    sample_parser = command_subparsers.add_parser(
+        'sample', help='Sample CM metrics and container stats while a workload runs'
+    )
+    sample_parser.add_argument('--query',
+                               help='tsquery to sample, can be repeated (default is CPU, memory, '
+                                    'heap and GC of all roles, DataNode I/O and RegionServer '
+                                    'request rates)',
+                               action='append',
+                               dest='queries',
+                               metavar='tsquery')
+    sample_parser.add_argument('--interval',
+                               help='Seconds between polls',
+                               type=float,
+                               default=sampler.DEFAULT_INTERVAL,
+                               metavar='seconds')
+    sample_parser.add_argument('--duration',
+                               help='Seconds to sample for (default is until interrupted)',
+                               type=float,
+                               metavar='seconds')
+    sample_parser.add_argument('--capacity',
+                               help='Points kept per metric and role before downsampling',
+                               type=int,
+                               default=sampler.DEFAULT_CAPACITY,
+                               metavar='n')
+    sample_parser.add_argument('--no-container-stats',
+                               help="Don't sample the Docker stats of the containers",
+                               action='store_true')
+    sample_parser.add_argument('--output',
+                               help='CSV (or .parquet) file for the samples. A summary is '
+                                    'written next to it as <output>.summary.json',
+                               default='metrics.csv',
+                               metavar='path')
+
+    validate_parser = command_subparsers.add_parser(
+        'validate', help='Check that every started service works and print a pass/fail table'
+    )
+    validate_parser.add_argument('--budget',
+                                 help='Seconds all checks together may take',
+                                 type=int,
+                                 default=validate.DEFAULT_BUDGET,
+                                 metavar='seconds')
+
+    history_parser = command_subparsers.add_parser(
+        'history', help='Show recent starts and flag phases slower than their baseline'
+    )
+    history_parser.add_argument('--db',
+                                help='Run history database',
+                                default=history.DEFAULT_HISTORY_PATH,
+                                metavar='path')
+    history_parser.add_argument('--limit',
+                                help='Number of recent starts to show',
+                                type=int,
+                                default=10,
+                                metavar='n')
+
+    bench_parser = command_subparsers.add_parser(
+        'bench', help='Run standard workloads and write their results as JSON'
+    )
+    bench_parser.add_argument('--workloads',
+                              help='Workloads to run (default is all of them)',
+                              nargs='+',
+                              choices=bench.WORKLOADS,
+                              metavar='workload')
+    bench_parser.add_argument('--size',
+                              help='Size of the workloads',
+                              choices=list(bench.SIZES),
+                              default='small')
+    bench_parser.add_argument('--concurrency',
+                              help='Map tasks, HBase clients, Kafka partitions, Spark executors '
+                                   'and Hive sessions running at the same time',
+                              type=int,
+                              default=bench.DEFAULT_CONCURRENCY,
+                              metavar='n')
+    bench_parser.add_argument('--sample',
+                              help='Sample resource usage during every workload and add a '
+                                   'summary of it to the results',
+                              action='store_true')
+    bench_parser.add_argument('--output',
+                              help='JSON file for the results',
+                              default='bench.json',
+                              metavar='path')
+
+    status_command_parser = command_subparsers.add_parser(
+        'status', help='Show the state of the containers, CM hosts, services, roles, parcels and '
+                       'Kerberos of the cluster'
+    )
+    status_command_parser.add_argument('--watch',
+                                       help='Keep showing the state, redrawing what changed',
+                                       action='store_true')
+    status_command_parser.add_argument('--interval',
+                                       help='Seconds between updates in watch mode',
+                                       type=float,
+                                       default=status.DEFAULT_WATCH_INTERVAL,
+                                       metavar='seconds')
+
+    pool_parser = command_subparsers.add_parser(
+        'pool', help='Keep warm clusters for CI jobs to lease and release'
+    )
+    pool_subparsers = pool_parser.add_subparsers(dest='pool_command')
+    pool_subparsers.required = True
+    serve_parser = pool_subparsers.add_parser(
+        'serve', help='Keep clusters warm and serve the lease API on localhost'
+    )
+    serve_parser.add_argument('--size',
+                              help='Number of ready clusters to keep warm (leased ones '
+                                   'included with --reset-on-release)',
+                              type=int,
+                              default=1,
+                              metavar='n')
+    serve_parser.add_argument('--max-concurrent-builds',
+                              help='Number of clusters to start at the same time',
+                              type=int,
+                              default=1,
+                              metavar='n')
+    serve_parser.add_argument('--prefix',
+                              help='Prefix of the instance names of the clusters',
+                              default=pool.DEFAULT_INSTANCE_NAME_PREFIX,
+                              metavar='prefix')
+    serve_parser.add_argument('--state-file',
+                              help='File in which the pool keeps its clusters and metrics',
+                              default=pool.DEFAULT_POOL_STATE_FILE_PATH,
+                              metavar='path')
+    serve_parser.add_argument('--reset-on-release',
+                              help='Reset released clusters in place instead of replacing them',
+                              action='store_true')
+    serve_parser.add_argument('start_args',
+                              help='Arguments for clusterdock start, after --',
+                              nargs=argparse.REMAINDER)
+    lease_parser = pool_subparsers.add_parser(
+        'lease', help='Lease a ready cluster, waiting for one if needed'
+    )
+    lease_parser.add_argument('--holder',
+                              help='Who leases the cluster (e.g. a CI job URL)',
+                              metavar='holder')
+    lease_parser.add_argument('--timeout',
+                              help='Seconds to wait for a ready cluster',
+                              type=float,
+                              metavar='seconds')
+    release_parser = pool_subparsers.add_parser(
+        'release', help='Give a leased cluster back to the pool'
+    )
+    release_parser.add_argument('instance',
+                                help='Instance name of the cluster')
+    status_parser = pool_subparsers.add_parser(
+        'status', help='Show the clusters of the pool and its lease and queue wait times'
+    )
+    for pool_command_parser in (serve_parser, lease_parser, release_parser, status_parser):
+        pool_command_parser.add_argument('--port',
+                                         help='Port of the pool API on localhost',
+                                         type=int,
+                                         default=pool.DEFAULT_POOL_PORT,
+                                         metavar='port')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+
+    command = importlib.import_module('.{}'.format(args.command), __package__)
+    command.main(args)
+
+
+if __name__ == '__main__':
+    main()
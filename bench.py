@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import logging
+import re
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from . import cluster_utils
+from .cluster_utils import execute
+from .cm import ClouderaManagerDeployment
+from .kerberos import KEYTAB_FILE_PATH, KEYTAB_PRINCIPAL
+from .pause import get_client_node, run_hbase_shell, supervisor_program_exists
+from .reconfigure import reconfigure
+from .reset import (KAFKA_TOPICS_PATH, KAFKA_ZOOKEEPER, delete_kafka_topics,
+                    enable_kafka_topic_deletion)
+from .sampler import Sampler
+from .start import DEFAULT_CLUSTER_NAME, YARN_ALLOWED_SYSTEM_USERS
+from .validate import CDH_PARCEL_DIR, KAFKA_BIN_DIR, KAFKA_BROKER, MAPREDUCE_EXAMPLES_JAR
+
+logger = logging.getLogger('clusterdock.{}'.format(__name__))
+
+SPARK_EXAMPLES_JAR = '{}/lib/spark/lib/spark-examples.jar'.format(CDH_PARCEL_DIR)
+
+# Benchmark data lives here and in tables and topics named after the run, and is removed after
+# every workload.
+HDFS_BENCH_DIR = '/user/cloudera-scm/clusterdock-bench'
+HBASE_PE_TABLE = 'TestTable'
+
+# Workload sizes. TeraGen rows are 100 bytes each.
+SIZES = OrderedDict([
+    ('small', {'tera_rows': 1000000, 'hbase_rows': 10000, 'kafka_records': 100000,
+               'kafka_record_size': 100, 'spark_slices': 10, 'hive_rows': 100000}),
+    ('medium', {'tera_rows': 10000000, 'hbase_rows': 100000, 'kafka_records': 1000000,
+                'kafka_record_size': 100, 'spark_slices': 100, 'hive_rows': 1000000}),
+    ('large', {'tera_rows': 100000000, 'hbase_rows': 1000000, 'kafka_records': 10000000,
+               'kafka_record_size': 1000, 'spark_slices': 1000, 'hive_rows': 10000000}),
+])
+WORKLOADS = ('terasort', 'hbase', 'kafka', 'spark', 'hive')
+DEFAULT_CONCURRENCY = 4
+
+# YARN only runs containers of system users (i.e. below this UID) that are allowed explicitly,
+# and benchmarks run as the cloudera-scm user of the admin principal. Clusters started before
+# start.YARN_ALLOWED_SYSTEM_USERS was set get it added.
+YARN_MIN_USER_ID = 1000
+
+# e.g. 100000 records sent, 41322.3 records/sec (3.94 MB/sec), 612.81 ms avg latency,
+# 1008.00 ms max latency, 635 ms 50th, 949 ms 95th, 994 ms 99th, 1006 ms 99.9th.
+KAFKA_PRODUCER_PATTERN = (r'([\d.]+) records/sec \(([\d.]+) MB/sec\), ([\d.]+) ms avg latency, '
+                          r'([\d.]+) ms max latency, (\d+) ms 50th, (\d+) ms 95th, '
+                          r'(\d+) ms 99th')
+# e.g. [RandomWriteTest] Min: 5218ms Max: 5385ms Avg: 5289ms
+HBASE_PE_TIMINGS_PATTERN = r'Min: (\d+)ms\s+Max: (\d+)ms\s+Avg: (\d+)ms'
+HBASE_PE_LATENCY_PATTERN = r'Latency \(us\) : mean=([\d.]+), .*?99th=([\d.]+)'
+HIVE_TIME_TAKEN_PATTERN = r'Time taken: ([\d.]+) seconds'
+
+
+def main(args):
+    cluster = cluster_utils.attach_cluster(args.network)
+    results = run_benchmarks(cluster,
+                             workloads=args.workloads or list(WORKLOADS),
+                             size=args.size,
+                             concurrency=args.concurrency,
+                             sample=args.sample)
+    with open(args.output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+    logger.info('Wrote results to %s.', args.output)
+
+
+def run_benchmarks(cluster, workloads, size='small', concurrency=DEFAULT_CONCURRENCY,
+                   sample=False):
+    """Run benchmark workloads on a cluster, one after the other.
+
+    Args:
+        cluster (:py:class:`clusterdock.models.Cluster`): The cluster, as returned by
+            :py:func:`cluster_utils.attach_cluster`.
+        workloads (:obj:`list`): Names of the workloads to run (see :py:data:`WORKLOADS`).
+        size (:obj:`str`, optional): One of :py:data:`SIZES`. Default: ``small``
+        concurrency (:obj:`int`, optional): Map tasks, HBase clients, Kafka partitions (and
+            consumer threads), Spark executors and Hive queries running at the same time.
+            Default: :py:const:`DEFAULT_CONCURRENCY`
+        sample (:obj:`bool`, optional): Sample resource usage during every workload and add a
+            summary of it to its results. Default: ``False``
+
+    Returns:
+        An :py:class:`collections.OrderedDict` with the ``metadata`` of the run and the
+        ``results`` of every workload.
+    """
+    unknown_workloads = set(workloads) - set(WORKLOADS)
+    if unknown_workloads:
+        raise ValueError('Cannot run {} (must be one of {}).'.format(
+            ', '.join(sorted(unknown_workloads)), ', '.join(WORKLOADS)
+        ))
+    deployment = ClouderaManagerDeployment(cluster_utils.get_server_url(cluster.primary_node))
+    client_node = get_client_node(cluster) or cluster.primary_node
+    kafka_nodes = [node for node in cluster
+                   if node.group == 'secondary' and supervisor_program_exists(node, 'kafka')]
+    sizes = SIZES[size]
+    run_id = datetime.utcnow().strftime('%Y%m%d%H%M%S')
+
+    execute(client_node, 'kinit -kt {} {}'.format(KEYTAB_FILE_PATH, KEYTAB_PRINCIPAL))
+    if {'terasort', 'spark', 'hive'} & set(workloads):
+        _allow_yarn_user(cluster, deployment, client_node)
+
+    runs = OrderedDict([
+        ('terasort', lambda: _run_terasort(client_node, sizes['tera_rows'], concurrency,
+                                           '{}/{}'.format(HDFS_BENCH_DIR, run_id))),
+        ('hbase', lambda: _run_hbase_pe(client_node, sizes['hbase_rows'], concurrency)),
+        ('kafka', lambda: _run_kafka_perf(kafka_nodes, sizes['kafka_records'],
+                                          sizes['kafka_record_size'], concurrency,
+                                          'clusterdock-bench-{}'.format(run_id))),
+        ('spark', lambda: _run_spark_pi(client_node, sizes['spark_slices'], concurrency)),
+        ('hive', lambda: _run_hive_queries(client_node, sizes['hive_rows'], concurrency,
+                                           'clusterdock_bench_{}'.format(run_id))),
+    ])
+
+    results = OrderedDict()
+    for workload in workloads:
+        if workload == 'kafka' and not kafka_nodes:
+            logger.info('Skipping kafka, which runs on no secondary node.')
+            continue
+        logger.info('Running %s workload ...', workload)
+        sampler = Sampler(cluster, deployment) if sample else None
+        if sampler:
+            sampler.start()
+        start_time = time.time()
+        try:
+            results[workload] = runs[workload]()
+        except Exception as exception:
+            # One broken workload (e.g. a service that is not running) spoils only its results.
+            logger.exception('Failed to run %s workload.', workload)
+            results[workload] = OrderedDict([('error', str(exception))])
+        results[workload]['elapsed_seconds'] = round(time.time() - start_time, 3)
+        if sampler:
+            sampler.stop()
+            results[workload]['resources'] = sampler.summarize()
+        logger.info('Ran %s workload in %.1f seconds.', workload,
+                    results[workload]['elapsed_seconds'])
+
+    return OrderedDict([('metadata', get_run_metadata(cluster, deployment, run_id, size,
+                                                      concurrency)),
+                        ('results', results)])
+
+
+def get_run_metadata(cluster, deployment, run_id, size, concurrency):
+    """Describe the cluster a benchmark ran on, so that results of runs can be compared.
+
+    Args:
+        cluster (:py:class:`clusterdock.models.Cluster`): The cluster.
+        deployment (:py:class:`cm.ClouderaManagerDeployment`): The CM deployment.
+        run_id (:obj:`str`): ID of the run.
+        size (:obj:`str`): Workload size.
+        concurrency (:obj:`int`): Workload concurrency.
+
+    Returns:
+        An :py:class:`collections.OrderedDict` of the metadata.
+    """
+    cdh_version = next((parcel['version']
+                        for parcel in deployment.get_cluster_parcels(DEFAULT_CLUSTER_NAME)
+                        if parcel['product'] == 'CDH' and parcel['stage'] == 'ACTIVATED'), None)
+    images = OrderedDict()
+    containers = OrderedDict()
+    for node in cluster:
+        images.setdefault(node.group, OrderedDict([('name', node.image),
+                                                   ('id', node.container.image.id)]))
+        host_config = node.container.attrs.get('HostConfig', {})
+        containers[node.fqdn] = OrderedDict([
+            ('cpus', (host_config.get('NanoCpus') or 0) / 1e9 or None),
+            ('memory_bytes', host_config.get('Memory') or None),
+        ])
+    return OrderedDict([
+        ('run_id', run_id),
+        ('timestamp', datetime.utcnow().isoformat() + 'Z'),
+        ('network', cluster.network),
+        ('size', size),
+        ('concurrency', concurrency),
+        ('nodes', OrderedDict(sorted(Counter(node.group for node in cluster).items()))),
+        ('images', images),
+        ('cdh_version', cdh_version),
+        ('cm_service_role_types', sorted(role['type']
+                                         for role in deployment.get_cm_service_roles(
+                                             fields=['type']
+                                         ))),
+        ('containers', containers),
+    ])
+
+
+def _allow_yarn_user(cluster, deployment, client_node):
+    user_id = int(execute(client_node, 'id -u cloudera-scm'))
+    if user_id >= YARN_MIN_USER_ID:
+        return
+    allowed_users = deployment.get_service_config(cluster_name=DEFAULT_CLUSTER_NAME,
+                                                  service_name='yarn').get(
+        'container_executor_allowed_system_users'
+    )
+    if not allowed_users or 'cloudera-scm' not in allowed_users.split(','):
+        logger.info('Allowing YARN containers of the cloudera-scm user ...')
+        reconfigure(cluster, deployment, {
+            'yarn': {'container_executor_allowed_system_users': ','.join(
+                YARN_ALLOWED_SYSTEM_USERS if not allowed_users
+                else allowed_users.split(',') + ['cloudera-scm']
+            )}
+        })
+
+
+def _timed_execute(node, command):
+    start_time = time.time()
+    output = execute(node, command)
+    return output, round(time.time() - start_time, 3)
+
+
+def _run_terasort(client_node, rows, concurrency, hdfs_dir):
+    hadoop_jar = 'hadoop jar {} {{}} -Dmapreduce.job.maps={} {{}}'.format(MAPREDUCE_EXAMPLES_JAR,
+                                                                          concurrency)
+    results = OrderedDict([('rows', rows), ('bytes', rows * 100)])
+    try:
+        for step, step_args in [('teragen', '{} {}/input'.format(rows, hdfs_dir)),
+                                ('terasort', '{0}/input {0}/output'.format(hdfs_dir)),
+                                ('teravalidate', '{0}/output {0}/report'.format(hdfs_dir))]:
+            _, seconds = _timed_execute(client_node, hadoop_jar.format(step, step_args))
+            results[step] = OrderedDict([('seconds', seconds),
+                                         ('mb_per_second', round(rows * 100 / 1e6 / seconds, 3))])
+        # TeraValidate reports misordered keys in its output and only a checksum if there are
+        # none.
+        report = execute(client_node, 'hdfs dfs -cat {}/report/part-r-*'.format(hdfs_dir))
+        results['valid'] = 'misorder' not in report
+    finally:
+        client_node.execute('hdfs dfs -rm -r -f -skipTrash {}'.format(hdfs_dir), quiet=True)
+    return results
+
+
+def _run_hbase_pe(client_node, rows, concurrency):
+    results = OrderedDict([('rows', rows), ('clients', concurrency)])
+    try:
+        for test in ('randomWrite', 'randomRead'):
+            output, seconds = _timed_execute(client_node,
+                                             'hbase pe --nomapred --rows={} {} {} 2>&1'.format(
+                                                 rows, test, concurrency
+                                             ))
+            test_results = OrderedDict([('seconds', seconds),
+                                        ('ops_per_second', round(rows * concurrency / seconds,
+                                                                 3))])
+            timings = re.search(HBASE_PE_TIMINGS_PATTERN, output)
+            if timings:
+                test_results.update(zip(('client_min_ms', 'client_max_ms', 'client_avg_ms'),
+                                        map(int, timings.groups())))
+            latencies = re.findall(HBASE_PE_LATENCY_PATTERN, output)
+            if latencies:
+                # One line per client. The worst client is the one that counts.
+                test_results['latency_mean_us'] = max(float(mean) for mean, _ in latencies)
+                test_results['latency_p99_us'] = max(float(p99) for _, p99 in latencies)
+            results[test] = test_results
+    finally:
+        run_hbase_shell(client_node, ['disable "{}"'.format(HBASE_PE_TABLE),
+                                      'drop "{}"'.format(HBASE_PE_TABLE)])
+    return results
+
+
+def _run_kafka_perf(kafka_nodes, records, record_size, concurrency, topic):
+    # Every broker has a ZooKeeper of its own, so each one is benchmarked on its own node and
+    # all of them at the same time.
+    def run_on_node(node):
+        enable_kafka_topic_deletion(node)
+        execute(node, '{} --zookeeper {} --create --topic {} --partitions {} '
+                      '--replication-factor 1'.format(KAFKA_TOPICS_PATH, KAFKA_ZOOKEEPER, topic,
+                                                      concurrency))
+        try:
+            output, seconds = _timed_execute(
+                node, '{}/kafka-producer-perf-test.sh --topic {} --num-records {} '
+                      '--record-size {} --throughput -1 '
+                      '--producer-props bootstrap.servers={}'.format(KAFKA_BIN_DIR, topic,
+                                                                     records, record_size,
+                                                                     KAFKA_BROKER)
+            )
+            producer = re.findall(KAFKA_PRODUCER_PATTERN, output)[-1]
+            node_results = OrderedDict([('producer', OrderedDict(zip(
+                ('records_per_second', 'mb_per_second', 'avg_latency_ms', 'max_latency_ms',
+                 'p50_latency_ms', 'p95_latency_ms', 'p99_latency_ms'),
+                map(float, producer)
+            )))])
+            node_results['producer']['seconds'] = seconds
+
+            output, seconds = _timed_execute(
+                node, '{}/kafka-consumer-perf-test.sh --broker-list {} --topic {} '
+                      '--messages {} --threads {}'.format(KAFKA_BIN_DIR, KAFKA_BROKER, topic,
+                                                          records, concurrency)
+            )
+            # A CSV header, then a line of values.
+            lines = [line for line in output.splitlines() if ',' in line]
+            consumer = dict(zip((name.strip() for name in lines[0].split(',')),
+                                (value.strip() for value in lines[-1].split(','))))
+            node_results['consumer'] = OrderedDict([
+                ('seconds', seconds),
+                ('mb_per_second', float(consumer['MB.sec'])),
+                ('records_per_second', float(consumer['nMsg.sec'])),
+            ])
+            return node_results
+        finally:
+            delete_kafka_topics(node, [topic])
+
+    with ThreadPoolExecutor(max_workers=len(kafka_nodes)) as executor:
+        node_results = list(executor.map(run_on_node, kafka_nodes))
+    return OrderedDict([('records', records),
+                        ('record_size', record_size),
+                        ('partitions', concurrency),
+                        ('brokers', OrderedDict((node.fqdn, results)
+                                                for node, results in zip(kafka_nodes,
+                                                                         node_results)))])
+
+
+def _run_spark_pi(client_node, slices, concurrency):
+    output, seconds = _timed_execute(
+        client_node, 'spark-submit --class org.apache.spark.examples.SparkPi --master yarn '
+                     '--deploy-mode client --num-executors {} {} {} 2>&1'.format(
+                         concurrency, SPARK_EXAMPLES_JAR, slices
+                     )
+    )
+    pi = re.search(r'Pi is roughly ([\d.]+)', output)
+    return OrderedDict([('slices', slices),
+                        ('executors', concurrency),
+                        ('seconds', seconds),
+                        ('pi', float(pi.group(1)) if pi else None)])
+
+
+def _run_hive_queries(client_node, rows, concurrency, table):
+    hive = 'hive -e "{}" 2>&1'
+    queries = OrderedDict([
+        ('count', 'SELECT COUNT(*) FROM {}'.format(table)),
+        ('group_by', 'SELECT bucket, COUNT(*), MAX(id) FROM {} GROUP BY bucket'.format(table)),
+        ('count_distinct', 'SELECT COUNT(DISTINCT value) FROM {}'.format(table)),
+    ])
+    results = OrderedDict([('rows', rows), ('concurrency', concurrency)])
+    try:
+        # The rows are generated by exploding a string of rows - 1 spaces.
+        output, seconds = _timed_execute(client_node, hive.format(
+            'CREATE TABLE {0} STORED AS PARQUET AS '
+            "SELECT p.pos AS id, concat('value-', cast(p.pos AS STRING)) AS value, "
+            'p.pos % 100 AS bucket FROM (SELECT 1) dummy '
+            "LATERAL VIEW posexplode(split(space({1}), ' ')) p AS pos, val".format(table, rows - 1)
+        ))
+        results['create_seconds'] = seconds
+
+        # Each query runs in as many Hive sessions at the same time as the concurrency says, and
+        # latency is what Hive reports as the time the query took.
+        for name, query in queries.items():
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                outputs = list(executor.map(lambda _: _timed_execute(client_node,
+                                                                     hive.format(query)),
+                                            range(concurrency)))
+            latencies = sorted(float(re.findall(HIVE_TIME_TAKEN_PATTERN, output)[-1])
+                               for output, _ in outputs)
+            results[name] = OrderedDict([
+                ('seconds', max(seconds for _, seconds in outputs)),
+                ('latency_p50_seconds', latencies[len(latencies) // 2]),
+                ('latency_max_seconds', latencies[-1]),
+            ])
+    finally:
+        client_node.execute(hive.format('DROP TABLE IF EXISTS {}'.format(table)), quiet=True)
+    return results
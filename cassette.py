@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Record and replay the Cloudera Manager API traffic of :py:class:`cm_api.ApiClient`.
+
+A cassette is a gzipped file of JSON lines, one per request/response pair. Setting the
+``CM_CASSETTE`` environment variable to ``<mode>:<path>`` makes every API client use it, with
+``mode`` being one of :py:data:`CASSETTE_MODES`.
+"""
+
+import gzip
+import json
+import logging
+import os
+import time
+from collections import defaultdict, deque
+
+import requests
+
+logger = logging.getLogger('clusterdock.{}'.format(__name__))
+
+CASSETTE_ENVIRONMENT_VARIABLE = 'CM_CASSETTE'
+
+RECORD = 'record'
+REPLAY = 'replay'
+# Like replay, but polling is cut short: every run of identical GET requests is answered with its
+# last recorded response, and so is every run of identical responses to a GET request, even if
+# other requests came in between (as when several commands are polled in turn).
+REPLAY_COMPRESSED = 'replay-compressed'
+CASSETTE_MODES = (RECORD, REPLAY, REPLAY_COMPRESSED)
+
+
+class CassetteMismatchError(Exception):
+    """Raised when a replayed client sends a request that is not in the cassette."""
+
+
+class Cassette:
+    """A file of recorded Cloudera Manager API interactions.
+
+    Args:
+        path (:obj:`str`): Path of the cassette file.
+        mode (:obj:`str`): One of :py:data:`CASSETTE_MODES`.
+    """
+    def __init__(self, path, mode):
+        if mode not in CASSETTE_MODES:
+            raise ValueError('Unknown cassette mode {} (must be one of {}).'.format(
+                mode, ', '.join(CASSETTE_MODES)
+            ))
+        self.path = path
+        self.mode = mode
+
+    @classmethod
+    def from_environment(cls):
+        """Get the cassette configured with the ``CM_CASSETTE`` environment variable.
+
+        Returns:
+            A :py:class:`Cassette` instance or ``None`` if the variable is not set.
+        """
+        value = os.environ.get(CASSETTE_ENVIRONMENT_VARIABLE)
+        if not value:
+            return None
+        mode, _, path = value.partition(':')
+        return cls(path=path, mode=mode)
+
+    def create_session(self, server_url):
+        """Create the :py:class:`requests.Session` through which an API client talks to CM.
+
+        Args:
+            server_url (:obj:`str`): Cloudera Manager server URL (including port). Requests are
+                recorded and matched relative to it, so a cassette replays against any server.
+
+        Returns:
+            A :py:class:`requests.Session` instance.
+        """
+        if self.mode == RECORD:
+            logger.info('Recording CM API interactions to %s ...', self.path)
+            return RecordingSession(server_url, self.path)
+        logger.info('Replaying CM API interactions from %s ...', self.path)
+        return ReplayingSession(server_url, self.path, compress=self.mode == REPLAY_COMPRESSED)
+
+
+def _get_request_key(server_url, method, url, params, data):
+    path = url[len(server_url):] if url.startswith(server_url) else url
+    return json.dumps([method.upper(), path, params or {}, data], sort_keys=True)
+
+
+class RecordingSession(requests.Session):
+    """A session that appends every request and its response to a cassette."""
+    def __init__(self, server_url, path):
+        super().__init__()
+        self._server_url = server_url
+        self._path = path
+
+    def request(self, method, url, params=None, data=None, **kwargs):
+        start_time = time.time()
+        response = super().request(method, url, params=params, data=data, **kwargs)
+        interaction = {'request': _get_request_key(self._server_url, method, url, params, data),
+                       'status_code': response.status_code,
+                       'reason': response.reason,
+                       'content_type': response.headers.get('Content-Type'),
+                       'content': response.text,
+                       'elapsed': round(time.time() - start_time, 3)}
+        # Every interaction is a gzip member of its own, which keeps a cassette of an aborted
+        # run readable.
+        with gzip.open(self._path, 'at') as cassette_file:
+            cassette_file.write(json.dumps(interaction) + '\n')
+        return response
+
+
+class ReplayingSession(requests.Session):
+    """A session that answers requests from a cassette instead of sending them.
+
+    Responses to a request are served in the order they were recorded. Once they run out, the last
+    one keeps being served, so that a replayed wait may poll more often than the recorded one did.
+    """
+    def __init__(self, server_url, path, compress=False):
+        super().__init__()
+        self._server_url = server_url
+        with gzip.open(path, 'rt') as cassette_file:
+            interactions = [json.loads(line) for line in cassette_file if line.strip()]
+        if compress:
+            interactions = _compress(interactions)
+        self._interactions = defaultdict(deque)
+        for interaction in interactions:
+            self._interactions[interaction['request']].append(interaction)
+        self.recorded_elapsed = sum(interaction['elapsed'] for interaction in interactions)
+        logger.debug('Loaded %s interactions (%.1f seconds of recorded CM API time).',
+                     len(interactions), self.recorded_elapsed)
+
+    def request(self, method, url, params=None, data=None, **kwargs):
+        key = _get_request_key(self._server_url, method, url, params, data)
+        responses = self._interactions.get(key)
+        if not responses:
+            raise CassetteMismatchError('Request not in cassette: {}'.format(key))
+        interaction = responses.popleft() if len(responses) > 1 else responses[0]
+
+        response = requests.Response()
+        response.status_code = interaction['status_code']
+        response.reason = interaction['reason']
+        response.url = url
+        response.encoding = 'utf-8'
+        if interaction['content_type']:
+            response.headers['Content-Type'] = interaction['content_type']
+        response._content = interaction['content'].encode('utf-8')
+        # Streamed responses are then read from the content.
+        response._content_consumed = True
+        return response
+
+
+def _compress(interactions):
+    compressed = []
+    # The last response kept per GET request, which later ones are compared with.
+    last_responses = {}
+    for index, interaction in enumerate(interactions):
+        key = interaction['request']
+        if key.startswith('["GET"'):
+            if index + 1 < len(interactions) and interactions[index + 1]['request'] == key:
+                continue
+            response = (interaction['status_code'], interaction['content'])
+            if last_responses.get(key) == response:
+                continue
+            last_responses[key] = response
+        compressed.append(interaction)
+    return compressed
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import logging
+import os
+import socket
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import docker
+from clusterdock.config import defaults
+from clusterdock.models import Cluster, client, Node
+from clusterdock.utils import nested_get, wait_for_condition
+
+from .networking import HOST_NETWORK, get_host_ip_address
+
+logger = logging.getLogger('clusterdock.{}'.format(__name__))
+
+CM_PORT = 7180
+DEFAULT_CLUSTER_NAME = 'cluster'
+TOPOLOGY_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# Node groups are recovered from the image a container was started from.
+NODE_GROUP_IMAGE_MARKERS = [('primary', 'cdh-cm-primary-'),
+                            ('database', 'cdh-cm-database-'),
+                            ('secondary', 'cdh-cm-secondary-'),
+                            ('edge', 'cdh-cm-edge-')]
+
+
+def get_server_url(primary_node):
+    """Get the URL under which the Cloudera Manager server of a cluster is reachable.
+
+    Args:
+        primary_node (:py:class:`clusterdock.models.Node`): The primary node of the cluster.
+
+    Returns:
+        A :obj:`str` of the server URL (including port).
+    """
+    # Docker for Mac exposes ports that can be accessed only with ``localhost:<port>`` so
+    # use that instead of the hostname if the host name is ``moby``.
+    hostname = 'localhost' if client.info().get('Name') == 'moby' else socket.gethostname()
+    port = primary_node.host_ports.get(CM_PORT)
+    return 'http://{}:{}'.format(hostname, port)
+
+
+def start_cluster_instance(instance_name, start_args=(), log_file=None):
+    """Start a cluster instance of this topology with ``clusterdock start`` in a subprocess.
+
+    Args:
+        instance_name (:obj:`str`): The instance name (and so, network) of the cluster.
+        start_args (:obj:`list`, optional): Additional arguments for ``clusterdock start``.
+            Default: ``()``
+        log_file (optional): File object to which the output of ``clusterdock start`` is written.
+            Default: ``None`` (inherit the output of this process)
+    """
+    command = ['clusterdock', 'start', TOPOLOGY_DIRECTORY,
+               '--instance-name', instance_name] + list(start_args)
+    logger.debug('Running %s ...', ' '.join(command))
+    returncode = subprocess.call(command, stdout=log_file,
+                                 stderr=subprocess.STDOUT if log_file else None)
+    if returncode:
+        raise Exception('clusterdock start of {} exited with {}.'.format(instance_name,
+                                                                         returncode))
+
+
+def execute(node, command):
+    """Execute a command on a node, raising an exception if it fails.
+
+    Args:
+        node (:py:class:`clusterdock.models.Node`): The node.
+        command (:obj:`str`): The command.
+
+    Returns:
+        A :obj:`str` of the command's output.
+    """
+    result = node.execute(command, quiet=True)
+    if result.exit_code:
+        raise Exception('Command failed on {} (exit code {}): {}'.format(node.fqdn,
+                                                                          result.exit_code,
+                                                                          result.output))
+    return result.output
+
+
+def execute_concurrently(nodes, command):
+    """Execute a command on several nodes at the same time.
+
+    Args:
+        nodes (:obj:`list`): A list of :py:class:`clusterdock.models.Node` instances.
+        command (:obj:`str`): The command.
+
+    Returns:
+        A :obj:`dict` of node FQDNs mapped to the results of :py:meth:`Node.execute`.
+    """
+    nodes = list(nodes)
+    if not nodes:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(nodes)) as executor:
+        results = executor.map(lambda node: node.execute(command, quiet=True), nodes)
+        return {node.fqdn: result for node, result in zip(nodes, results)}
+
+
+def attach_node(container, network):
+    """Create a :py:class:`clusterdock.models.Node` for a container that is already running.
+
+    Args:
+        container (:py:class:`docker.models.containers.Container`): The node's container.
+        network (:obj:`str`): Docker network the container is attached to.
+
+    Returns:
+        A :py:class:`clusterdock.models.Node` instance, in the state
+        :py:meth:`clusterdock.models.Node.start` would have left it in.
+    """
+    image = nested_get(container.attrs, ['Config', 'Image'])
+    group = next((group for group, marker in NODE_GROUP_IMAGE_MARKERS if marker in image), None)
+    fqdn = nested_get(container.attrs, ['Config', 'Hostname'])
+
+    node = Node(hostname=fqdn.split('.')[0], group=group, image=image)
+    node.container = container
+    node.fqdn = fqdn
+    node.ip_address = nested_get(container.attrs,
+                                 ['NetworkSettings', 'Networks', network, 'IPAddress'])
+    node.host_ports = {int(container_port.split('/')[0]): int(host_ports[0]['HostPort'])
+                       for container_port, host_ports in nested_get(container.attrs,
+                                                                    ['NetworkSettings',
+                                                                     'Ports']).items()
+                       if host_ports}
+    if network == HOST_NETWORK:
+        # A node in host network mode has the FQDN and address of the Docker host and listens
+        # on its ports, so none are published. Its container only knows the host's short name.
+        node.fqdn = socket.getfqdn()
+        node.ip_address = get_host_ip_address()
+        node.host_ports = {int(container_port.split('/')[0]): int(container_port.split('/')[0])
+                           for container_port in nested_get(container.attrs,
+                                                            ['Config', 'ExposedPorts']) or {}}
+    return node
+
+
+def attach_cluster(network):
+    """Recreate the :py:class:`clusterdock.models.Cluster` of a running cluster.
+
+    Args:
+        network (:obj:`str`): Docker network of the cluster.
+
+    Returns:
+        A :py:class:`clusterdock.models.Cluster` instance with a ``primary_node`` attribute.
+    """
+    the_network = client.networks.get(network)
+    container_ids = list(nested_get(the_network.attrs, ['Containers']) or {})
+    if not container_ids:
+        raise Exception('Found no containers on network {}.'.format(network))
+    # The containers are inspected at the same time rather than one after the other.
+    with ThreadPoolExecutor(max_workers=len(container_ids)) as executor:
+        containers = list(executor.map(client.containers.get, container_ids))
+
+    group_order = [group for group, _ in NODE_GROUP_IMAGE_MARKERS]
+    nodes = sorted((node for node in (attach_node(container, network) for container in containers)
+                    if node.group),
+                   key=lambda node: (group_order.index(node.group), node.hostname))
+    cluster = Cluster(*nodes)
+    cluster.network = network
+
+    # Reuse the name of the running cluster so that any node started later gets the same label.
+    label = nested_get(containers[0].attrs,
+                       ['Config', 'Labels']).get(defaults.get('DEFAULT_DOCKER_LABEL_KEY'))
+    if label:
+        cluster.name = json.loads(label).get('cluster_name', cluster.name)
+
+    cluster.primary_node = next((node for node in cluster if node.group == 'primary'), None)
+    if not cluster.primary_node:
+        raise Exception('Found no primary node on network {}.'.format(network))
+    logger.debug('Attached to cluster %s (%s).',
+                 cluster.name, ', '.join(node.fqdn for node in cluster))
+    return cluster
+
+
+def wait_for_command(deployment, command_id, description, timeout=600):
+    """Wait for an asynchronous Cloudera Manager command to finish successfully.
+
+    Args:
+        deployment (:py:class:`ClouderaManagerDeployment`): The Cloudera Manager deployment.
+        command_id (:obj:`int`): The command ID.
+        description (:obj:`str`): What the command does, used in log and error messages.
+        timeout (:obj:`int`, optional): Seconds to wait before timing out. Default: ``600``
+    """
+    def condition(deployment, command_id):
+        command_information = deployment.api_client.get_command_information(command_id)
+        active = command_information.get('active')
+        success = command_information.get('success')
+        logger.debug('%s command: (active: %s, success: %s)', description, active, success)
+        if not active and not success:
+            raise Exception('Failed to {} ({}).'.format(description.lower(),
+                                                        command_information.get('resultMessage')))
+        return not active and success
+
+    def success(time):
+        logger.debug('%s command finished in %s seconds.', description, time)
+
+    def failure(timeout):
+        raise TimeoutError('Timed out after {} seconds waiting '
+                           'for {} command to finish.'.format(timeout, description.lower()))
+
+    wait_for_condition(condition=condition, condition_args=[deployment, command_id],
+                       time_between_checks=1, timeout=timeout, success=success, failure=failure)
+
+
+def wait_for_commands(deployment, command_ids, description, timeout=600, progress=None):
+    """Wait for several asynchronous Cloudera Manager commands running side by side.
+
+    Args:
+        deployment (:py:class:`ClouderaManagerDeployment`): The Cloudera Manager deployment.
+        command_ids (:obj:`list`): The command IDs.
+        description (:obj:`str`): What the commands do, used in log and error messages.
+        timeout (:obj:`int`, optional): Seconds to wait before timing out. Default: ``600``
+        progress (optional): Callable invoked after every check to log additional progress
+            information. Default: ``None``
+    """
+    pending_command_ids = set(command_ids)
+
+    def condition(deployment):
+        for command_id in list(pending_command_ids):
+            command_information = deployment.api_client.get_command_information(command_id)
+            if command_information.get('active'):
+                continue
+            if not command_information.get('success'):
+                raise Exception('Failed to {} ({}: {}).'.format(
+                    description.lower(), command_information.get('name'),
+                    command_information.get('resultMessage')
+                ))
+            pending_command_ids.remove(command_id)
+        logger.info('%s: %s of %s commands finished.', description,
+                    len(command_ids) - len(pending_command_ids), len(command_ids))
+        if progress is not None:
+            progress()
+        return not pending_command_ids
+
+    def success(time):
+        logger.debug('%s commands finished in %s seconds.', description, time)
+
+    def failure(timeout):
+        raise TimeoutError('Timed out after {} seconds waiting '
+                           'for {} commands to finish.'.format(timeout, description.lower()))
+
+    wait_for_condition(condition=condition, condition_args=[deployment],
+                       time_between_checks=3, timeout=timeout, success=success, failure=failure)
+
+
+def remove_node_from_etc_hosts(fqdn):
+    """Remove the entries of a node from the Docker host's /etc/hosts file, exploiting Docker's
+    permissions to do so without needing an explicit sudo.
+
+    Args:
+        fqdn (:obj:`str`): The FQDN of the node.
+    """
+    # Both the entries clusterdock adds itself and those of start.update_hosts_file are removed.
+    # We have to use echo to write to the file instead of sed -i because of how Docker volume
+    # mounts deal with inodes.
+    command = ['/bin/sh', '-c',
+               'echo "$(sed "/ {} .*# .*clusterdock/d" /etc/hosts)" > /etc/hosts'.format(
+                   fqdn.replace('.', '\\.')
+               )]
+    logger.debug('Removing any instances of %s from /etc/hosts ...', fqdn)
+    client.containers.run(image='alpine:latest',
+                          command=command,
+                          volumes={'/etc/hosts': {'bind': '/etc/hosts', 'mode': 'rw'}},
+                          remove=True)
+
+
+def remove_cluster(network):
+    """Remove a cluster altogether: its containers, their volumes, their /etc/hosts entries on
+    the Docker host and the network itself.
+
+    Args:
+        network (:obj:`str`): Docker network of the cluster.
+    """
+    try:
+        the_network = client.networks.get(network)
+    except docker.errors.NotFound:
+        logger.debug('Network %s does not exist.', network)
+        return
+
+    for container in the_network.containers:
+        container.reload()
+        fqdn = nested_get(container.attrs, ['Config', 'Hostname'])
+        volume_names = [mount['Name'] for mount in container.attrs.get('Mounts', [])
+                        if mount.get('Type') == 'volume']
+        logger.debug('Removing container of %s ...', fqdn)
+        container.remove(v=True, force=True)
+        # Named volumes (e.g. those of the volume storage backend) outlive their container.
+        for volume_name in volume_names:
+            try:
+                client.volumes.get(volume_name).remove(force=True)
+            except docker.errors.NotFound:
+                pass
+        remove_node_from_etc_hosts(fqdn)
+
+    # Docker's own host network stays.
+    if network != HOST_NETWORK:
+        logger.debug('Removing network %s ...', network)
+        the_network.remove()
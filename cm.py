@@ -28,26 +28,32 @@ class ClouderaManagerDeployment:
             :py:const:`DEFAULT_CM_USERNAME`
         password (:obj:`str`, optional): Cloudera Manager password. Default:
             :py:const:`DEFAULT_CM_PASSWORD`
+        cassette (:py:class:`cassette.Cassette`, optional): Cassette to record the API traffic to
+            or replay it from. Default: ``None``
     """
     def __init__(self,
                  server_url,
                  username=cm_api.DEFAULT_CM_USERNAME,
-                 password=cm_api.DEFAULT_CM_PASSWORD):
+                 password=cm_api.DEFAULT_CM_PASSWORD,
+                 cassette=None):
         self.api_client = cm_api.ApiClient(server_url=server_url,
                                            username=username,
-                                           password=password)
+                                           password=password,
+                                           cassette=cassette)
 
-    def get_all_hosts(self, view='summary'):
+    def get_all_hosts(self, view='summary', fields=None):
         """Get information about all the hosts in the deployment.
 
         Args:
             view (:obj:`str`, optional): The collection view. Could be ``summary`` or ``full``.
                 Default: ``summary``
+            fields (:obj:`list`, optional): Fields of each host to keep, with dots for nested
+                fields (e.g. ``hostRef.hostId``). Default: ``None`` (all of them)
 
         Returns:
             A list of dictionaries with each representing one host in the deployment.
         """
-        return self.api_client.get_all_hosts(view=view)['items']
+        return list(self.api_client.iter_all_hosts(view=view, fields=fields))
 
     def get_cluster_parcels(self, cluster_name, view='summary'):
         """Get a list of all parcels to which a cluster has access.
@@ -63,6 +69,27 @@ class ClouderaManagerDeployment:
         return self.api_client.get_cluster_parcels(cluster_name=cluster_name,
                                                    view=view)['items']
 
+    def get_timeseries(self, query, from_time, to_time, desired_rollup='RAW', fields=None):
+        """Run a tsquery against the time-series data of the deployment.
+
+        Args:
+            query (:obj:`str`): The tsquery.
+            from_time (:obj:`str`): Start of the period, as an ISO 8601 timestamp.
+            to_time (:obj:`str`): End of the period, as an ISO 8601 timestamp.
+            desired_rollup (:obj:`str`, optional): Aggregation level of the data. Default: ``RAW``
+            fields (:obj:`list`, optional): Fields of each time series to keep, with dots for nested
+                fields (e.g. ``metadata.metricName``). Default: ``None`` (all of them)
+
+        Returns:
+            An iterator of time series, each a dictionary with ``metadata`` and ``data``, parsed
+            one at a time as the response arrives.
+        """
+        return self.api_client.iter_timeseries(query=query,
+                                               from_time=from_time,
+                                               to_time=to_time,
+                                               desired_rollup=desired_rollup,
+                                               fields=fields)
+
     def get_regenerate_keytab_command(self):
 
         return self.api_client.get_regenerate_keytab_command()
@@ -78,6 +105,18 @@ class ClouderaManagerDeployment:
         """
         return self.api_client.get_cluster_parcel_usage(cluster_name=cluster_name)
 
+    def get_cluster_kerberos_info(self, cluster_name):
+        """Get the Kerberos configuration of a cluster.
+
+        Args:
+            cluster_name (:obj:`str`): The name of the cluster.
+
+        Returns:
+            A dictionary with whether the cluster is kerberized (``kerberized``), its realm
+            (``kerberosRealm``) and its KDC (``kdcHost``).
+        """
+        return self.api_client.get_cluster_kerberos_info(cluster_name=cluster_name)
+
     def refresh_parcel_repos(self):
         """Refresh parcel information.
 
@@ -130,6 +169,29 @@ class ClouderaManagerDeployment:
                 for host in self.api_client.add_cluster_hosts(cluster_name=cluster_name,
                                                               host_ref_list=host_ref_list)['items']]
 
+    def remove_cluster_host(self, cluster_name, host_id):
+        """Remove a host from the cluster.
+
+        Args:
+            cluster_name (:obj:`str`): The name of the cluster.
+            host_id (:obj:`str`): The host ID of the host.
+
+        Returns:
+            The removed host.
+        """
+        return self.api_client.remove_cluster_host(cluster_name=cluster_name, host_id=host_id)
+
+    def delete_host(self, host_id):
+        """Delete a host from the deployment.
+
+        Args:
+            host_id (:obj:`str`): The host ID of the host.
+
+        Returns:
+            The deleted host.
+        """
+        return self.api_client.delete_host(host_id=host_id)
+
     def create_cluster_services(self, cluster_name, services):
         """Create a list of services.
 
@@ -171,18 +233,36 @@ class ClouderaManagerDeployment:
         return self.api_client.delete_cluster_service(cluster_name=cluster_name,
                                                       service_name=service_name)
 
-    def get_service_roles(self, cluster_name, service_name):
+    def get_service_roles(self, cluster_name, service_name, fields=None):
         """Get a list of roles of a given service.
 
         Args:
             cluster_name (:obj:`str`): The name of the cluster.
             service_name (:obj:`str`): The name of the service.
+            fields (:obj:`list`, optional): Fields of each role to keep, with dots for nested
+                fields (e.g. ``hostRef.hostId``). Default: ``None`` (all of them)
 
         Returns:
             A list of the roles of the service.
         """
-        return self.api_client.get_service_roles(cluster_name=cluster_name,
-                                                 service_name=service_name)['items']
+        return list(self.api_client.iter_service_roles(cluster_name=cluster_name,
+                                                       service_name=service_name,
+                                                       fields=fields))
+
+    def delete_service_role(self, cluster_name, service_name, role_name):
+        """Delete a role of a given service.
+
+        Args:
+            cluster_name (:obj:`str`): The name of the cluster.
+            service_name (:obj:`str`): The name of the service.
+            role_name (:obj:`str`): The name of the role.
+
+        Returns:
+            The deleted role.
+        """
+        return self.api_client.delete_service_role(cluster_name=cluster_name,
+                                                   service_name=service_name,
+                                                   role_name=role_name)
 
     def get_service_role_config_groups(self, cluster_name, service_name):
         """Get a list of role config groups of a given service.
@@ -240,6 +320,23 @@ class ClouderaManagerDeployment:
                     view=view
                 )['items']}
 
+    def get_service_config(self, cluster_name, service_name, view='summary'):
+        """Get the service configuration.
+
+        Args:
+            cluster_name (:obj:`str`): The name of the cluster.
+            service_name (:obj:`str`): The name of the service.
+            view (:obj:`str`, optional): The collection view. Could be ``summary`` or ``full``.
+                Default: ``summary``
+
+        Returns:
+            A dictionary of the service configuration.
+        """
+        return {config['name']: config.get('value') or config.get('default')
+                for config in self.api_client.get_service_config(cluster_name=cluster_name,
+                                                                 service_name=service_name,
+                                                                 view=view)['items']}
+
     def update_service_config(self, cluster_name, service_name, configs):
         """Update the service configuration values.
 
@@ -364,6 +461,102 @@ class ClouderaManagerDeployment:
     def start_cluster_service_command(self, cluster_name, service_name, command):
         return self.api_client.start_cluster_service_command(cluster_name=cluster_name,service_name=service_name,command=command)
 
+    def start_service_roles(self, cluster_name, service_name, role_names):
+        """Start a list of roles of a service.
+
+        Args:
+            cluster_name (:obj:`str`): The name of the cluster.
+            service_name (:obj:`str`): The name of the service.
+            role_names (:obj:`list`): A list of names of the roles to start.
+
+        Returns:
+            A list of commands.
+        """
+        role_name_list = {'items': list(role_names)}
+        return self.api_client.start_service_roles(cluster_name=cluster_name,
+                                                   service_name=service_name,
+                                                   role_name_list=role_name_list)['items']
+
+    def stop_service_roles(self, cluster_name, service_name, role_names):
+        """Stop a list of roles of a service.
+
+        Args:
+            cluster_name (:obj:`str`): The name of the cluster.
+            service_name (:obj:`str`): The name of the service.
+            role_names (:obj:`list`): A list of names of the roles to stop.
+
+        Returns:
+            A list of commands.
+        """
+        role_name_list = {'items': list(role_names)}
+        return self.api_client.stop_service_roles(cluster_name=cluster_name,
+                                                  service_name=service_name,
+                                                  role_name_list=role_name_list)['items']
+
+    def restart_service_roles(self, cluster_name, service_name, role_names):
+        """Restart a list of roles of a service.
+
+        Args:
+            cluster_name (:obj:`str`): The name of the cluster.
+            service_name (:obj:`str`): The name of the service.
+            role_names (:obj:`list`): A list of names of the roles to restart.
+
+        Returns:
+            A list of commands.
+        """
+        role_name_list = {'items': list(role_names)}
+        return self.api_client.restart_service_roles(cluster_name=cluster_name,
+                                                     service_name=service_name,
+                                                     role_name_list=role_name_list)['items']
+
+    def refresh_service_roles(self, cluster_name, service_name, role_names):
+        """Refresh the configuration of a list of roles of a service without restarting them.
+
+        Args:
+            cluster_name (:obj:`str`): The name of the cluster.
+            service_name (:obj:`str`): The name of the service.
+            role_names (:obj:`list`): A list of names of the roles to refresh.
+
+        Returns:
+            A list of commands.
+        """
+        role_name_list = {'items': list(role_names)}
+        return self.api_client.refresh_service_roles(cluster_name=cluster_name,
+                                                     service_name=service_name,
+                                                     role_name_list=role_name_list)['items']
+
+    def deploy_service_client_config(self, cluster_name, service_name, role_names):
+        """Deploy the client configuration of a service to the hosts of a list of its roles.
+
+        Args:
+            cluster_name (:obj:`str`): The name of the cluster.
+            service_name (:obj:`str`): The name of the service.
+            role_names (:obj:`list`): A list of names of roles of the service.
+
+        Returns:
+            A command.
+        """
+        role_name_list = {'items': list(role_names)}
+        return self.api_client.deploy_service_client_config(cluster_name=cluster_name,
+                                                            service_name=service_name,
+                                                            role_name_list=role_name_list)
+
+    def decommission_service_roles(self, cluster_name, service_name, role_names):
+        """Decommission a list of roles of a service.
+
+        Args:
+            cluster_name (:obj:`str`): The name of the cluster.
+            service_name (:obj:`str`): The name of the service.
+            role_names (:obj:`list`): A list of names of the roles to decommission.
+
+        Returns:
+            A command.
+        """
+        role_name_list = {'items': list(role_names)}
+        return self.api_client.decommission_service_roles(cluster_name=cluster_name,
+                                                          service_name=service_name,
+                                                          role_name_list=role_name_list)
+
     def start_all_cluster_services(self, cluster_name):
         """Start all cluster services in the cluster.
 
@@ -402,3 +595,46 @@ class ClouderaManagerDeployment:
             A command.
         """
         return self.api_client.stop_cm_service()
+
+    def get_cm_service_roles(self, view='summary', fields=None):
+        """Get a list of the roles of the Cloudera Manager Services.
+
+        Args:
+            view (:obj:`str`, optional): The collection view. Could be ``summary`` or ``full``.
+                Default: ``summary``
+            fields (:obj:`list`, optional): Fields of each role to keep, with dots for nested
+                fields (e.g. ``hostRef.hostId``). Default: ``None`` (all of them)
+
+        Returns:
+            A list of the roles of the Cloudera Manager Services.
+        """
+        return list(self.api_client.iter_cm_service_roles(view=view, fields=fields))
+
+    def delete_cm_service_role(self, role_name):
+        """Delete a role of the Cloudera Manager Services.
+
+        Args:
+            role_name (:obj:`str`): The name of the role.
+
+        Returns:
+            The deleted role.
+        """
+        return self.api_client.delete_cm_service_role(role_name=role_name)
+
+    def update_cm_service_role_config_group_config(self, role_config_group_name, configs):
+        """Update the configuration values of a Cloudera Manager Services role config group.
+
+        Args:
+            role_config_group_name (:obj:`str`): The name of the role config group.
+            configs (:obj:`dict`): Configurations to update.
+
+        Returns:
+            A dictionary of the updated role config group configuration.
+        """
+        config_list = {
+            'items': [{'name': name, 'value': value}
+                      for name, value in configs.items()]
+        }
+        return self.api_client.update_cm_service_role_config_group_config(
+            role_config_group_name=role_config_group_name, config_list=config_list
+        )['items']
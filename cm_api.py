@@ -12,15 +12,23 @@
 # limitations under the License.
 import json
 import logging
+from contextlib import closing
+
 import requests
 
 from clusterdock.utils import join_url_parts
 
+from . import json_stream
+from .cassette import Cassette
+
 DEFAULT_CM_USERNAME = 'admin'  #:
 DEFAULT_CM_PASSWORD = 'admin'  #:
 
 REQUIRED_HEADERS = {'Content-Type': 'application/json'}
 
+# Size of the chunks in which list responses are read and parsed.
+STREAM_CHUNK_SIZE = 64 * 1024
+
 logger = logging.getLogger('clusterdock.{}'.format(__name__))
 
 
@@ -33,15 +41,22 @@ class ApiClient:
             :py:const:`DEFAULT_CM_USERNAME`
         password (:obj:`str`, optional): Cloudera Manager password. Default:
             :py:const:`DEFAULT_CM_PASSWORD`
+        cassette (:py:class:`cassette.Cassette`, optional): Cassette to record the API traffic to
+            or replay it from. Default: ``None`` (the one set with the ``CM_CASSETTE``
+            environment variable, if any)
     """
 
     def __init__(self,
                  server_url,
                  username=DEFAULT_CM_USERNAME,
-                 password=DEFAULT_CM_PASSWORD):
+                 password=DEFAULT_CM_PASSWORD,
+                 cassette=None):
         self.server_url = server_url
+        # Number of requests sent, e.g. for the run history to count them per phase.
+        self.request_count = 0
 
-        self.session = requests.Session()
+        cassette = cassette or Cassette.from_environment()
+        self.session = cassette.create_session(server_url) if cassette else requests.Session()
         self.session.auth = (username, password)
         self.session.headers.update(REQUIRED_HEADERS)
 
@@ -60,6 +75,21 @@ class ApiClient:
         return self._get(endpoint='{}/hosts'.format(self.api_version),
                          params=dict(view=view)).json()
 
+    def iter_all_hosts(self, view='summary', fields=None):
+        """Iterate over the hosts in the deployment as the response arrives.
+
+        Args:
+            view (:obj:`str`, optional): The collection view. Could be ``summary`` or ``full``.
+                Default: ``summary``
+            fields (:obj:`list`, optional): Fields of each host to keep, see
+                :py:func:`json_stream.project`. Default: ``None`` (all of them)
+
+        Yields:
+            A dictionary (host ref) for every host in the deployment.
+        """
+        return self._iter_items(endpoint='{}/hosts'.format(self.api_version),
+                                params=dict(view=view), fields=fields)
+
     def get_cluster_parcels(self, cluster_name, view='summary'):
         """Get a list of all parcels to which a cluster has access.
 
@@ -87,6 +117,19 @@ class ApiClient:
         return self._get(endpoint='{}/clusters/{}/parcels/usage'.format(self.api_version,
                                                                         cluster_name)).json()
 
+    def get_cluster_kerberos_info(self, cluster_name):
+        """Get the Kerberos configuration of a cluster.
+
+        Args:
+            cluster_name (:obj:`str`): The name of the cluster.
+
+        Returns:
+            A dictionary (Kerberos info) of whether the cluster is kerberized, its realm and its
+            KDC.
+        """
+        return self._get(endpoint='{}/clusters/{}/kerberosInfo'.format(self.api_version,
+                                                                       cluster_name)).json()
+
     def refresh_parcel_repos(self):
         """Refresh parcel information.
 
@@ -238,6 +281,32 @@ class ApiClient:
                                                                  cluster_name),
                           data=host_ref_list).json()
 
+    def remove_cluster_host(self, cluster_name, host_id):
+        """Remove a host from the cluster.
+
+        Args:
+            cluster_name (:obj:`str`): The name of the cluster.
+            host_id (:obj:`str`): The host ID of the host.
+
+        Returns:
+            A dictionary (host ref) of the removed host.
+        """
+        return self._delete(endpoint='{}/clusters/{}/hosts/{}'.format(self.api_version,
+                                                                      cluster_name,
+                                                                      host_id)).json()
+
+    def delete_host(self, host_id):
+        """Delete a host from the deployment.
+
+        Args:
+            host_id (:obj:`str`): The host ID of the host.
+
+        Returns:
+            A dictionary (host) of details of the deleted host.
+        """
+        return self._delete(endpoint='{}/hosts/{}'.format(self.api_version,
+                                                          host_id)).json()
+
     def create_cluster_services(self, cluster_name, service_list):
         """Create a list of services.
 
@@ -295,6 +364,38 @@ class ApiClient:
                                                                             cluster_name,
                                                                             service_name)).json()
 
+    def iter_service_roles(self, cluster_name, service_name, fields=None):
+        """Iterate over the roles of a given service as the response arrives.
+
+        Args:
+            cluster_name (:obj:`str`): The name of the cluster.
+            service_name (:obj:`str`): The name of the service.
+            fields (:obj:`list`, optional): Fields of each role to keep, see
+                :py:func:`json_stream.project`. Default: ``None`` (all of them)
+
+        Yields:
+            A dictionary (role) for every role of the service.
+        """
+        return self._iter_items(endpoint='{}/clusters/{}/services/{}/roles'.format(
+            self.api_version, cluster_name, service_name
+        ), fields=fields)
+
+    def delete_service_role(self, cluster_name, service_name, role_name):
+        """Delete a role of a given service.
+
+        Args:
+            cluster_name (:obj:`str`): The name of the cluster.
+            service_name (:obj:`str`): The name of the service.
+            role_name (:obj:`str`): The name of the role.
+
+        Returns:
+            A dictionary (role) of details of the deleted role.
+        """
+        return self._delete(endpoint='{}/clusters/{}/services/{}/roles/{}'.format(self.api_version,
+                                                                                  cluster_name,
+                                                                                  service_name,
+                                                                                  role_name)).json()
+
     def get_service_role_config_groups(self, cluster_name, service_name):
         """Get a list of role config groups of a given service.
 
@@ -351,6 +452,23 @@ class ApiClient:
                                                                         role_config_group_name),
                          data=config_list).json()
 
+    def get_service_config(self, cluster_name, service_name, view='summary'):
+        """Get the service configuration.
+
+        Args:
+            cluster_name (:obj:`str`): The name of the cluster.
+            service_name (:obj:`str`): The name of the service.
+            view (:obj:`str`, optional): The collection view. Could be ``summary`` or ``full``.
+                Default: ``summary``
+
+        Returns:
+            A dictionary (service config) of the service configuration.
+        """
+        return self._get(endpoint='{}/clusters/{}/services/{}/config'.format(self.api_version,
+                                                                             cluster_name,
+                                                                             service_name),
+                         params={'view': view}).json()
+
     def update_service_config(self, cluster_name, service_name, service_config):
         """Update the service configuration values.
 
@@ -491,6 +609,108 @@ class ApiClient:
                                                                                    cluster_name, service_name,
                                                                                    command)).json()
 
+    def start_service_roles(self, cluster_name, service_name, role_name_list):
+        """Start a list of roles of a service.
+
+        Args:
+            cluster_name (:obj:`str`): The name of the cluster.
+            service_name (:obj:`str`): The name of the service.
+            role_name_list (:obj:`dict`)
+
+        Returns:
+            A dictionary (bulk command response) of the submitted commands.
+        """
+        return self._post(endpoint=('{}/clusters/{}/services/{}/'
+                                    'roleCommands/start').format(self.api_version,
+                                                                 cluster_name,
+                                                                 service_name),
+                          data=role_name_list).json()
+
+    def stop_service_roles(self, cluster_name, service_name, role_name_list):
+        """Stop a list of roles of a service.
+
+        Args:
+            cluster_name (:obj:`str`): The name of the cluster.
+            service_name (:obj:`str`): The name of the service.
+            role_name_list (:obj:`dict`)
+
+        Returns:
+            A dictionary (bulk command response) of the submitted commands.
+        """
+        return self._post(endpoint=('{}/clusters/{}/services/{}/'
+                                    'roleCommands/stop').format(self.api_version,
+                                                                cluster_name,
+                                                                service_name),
+                          data=role_name_list).json()
+
+    def restart_service_roles(self, cluster_name, service_name, role_name_list):
+        """Restart a list of roles of a service.
+
+        Args:
+            cluster_name (:obj:`str`): The name of the cluster.
+            service_name (:obj:`str`): The name of the service.
+            role_name_list (:obj:`dict`)
+
+        Returns:
+            A dictionary (bulk command response) of the submitted commands.
+        """
+        return self._post(endpoint=('{}/clusters/{}/services/{}/'
+                                    'roleCommands/restart').format(self.api_version,
+                                                                   cluster_name,
+                                                                   service_name),
+                          data=role_name_list).json()
+
+    def refresh_service_roles(self, cluster_name, service_name, role_name_list):
+        """Refresh the configuration of a list of roles of a service without restarting them.
+
+        Args:
+            cluster_name (:obj:`str`): The name of the cluster.
+            service_name (:obj:`str`): The name of the service.
+            role_name_list (:obj:`dict`)
+
+        Returns:
+            A dictionary (bulk command response) of the submitted commands.
+        """
+        return self._post(endpoint=('{}/clusters/{}/services/{}/'
+                                    'roleCommands/refresh').format(self.api_version,
+                                                                   cluster_name,
+                                                                   service_name),
+                          data=role_name_list).json()
+
+    def deploy_service_client_config(self, cluster_name, service_name, role_name_list):
+        """Deploy the client configuration of a service to the hosts of a list of its roles.
+
+        Args:
+            cluster_name (:obj:`str`): The name of the cluster.
+            service_name (:obj:`str`): The name of the service.
+            role_name_list (:obj:`dict`)
+
+        Returns:
+            A dictionary (command) of the submitted command.
+        """
+        return self._post(endpoint=('{}/clusters/{}/services/{}/'
+                                    'commands/deployClientConfig').format(self.api_version,
+                                                                          cluster_name,
+                                                                          service_name),
+                          data=role_name_list).json()
+
+    def decommission_service_roles(self, cluster_name, service_name, role_name_list):
+        """Decommission a list of roles of a service.
+
+        Args:
+            cluster_name (:obj:`str`): The name of the cluster.
+            service_name (:obj:`str`): The name of the service.
+            role_name_list (:obj:`dict`)
+
+        Returns:
+            A dictionary (command) of the submitted command.
+        """
+        return self._post(endpoint=('{}/clusters/{}/services/{}/'
+                                    'commands/decommission').format(self.api_version,
+                                                                    cluster_name,
+                                                                    service_name),
+                          data=role_name_list).json()
+
     def get_cm_service(self, view='summary'):
         """Get Cloudera Manager Services service.
 
@@ -520,6 +740,102 @@ class ApiClient:
         """
         return self._post(endpoint='{}/cm/service/commands/stop'.format(self.api_version)).json()
 
+    def get_cm_service_roles(self, view='summary'):
+        """Get a list of the roles of the Cloudera Manager Services.
+
+        Args:
+            view (:obj:`str`, optional): The collection view. Could be ``summary`` or ``full``.
+                Default: ``summary``
+
+        Returns:
+            A dictionary (role list) of the roles of the Cloudera Manager Services.
+        """
+        return self._get(endpoint='{}/cm/service/roles'.format(self.api_version),
+                         params=dict(view=view)).json()
+
+    def iter_cm_service_roles(self, view='summary', fields=None):
+        """Iterate over the roles of the Cloudera Manager Services as the response arrives.
+
+        Args:
+            view (:obj:`str`, optional): The collection view. Could be ``summary`` or ``full``.
+                Default: ``summary``
+            fields (:obj:`list`, optional): Fields of each role to keep, see
+                :py:func:`json_stream.project`. Default: ``None`` (all of them)
+
+        Yields:
+            A dictionary (role) for every role of the Cloudera Manager Services.
+        """
+        return self._iter_items(endpoint='{}/cm/service/roles'.format(self.api_version),
+                                params=dict(view=view), fields=fields)
+
+    def delete_cm_service_role(self, role_name):
+        """Delete a role of the Cloudera Manager Services.
+
+        Args:
+            role_name (:obj:`str`): The name of the role.
+
+        Returns:
+            A dictionary (role) of details of the deleted role.
+        """
+        return self._delete(endpoint='{}/cm/service/roles/{}'.format(self.api_version,
+                                                                     role_name)).json()
+
+    def update_cm_service_role_config_group_config(self, role_config_group_name, config_list):
+        """Update the configuration values of a Cloudera Manager Services role config group.
+
+        Args:
+            role_config_group_name (:obj:`str`): The name of the role config group.
+            config_list (:obj:`dict`)
+
+        Returns:
+            A dictionary (config list) of the updated role config group configuration.
+        """
+        return self._put(endpoint=('{}/cm/service/'
+                                   'roleConfigGroups/{}/config').format(self.api_version,
+                                                                        role_config_group_name),
+                         data=config_list).json()
+
+    def get_timeseries(self, query, from_time, to_time, desired_rollup='RAW'):
+        """Run a tsquery against the time-series data of the deployment.
+
+        Args:
+            query (:obj:`str`): The tsquery.
+            from_time (:obj:`str`): Start of the period, as an ISO 8601 timestamp.
+            to_time (:obj:`str`): End of the period, as an ISO 8601 timestamp.
+            desired_rollup (:obj:`str`, optional): Aggregation level of the data. Default: ``RAW``
+
+        Returns:
+            A dictionary (time series response list) of the query results.
+        """
+        return self._get(endpoint='{}/timeseries'.format(self.api_version),
+                         params={'query': query,
+                                 'from': from_time,
+                                 'to': to_time,
+                                 'desiredRollup': desired_rollup}).json()
+
+    def iter_timeseries(self, query, from_time, to_time, desired_rollup='RAW', fields=None):
+        """Iterate over the time series of a tsquery as the response arrives.
+
+        Args:
+            query (:obj:`str`): The tsquery.
+            from_time (:obj:`str`): Start of the period, as an ISO 8601 timestamp.
+            to_time (:obj:`str`): End of the period, as an ISO 8601 timestamp.
+            desired_rollup (:obj:`str`, optional): Aggregation level of the data. Default: ``RAW``
+            fields (:obj:`list`, optional): Fields of each time series to keep, see
+                :py:func:`json_stream.project`. Default: ``None`` (all of them)
+
+        Yields:
+            A dictionary (time series) with ``metadata`` and ``data`` for every time series of
+            every response of the query.
+        """
+        return self._iter_items(endpoint='{}/timeseries'.format(self.api_version),
+                                params={'query': query,
+                                        'from': from_time,
+                                        'to': to_time,
+                                        'desiredRollup': desired_rollup},
+                                path=('items', json_stream.EVERY_ITEM, 'timeSeries'),
+                                fields=fields)
+
     def get_regenerate_keytab_command(self):
         return self._get(endpoint='{}/cm/commands/HostsRegenerateKeytab'.format(self.api_version)).json()
 
@@ -543,15 +859,27 @@ class ApiClient:
             logger.info('Detected CM API %s.', api_version)
             return api_version
 
-    def _get(self, endpoint, params=None):
+    def _get(self, endpoint, params=None, stream=False):
         url = join_url_parts(self.server_url, '/api', endpoint)
         logger.debug('Sending GET request to URL (%s) with parameters (%s) ...',
                      url,
                      params or 'None')
-        response = self.session.get(url, params=params or {})
+        self.request_count += 1
+        response = self.session.get(url, params=params or {}, stream=stream)
         response.raise_for_status()
         return response
 
+    def _iter_items(self, endpoint, params=None, path=('items',), fields=None):
+        # The response is parsed as it is read, one item at a time, and every item is projected
+        # before the next one is parsed, so that neither the body nor all the items are held.
+        with closing(self._get(endpoint=endpoint, params=params, stream=True)) as response:
+            # CM doesn't name the charset of its JSON responses.
+            response.encoding = response.encoding or 'utf-8'
+            for item in json_stream.iter_items(response.iter_content(chunk_size=STREAM_CHUNK_SIZE,
+                                                                     decode_unicode=True),
+                                               path=path):
+                yield json_stream.project(item, fields) if fields else item
+
     def _post(self, endpoint, params=None, data=None):
         url = join_url_parts(self.server_url, '/api', endpoint)
         data = json.dumps(data)
@@ -559,6 +887,7 @@ class ApiClient:
                      url,
                      params or 'None',
                      data or 'None')
+        self.request_count += 1
         response = self.session.post(url, params=params or {}, data=data)
         response.raise_for_status()
         return response
@@ -570,6 +899,7 @@ class ApiClient:
                      url,
                      params or 'None',
                      data or 'None')
+        self.request_count += 1
         response = self.session.delete(url, params=params or {}, data=data)
         response.raise_for_status()
         return response
@@ -581,6 +911,7 @@ class ApiClient:
                      url,
                      params or 'None',
                      data or 'None')
+        self.request_count += 1
         response = self.session.put(url, params=params or {}, data=data)
         response.raise_for_status()
         return response
@@ -16,11 +16,28 @@
 import json
 import logging
 import os
+from datetime import datetime, timezone
 from time import sleep, time
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# CM reports timestamps like 2017-08-01T12:34:56.789Z.
+CM_TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+
+def parse_cm_timestamp(timestamp):
+    """Parse a CM timestamp into a timezone-aware datetime (in UTC)."""
+    # Timestamps on whole seconds may come without the fraction.
+    if '.' not in timestamp:
+        timestamp = timestamp.replace('Z', '.000Z')
+    return datetime.strptime(timestamp, CM_TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc)
+
+
+def format_cm_timestamp(timestamp):
+    """Format seconds since the epoch as a CM timestamp."""
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime(CM_TIMESTAMP_FORMAT)
+
 
 def add_hosts_to_cluster(api, cluster, all_fqdns, secondary_nodes, edge_nodes):
     """Add all CM hosts to cluster."""
@@ -28,32 +45,26 @@ def add_hosts_to_cluster(api, cluster, all_fqdns, secondary_nodes, edge_nodes):
     # Wait up to 60 seconds for CM to see all hosts.
     TIMEOUT_IN_SECS = 60
     TIMEOUT_TIME = time() + TIMEOUT_IN_SECS
+    expected_fqdns = set(all_fqdns)
     while time() < TIMEOUT_TIME:
         all_hosts = api.get_all_hosts()
-        # Once hostname changes have propagated through CM, we switch all_hosts to be a list of
-        # hostIds (since that's what CM uses).
-        if set([host.hostname for host in all_hosts]) == set(all_fqdns):
-            all_hosts = [host.hostId for host in all_hosts]
+        if set(host.hostname for host in all_hosts) >= expected_fqdns:
             break
         sleep(1)
     else:
         raise Exception("Timed out waiting for CM to recognize all hosts (saw: {0}).".format(
-            ', '.join(all_hosts)
+            ', '.join(host.hostname for host in all_hosts)
         ))
 
-    hosts_in_cluster = [host.hostId for host in cluster.list_hosts()]
-    # Use Set.difference to get all_hosts - hosts_in_cluster.
-    hosts_ids_to_add = list(set(all_hosts).difference(hosts_in_cluster))
-
-    secondary_host_ids_to_add = []
-    edge_host_ids_to_add = []
-
-    for cluster_node in api.get_all_hosts():
-        if cluster_node.hostId in hosts_ids_to_add and cluster_node.hostname in [node.fqdn for node in secondary_nodes]:
-            secondary_host_ids_to_add.append(cluster_node.hostId)
+    # The last listing already has everything needed, so hosts are indexed from it instead of
+    # being listed again.
+    host_ids_by_fqdn = {host.hostname: host.hostId for host in all_hosts}
+    hosts_in_cluster = set(host.hostId for host in cluster.list_hosts())
 
-        if cluster_node.hostId in hosts_ids_to_add and cluster_node.hostname in [node.fqdn for node in edge_nodes]:
-            edge_host_ids_to_add.append(cluster_node.hostId)
+    secondary_host_ids_to_add = [host_ids_by_fqdn[node.fqdn] for node in secondary_nodes
+                                 if host_ids_by_fqdn[node.fqdn] not in hosts_in_cluster]
+    edge_host_ids_to_add = [host_ids_by_fqdn[node.fqdn] for node in edge_nodes
+                            if host_ids_by_fqdn[node.fqdn] not in hosts_in_cluster]
 
     secondary_node_template = get_host_template(api=api, cluster=cluster, filename='secondary.json', name='secondary')
     edge_node_template = get_host_template(api=api, cluster=cluster, filename='edge.json', name='edge')
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The metadata database of a cluster on a node of its own.
+
+The database image is built from the primary image, so its embedded PostgreSQL holds the same
+databases (those of CM, the Cloudera Management Service, Hive, Oozie, Hue and Sentry) with the
+same passwords. Once it's tuned, Cloudera Manager and the services are pointed at it and the
+primary node's own copy is stopped. The services connect through PgBouncer, which keeps their
+connections to PostgreSQL open between sessions.
+"""
+
+import logging
+import shlex
+from collections import OrderedDict
+
+from . import cluster_utils
+
+logger = logging.getLogger('clusterdock.{}'.format(__name__))
+
+DATABASE_PORT = 7432
+POOLER_PORT = 6432
+
+DATA_DIR = '/var/lib/cloudera-scm-server-db/data'
+POSTGRESQL_CONF_PATH = '{}/postgresql.conf'.format(DATA_DIR)
+PG_HBA_CONF_PATH = '{}/pg_hba.conf'.format(DATA_DIR)
+# Included from postgresql.conf, so that settings of a later start replace those of this one.
+TUNING_CONF_NAME = 'clusterdock.conf'
+CM_DB_PROPERTIES_PATH = '/etc/cloudera-scm-server/db.properties'
+PGBOUNCER_CONFIG_PATH = '/etc/pgbouncer/pgbouncer.ini'
+PGBOUNCER_USERLIST_PATH = '/etc/pgbouncer/userlist.txt'
+
+DEFAULT_SHARED_BUFFERS = '512MB'
+DEFAULT_MAX_CONNECTIONS = 300
+DEFAULT_POOL_SIZE = 20
+
+# Settings of PostgreSQL 8.4 (the version of CentOS 6) for many small transactions of a handful
+# of metadata stores.
+TUNED_SETTINGS = OrderedDict([
+    ('work_mem', '8MB'),
+    ('maintenance_work_mem', '128MB'),
+    ('wal_buffers', '16MB'),
+    ('checkpoint_segments', '32'),
+    ('checkpoint_completion_target', '0.9'),
+    ('random_page_cost', '2.0'),
+])
+
+# ``fast`` trades the database of a cluster for speed if its node crashes, which is fine for a
+# cluster that's thrown away anyway.
+DURABILITY_SETTINGS = {
+    'safe': OrderedDict([('fsync', 'on'),
+                         ('synchronous_commit', 'on'),
+                         ('full_page_writes', 'on')]),
+    'fast': OrderedDict([('fsync', 'off'),
+                         ('synchronous_commit', 'off'),
+                         ('full_page_writes', 'off')]),
+}
+
+# The CM embedded database's superuser, whose generated password is kept in the data directory.
+PSQL_COMMAND = ('PGPASSWORD=$(head -1 {}/generated_password.txt) '
+                'psql -A -t -d scm -U cloudera-scm -h localhost -p {}'.format(DATA_DIR,
+                                                                             DATABASE_PORT))
+USERLIST_QUERY = """SELECT '"' || usename || '" "' || passwd || '"' FROM pg_shadow"""
+# Clients on other nodes log in with passwords.
+PG_HBA_REMOTE_MD5_LINE = 'host all all 0.0.0.0/0 md5'
+
+
+def get_settings(shared_buffers=DEFAULT_SHARED_BUFFERS, max_connections=DEFAULT_MAX_CONNECTIONS,
+                 durability='fast'):
+    """Get the PostgreSQL settings of a database node.
+
+    Args:
+        shared_buffers (:obj:`str`, optional): Memory for PostgreSQL's buffer cache, e.g.
+            ``1GB``. Default: :py:const:`DEFAULT_SHARED_BUFFERS`
+        max_connections (:obj:`int`, optional): Connections PostgreSQL accepts.
+            Default: :py:const:`DEFAULT_MAX_CONNECTIONS`
+        durability (:obj:`str`, optional): ``safe`` or ``fast``. Default: ``fast``
+
+    Returns:
+        An :py:class:`collections.OrderedDict` of setting names mapped to values.
+    """
+    if durability not in DURABILITY_SETTINGS:
+        raise ValueError('Unknown durability {} (expected one of {}).'.format(
+            durability, ', '.join(sorted(DURABILITY_SETTINGS))
+        ))
+    settings = OrderedDict([('listen_addresses', "'*'"),
+                            ('max_connections', str(max_connections)),
+                            ('shared_buffers', shared_buffers)])
+    settings.update(TUNED_SETTINGS)
+    settings.update(DURABILITY_SETTINGS[durability])
+    return settings
+
+
+def configure_database_node(database_node, settings, pool_size=DEFAULT_POOL_SIZE):
+    """Tune the PostgreSQL of a database node, restart it and start PgBouncer in front of it.
+
+    Args:
+        database_node (:py:class:`clusterdock.models.Node`): The database node.
+        settings (:obj:`dict`): PostgreSQL setting names mapped to values, see
+            :py:func:`get_settings`.
+        pool_size (:obj:`int`, optional): Server connections PgBouncer keeps per database and
+            user, with ``0`` for no PgBouncer. Default: :py:const:`DEFAULT_POOL_SIZE`
+    """
+    logger.info('Tuning PostgreSQL on %s (%s) ...', database_node.fqdn,
+                ', '.join('{}={}'.format(name, value) for name, value in settings.items()))
+    database_node.put_file('{}/{}'.format(DATA_DIR, TUNING_CONF_NAME),
+                           ''.join('{} = {}\n'.format(name, value)
+                                   for name, value in settings.items()))
+    cluster_utils.execute(database_node, 'chown cloudera-scm:cloudera-scm {}/{}'.format(
+        DATA_DIR, TUNING_CONF_NAME
+    ))
+    cluster_utils.execute(database_node, _append_line_command(
+        line="include '{}'".format(TUNING_CONF_NAME), path=POSTGRESQL_CONF_PATH
+    ))
+    cluster_utils.execute(database_node, _append_line_command(line=PG_HBA_REMOTE_MD5_LINE,
+                                                              path=PG_HBA_CONF_PATH))
+    cluster_utils.execute(database_node, 'service cloudera-scm-server-db restart')
+
+    if not pool_size:
+        return
+    logger.info('Starting PgBouncer on %s (pool size %s) ...', database_node.fqdn, pool_size)
+    # PgBouncer authenticates clients against the MD5 hashes of PostgreSQL's own roles, which
+    # it then logs in to PostgreSQL with.
+    userlist = cluster_utils.execute(database_node,
+                                     "{} <<'SQL'\n{};\nSQL".format(PSQL_COMMAND, USERLIST_QUERY))
+    database_node.put_file(PGBOUNCER_USERLIST_PATH, userlist)
+    database_node.put_file(PGBOUNCER_CONFIG_PATH, _get_pgbouncer_config(pool_size))
+    cluster_utils.execute(database_node,
+                          'chown pgbouncer:pgbouncer {0} {1} && chmod 600 {1} '
+                          '&& service pgbouncer restart'.format(PGBOUNCER_CONFIG_PATH,
+                                                                PGBOUNCER_USERLIST_PATH))
+
+
+def move_cm_database(primary_node, database_node):
+    """Point the Cloudera Manager server at the database node and stop the primary node's
+    embedded PostgreSQL.
+
+    CM keeps a pool of connections of its own, so it connects to PostgreSQL directly.
+
+    Args:
+        primary_node (:py:class:`clusterdock.models.Node`): The primary node (running the CM
+            server).
+        database_node (:py:class:`clusterdock.models.Node`): The database node.
+    """
+    logger.info('Moving the Cloudera Manager database to %s ...', database_node.fqdn)
+    cluster_utils.execute(primary_node,
+                          'service cloudera-scm-server stop; '
+                          'service cloudera-scm-server-db stop && '
+                          'chkconfig cloudera-scm-server-db off && '
+                          "sed -i 's/^com.cloudera.cmf.db.host=.*/com.cloudera.cmf.db.host={}:{}/' "
+                          '{} && service cloudera-scm-server start'.format(database_node.fqdn,
+                                                                           DATABASE_PORT,
+                                                                           CM_DB_PROPERTIES_PATH))
+
+
+def get_service_endpoint(database_node, pool_size=DEFAULT_POOL_SIZE):
+    """Get the host and port at which the services reach their metadata databases.
+
+    Args:
+        database_node (:py:class:`clusterdock.models.Node`): The database node.
+        pool_size (:obj:`int`, optional): PgBouncer's pool size, with ``0`` for no pooling.
+            Default: :py:const:`DEFAULT_POOL_SIZE`
+
+    Returns:
+        A :obj:`tuple` of the host FQDN and the port.
+    """
+    return database_node.fqdn, POOLER_PORT if pool_size else DATABASE_PORT
+
+
+def _append_line_command(line, path):
+    return "grep -qxF {0} {1} || echo {0} >> {1}".format(shlex.quote(line), path)
+
+
+def _get_pgbouncer_config(pool_size):
+    # Session pooling, since the JDBC drivers of the services rely on prepared statements
+    # and session state. extra_float_digits is a startup parameter the JDBC driver sends.
+    return '\n'.join([
+        '[databases]',
+        '* = host=127.0.0.1 port={}'.format(DATABASE_PORT),
+        '',
+        '[pgbouncer]',
+        'listen_addr = *',
+        'listen_port = {}'.format(POOLER_PORT),
+        'auth_type = md5',
+        'auth_file = {}'.format(PGBOUNCER_USERLIST_PATH),
+        'pool_mode = session',
+        'default_pool_size = {}'.format(pool_size),
+        'max_client_conn = 1000',
+        'server_reset_query = DISCARD ALL',
+        'ignore_startup_parameters = extra_float_digits',
+        'logfile = /var/log/pgbouncer/pgbouncer.log',
+        'pidfile = /var/run/pgbouncer/pgbouncer.pid',
+        '',
+    ])
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Copy files to many nodes at once.
+
+Every node gets all of its files in a single tar archive, and all nodes get theirs at the same
+time. Files whose content already matches on a node are left out of its archive.
+"""
+
+import hashlib
+import io
+import logging
+import tarfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger('clusterdock.{}'.format(__name__))
+
+
+def distribute(nodes, files, mode=0o644, skip_unchanged=True):
+    """Copy files to nodes.
+
+    Args:
+        nodes (:obj:`list`): A list of :py:class:`clusterdock.models.Node` instances, e.g. the
+            nodes of a :py:class:`clusterdock.models.NodeGroup`.
+        files (:obj:`dict`): Absolute paths on the nodes mapped to the content of the files
+            (:obj:`str` or :obj:`bytes`) or to a rendering hook. A hook is called with the node
+            and returns the content for that node, or ``None`` to leave the file out.
+        mode (:obj:`int`, optional): Permissions of the files. Default: ``0o644``
+        skip_unchanged (:obj:`bool`, optional): Compare content hashes first and leave out files
+            that already match. Default: ``True``
+
+    Returns:
+        A :obj:`dict` of node FQDNs mapped to lists of the paths that were written.
+    """
+    nodes = list(nodes)
+    if not nodes or not files:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(nodes)) as executor:
+        written_paths = executor.map(lambda node: _distribute_to_node(node, files, mode,
+                                                                       skip_unchanged),
+                                     nodes)
+        return {node.fqdn: paths for node, paths in zip(nodes, written_paths)}
+
+
+def _distribute_to_node(node, files, mode, skip_unchanged):
+    contents = {}
+    for path, content in files.items():
+        if callable(content):
+            content = content(node)
+        if content is not None:
+            contents[path] = content.encode() if isinstance(content, str) else content
+
+    if skip_unchanged and contents:
+        # One sha256sum for all files; those missing on the node simply do not show up.
+        result = node.execute('sha256sum -- {} 2>/dev/null'.format(' '.join(sorted(contents))),
+                              quiet=True)
+        node_hashes = {path: content_hash
+                       for content_hash, path in (line.split(None, 1)
+                                                  for line in result.output.splitlines()
+                                                  if line.strip())}
+        contents = {path: content for path, content in contents.items()
+                    if node_hashes.get(path) != hashlib.sha256(content).hexdigest()}
+
+    if contents:
+        logger.debug('Copying %s to %s ...', ', '.join(sorted(contents)), node.fqdn)
+        node.container.put_archive('/', _create_archive(contents, mode))
+    return sorted(contents)
+
+
+def _create_archive(contents, mode):
+    archive = io.BytesIO()
+    with tarfile.open(fileobj=archive, mode='w') as tar:
+        for path, content in sorted(contents.items()):
+            tarinfo = tarfile.TarInfo(name=path.lstrip('/'))
+            tarinfo.size = len(content)
+            tarinfo.mode = mode
+            tarinfo.mtime = time.time()
+            tar.addfile(tarinfo, io.BytesIO(content))
+    return archive.getvalue()
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import logging
+import re
+from collections import defaultdict
+
+from clusterdock.models import Node
+from clusterdock.utils import wait_for_condition
+
+from . import cluster_utils, extras, kerberos, storage
+from .cm import ClouderaManagerDeployment
+from .distribute import distribute
+from .hosts import HostRegistry
+from .networking import HOST_NETWORK
+from .start import (DEFAULT_CLUSTER_NAME, HOST_TEMPLATE_NAMES, prepare_nodes,
+                    prepare_secondary_nodes, regenerate_keytabs, remove_cloned_identities,
+                    update_hosts_file)
+
+logger = logging.getLogger('clusterdock.{}'.format(__name__))
+
+# Hostname prefixes of the nodes of each node group that can be added later on.
+HOSTNAME_PREFIXES = {'secondary': 'node', 'edge': 'edge'}
+
+
+def main(args):
+    cluster = cluster_utils.attach_cluster(args.network)
+    if cluster.network == HOST_NETWORK:
+        raise Exception('Cannot add nodes to a cluster in host network mode.')
+    primary_node = cluster.primary_node
+    secondary_nodes = [node for node in cluster if node.group == 'secondary']
+
+    # New secondary nodes get the storage backend of the running ones.
+    secondary_storage = (storage.get_storage_backend(secondary_nodes[0]) if secondary_nodes
+                         else storage.parse_storage_backend(None))
+    new_secondary_nodes = _create_nodes(cluster, group='secondary', count=args.secondaries,
+                                        storage_backend=secondary_storage)
+    new_nodes = new_secondary_nodes + _create_nodes(cluster, group='edge', count=args.edges)
+    if not new_nodes:
+        logger.warning('No nodes to add. Use --secondaries and/or --edges.')
+        return
+
+    logger.info('Starting nodes (%s) ...', ', '.join(node.hostname for node in new_nodes))
+    for node in new_nodes:
+        node.start(cluster.network, cluster_name=cluster.name)
+
+    prepare_nodes(primary_node=primary_node, nodes=new_nodes)
+
+    # The new secondary nodes are set up the way start sets up those a cluster starts with.
+    placement = extras.get_running_placement(secondary_nodes, new_nodes=new_secondary_nodes)
+    kerberos_realm = kerberos.get_realm(primary_node)
+    prepare_secondary_nodes(secondary_nodes=new_secondary_nodes,
+                            placement=placement,
+                            secondary_storage=secondary_storage,
+                            zookeeper_quorum=primary_node.fqdn,
+                            kerberos_realm=kerberos_realm)
+
+    # Nodes started from the secondary image carry the CM agent UUID and DataNode storage of
+    # the image, which would clash with the running secondary nodes.
+    remove_cloned_identities(nodes=new_nodes, secondary_storage=secondary_storage)
+
+    cluster.nodes = tuple(cluster.nodes) + tuple(new_nodes)
+    if args.change_hostfile:
+        update_hosts_file(cluster)
+
+    logger.info('Configuring Kerberos clients ...')
+    distribute(new_nodes, {kerberos.KRB5_CONF_PATH: primary_node.get_file(kerberos.KRB5_CONF_PATH)})
+    kerberos.copy_keytab(primary_node=primary_node, nodes=new_nodes)
+
+    logger.info('Restarting Cloudera Manager agents on new nodes ...')
+    for node in new_nodes:
+        node.execute('service cloudera-scm-agent restart', quiet=True)
+
+    deployment = ClouderaManagerDeployment(cluster_utils.get_server_url(primary_node))
+
+    hosts = HostRegistry(deployment, new_nodes)
+    hosts.wait_for_hosts()
+    host_ids = hosts.get_host_ids()
+
+    logger.info('Regenerating keytabs of new hosts ...')
+    regenerate_keytabs(cluster, primary_node, deployment, host_ids=host_ids)
+
+    logger.info('Adding hosts to cluster ...')
+    deployment.add_cluster_hosts(cluster_name=DEFAULT_CLUSTER_NAME, host_ids=host_ids)
+    _wait_for_cdh_parcel_on_all_hosts(deployment=deployment, cluster_name=DEFAULT_CLUSTER_NAME)
+
+    for group, host_template_name in HOST_TEMPLATE_NAMES.items():
+        group_host_ids = hosts.get_host_ids(group=group)
+        if group_host_ids:
+            logger.info('Applying %s host template ...', host_template_name)
+            command = deployment.apply_host_template(cluster_name=DEFAULT_CLUSTER_NAME,
+                                                     host_template_name=host_template_name,
+                                                     start_roles=False,
+                                                     host_ids=group_host_ids)
+            cluster_utils.wait_for_command(deployment, command['id'],
+                                           'Apply {} host template'.format(host_template_name))
+
+    logger.info('Starting roles on new hosts ...')
+    _start_host_roles(deployment=deployment, cluster_name=DEFAULT_CLUSTER_NAME,
+                      host_ids=host_ids)
+
+    if any(node.group == 'edge' for node in new_nodes):
+        logger.info('Deploying client config ...')
+        command = deployment.deploy_cluster_client_config(cluster_name=DEFAULT_CLUSTER_NAME)
+        cluster_utils.wait_for_command(deployment, command['id'], 'Deploy client config')
+
+    logger.info('Kinit cloudera-scm/admin ...')
+    kerberos.kinit(new_nodes)
+
+    logger.info('Executing post run script ...')
+    for node in new_nodes:
+        node.execute('/root/post_run.sh')
+    extras.configure_grafana_datasource(placement=placement, nodes=new_secondary_nodes)
+
+    logger.info('Added %s to the cluster.', ', '.join(node.fqdn for node in new_nodes))
+
+
+def _create_nodes(cluster, group, count, storage_backend=None):
+    group_nodes = [node for node in cluster if node.group == group]
+    if group_nodes:
+        image = group_nodes[0].image
+    else:
+        image = cluster.primary_node.image.replace('cdh-cm-primary-',
+                                                   'cdh-cm-{}-'.format(group))
+
+    prefix = HOSTNAME_PREFIXES[group]
+    used_indices = [int(match.group(1))
+                    for match in (re.match(r'{}-(\d+)$'.format(prefix), node.hostname)
+                                  for node in cluster)
+                    if match]
+    first_index = max(used_indices, default=0) + 1
+    hostnames = ['{}-{}'.format(prefix, index) for index in range(first_index, first_index + count)]
+    return [Node(hostname=hostname, group=group, image=image,
+                 volumes=(storage.get_node_volumes(storage_backend, hostname, cluster.network)
+                          if storage_backend else []))
+            for hostname in hostnames]
+
+
+def _wait_for_cdh_parcel_on_all_hosts(deployment, cluster_name):
+    def condition(deployment, cluster_name):
+        for parcel in deployment.get_cluster_parcels(cluster_name=cluster_name, view='full'):
+            if parcel['product'] == 'CDH' and parcel['stage'] == 'ACTIVATED':
+                # While an activated parcel is distributed to hosts added later on, its state
+                # counts the hosts it has reached so far.
+                state = parcel.get('state') or {}
+                logger.debug('CDH parcel reached %s of %s hosts.',
+                             state.get('count'), state.get('totalCount'))
+                return state.get('count') == state.get('totalCount')
+        raise Exception('Could not find activated CDH parcel.')
+
+    def success(time):
+        logger.debug('CDH parcel became activated on all hosts after %s seconds.', time)
+
+    def failure(timeout):
+        raise TimeoutError('Timed out after {} seconds waiting for '
+                           'CDH parcel to become activated on all hosts.'.format(timeout))
+
+    wait_for_condition(condition=condition, condition_args=[deployment, cluster_name],
+                       time_between_checks=1, timeout=500, success=success, failure=failure)
+
+
+def _start_host_roles(deployment, cluster_name, host_ids):
+    role_names_by_service = defaultdict(list)
+    for host_id in host_ids:
+        for role_ref in deployment.get_host(host_id=host_id).get('roleRefs', []):
+            # Gateway roles only carry client configuration and cannot be started.
+            if '-GATEWAY-' not in role_ref['roleName']:
+                role_names_by_service[role_ref['serviceName']].append(role_ref['roleName'])
+
+    commands = []
+    for service_name, role_names in role_names_by_service.items():
+        logger.debug('Starting roles (%s) of service %s ...', ', '.join(role_names), service_name)
+        commands.extend(deployment.start_service_roles(cluster_name=cluster_name,
+                                                       service_name=service_name,
+                                                       role_names=role_names))
+    for command in commands:
+        cluster_utils.wait_for_command(deployment, command['id'],
+                                       'Start {}'.format(command.get('name', 'role')))
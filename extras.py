@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger('clusterdock.{}'.format(__name__))
+
+SUPERVISOR_CONF_DIR = '/etc/supervisord.d'
+
+# The extra services of the secondary image, mapped to the supervisord configuration file that
+# defines their programs. Kafka's file also holds the standalone ZooKeeper Kafka uses.
+EXTRA_SERVICES = OrderedDict([
+    ('kafka', 'kafka-supervisor.conf'),
+    ('kafka-manager', 'kafka-manager.conf'),
+    ('opentsdb', 'opentsdb.conf'),
+    ('grafana', 'grafana.conf'),
+])
+
+KAFKA_ZOOKEEPER_PORT = 2181
+KAFKA_MANAGER_CONFIG_FILE_PATH = '/root/tools/kafka-manager/conf/application.conf'
+OPENTSDB_CONFIG_FILE_PATH = '/root/tools/opentsdb/etc/opentsdb/opentsdb.conf'
+OPENTSDB_PORT = 4242
+GRAFANA_PORT = 3000
+GRAFANA_CREDENTIALS = 'admin:admin'
+
+
+def get_placement(args, secondary_nodes):
+    """Work out which secondary nodes run each extra service.
+
+    Args:
+        args (:py:class:`argparse.Namespace`): The parsed start arguments. For every extra
+            service, ``args.<service>_nodes`` is either ``None`` (run on every secondary node)
+            or a list of hostnames.
+        secondary_nodes (:obj:`list`): A list of :py:class:`clusterdock.models.Node` instances.
+
+    Returns:
+        An :py:class:`collections.OrderedDict` of extra service names mapped to lists of nodes.
+    """
+    nodes_by_hostname = {node.hostname: node for node in secondary_nodes}
+    placement = OrderedDict()
+    for service in EXTRA_SERVICES:
+        hostnames = getattr(args, '{}_nodes'.format(service.replace('-', '_')), None)
+        if hostnames is None:
+            placement[service] = list(secondary_nodes)
+            continue
+        unknown_hostnames = set(hostnames) - set(nodes_by_hostname)
+        if unknown_hostnames:
+            raise ValueError('Cannot place {} on {} (not secondary nodes).'.format(
+                service, ', '.join(sorted(unknown_hostnames))
+            ))
+        placement[service] = [nodes_by_hostname[hostname] for hostname in hostnames]
+    return placement
+
+
+def get_running_placement(secondary_nodes, new_nodes=()):
+    """Work out which secondary nodes of a running cluster run each extra service, extended to
+    secondary nodes added to it. New nodes run the services that run on every secondary node,
+    as they would have if the cluster had been started with them.
+
+    Args:
+        secondary_nodes (:obj:`list`): The running secondary nodes.
+        new_nodes (:obj:`list`, optional): Secondary nodes being added. Default: ``()``
+
+    Returns:
+        An :py:class:`collections.OrderedDict` of extra service names mapped to lists of nodes.
+    """
+    placement = OrderedDict((service, []) for service in EXTRA_SERVICES)
+    for node in secondary_nodes:
+        # Disabled services have had their configuration files renamed (see apply_placement).
+        file_names = node.execute('ls {}'.format(SUPERVISOR_CONF_DIR), quiet=True).output.split()
+        for service, file_name in EXTRA_SERVICES.items():
+            if file_name in file_names:
+                placement[service].append(node)
+    for nodes in placement.values():
+        if len(nodes) == len(secondary_nodes):
+            nodes.extend(new_nodes)
+    return placement
+
+
+def apply_placement(placement, secondary_nodes):
+    """Disable the supervisord programs of extra services on nodes that should not run them and
+    point the remaining clients at the chosen hosts.
+
+    Args:
+        placement (:obj:`dict`): Extra service names mapped to lists of nodes, as returned by
+            :py:func:`get_placement`.
+        secondary_nodes (:obj:`list`): A list of :py:class:`clusterdock.models.Node` instances
+            to apply the placement to. Nodes of ``placement`` that aren't among them are left
+            alone.
+    """
+    for node in secondary_nodes:
+        disabled_services = [service for service, nodes in placement.items() if node not in nodes]
+        if not disabled_services:
+            continue
+        logger.info('Disabling %s on %s ...', ', '.join(disabled_services), node.fqdn)
+        # Moving the configuration files out of the include pattern and running
+        # supervisorctl update stops the programs and keeps them from coming back on restart.
+        command = '; '.join(['mv -f {0}/{1} {0}/{1}.disabled'.format(SUPERVISOR_CONF_DIR,
+                                                                     EXTRA_SERVICES[service])
+                             for service in disabled_services]
+                            + ['supervisorctl update'])
+        node.execute(command, quiet=True)
+
+    if placement['kafka']:
+        kafka_zookeeper = '{}:{}'.format(placement['kafka'][0].fqdn, KAFKA_ZOOKEEPER_PORT)
+        for node in placement['kafka-manager']:
+            if node not in secondary_nodes:
+                continue
+            logger.debug('Pointing Kafka Manager on %s at %s ...', node.fqdn, kafka_zookeeper)
+            node.execute("sed -i 's#^kafka-manager.zkhosts=.*#"
+                         "kafka-manager.zkhosts=\"{}\"#' {} "
+                         "&& supervisorctl restart kafka-manager".format(
+                             kafka_zookeeper, KAFKA_MANAGER_CONFIG_FILE_PATH
+                         ), quiet=True)
+
+
+def configure_opentsdb(placement, zookeeper_quorum, kerberos_realm):
+    """Point OpenTSDB at the ZooKeeper quorum and Kerberos realm of the cluster's HBase service.
+
+    Args:
+        placement (:obj:`dict`): Extra service names mapped to lists of nodes.
+        zookeeper_quorum (:obj:`str`): Comma-separated ZooKeeper hosts used by HBase.
+        kerberos_realm (:obj:`str`): The Kerberos realm of the cluster.
+    """
+    for node in placement['opentsdb']:
+        logger.debug('Pointing OpenTSDB on %s at %s ...', node.fqdn, zookeeper_quorum)
+        node.execute("sed -i -e 's#^tsd.storage.hbase.zk_quorum = .*#"
+                     "tsd.storage.hbase.zk_quorum = {}#' "
+                     "-e 's#^hbase.kerberos.regionserver.principal = .*#"
+                     "hbase.kerberos.regionserver.principal = hbase/_HOST@{}#' {}".format(
+                         zookeeper_quorum, kerberos_realm, OPENTSDB_CONFIG_FILE_PATH
+                     ), quiet=True)
+
+
+def configure_grafana_datasource(placement, nodes=None):
+    """Add the first OpenTSDB node as the default data source of every Grafana.
+
+    Args:
+        placement (:obj:`dict`): Extra service names mapped to lists of nodes.
+        nodes (:obj:`list`, optional): Nodes whose Grafana is configured. Default: ``None``
+            (every node of ``placement`` running Grafana)
+    """
+    if not placement['opentsdb']:
+        return
+    datasource = json.dumps({'name': 'opentsdb',
+                             'type': 'opentsdb',
+                             'access': 'proxy',
+                             'isDefault': True,
+                             'url': 'http://{}:{}'.format(placement['opentsdb'][0].fqdn,
+                                                          OPENTSDB_PORT)})
+    # Grafana was only just started by post_run.sh, so give it some time to accept connections.
+    command = ('for i in $(seq 30); do '
+               'curl -sf -o /dev/null http://localhost:{0}/login && break; sleep 1; done; '
+               "curl -s -u {1} -H 'Content-Type: application/json' "
+               "-XPOST http://localhost:{0}/api/datasources -d '{2}'").format(GRAFANA_PORT,
+                                                                              GRAFANA_CREDENTIALS,
+                                                                              datasource)
+    for node in placement['grafana']:
+        if nodes is not None and node not in nodes:
+            continue
+        logger.debug('Adding OpenTSDB data source to Grafana on %s ...', node.fqdn)
+        node.execute(command, quiet=True)
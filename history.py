@@ -0,0 +1,394 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A local SQLite history of cluster starts.
+
+Every start records how long each of its phases took and how many CM API requests it sent,
+along with the node counts and images of the cluster. The history then serves two purposes:
+flagging phases of the latest start that were slower than usual, and sizing the timeouts of a
+start's waits from how long the same phases took before.
+
+Durations are only compared between starts of clusters with the same node counts, and only
+successful starts count towards baselines and timeouts.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import statistics
+import time
+from collections import Counter, OrderedDict
+from datetime import datetime
+
+logger = logging.getLogger('clusterdock.{}'.format(__name__))
+
+DEFAULT_HISTORY_PATH = '~/.clusterdock/history.db'
+
+# Timeouts come from history once this many successful starts were recorded. They are the
+# percentile of past durations times the margin, and never below the minimum.
+MIN_RUNS_FOR_TIMEOUTS = 5
+TIMEOUT_PERCENTILE = 99
+TIMEOUT_MARGIN = 2
+MIN_TIMEOUT = 60
+
+# A phase of the latest start counts as a regression if it is this many (robust) standard
+# deviations above the median of the baseline runs before it, and slower by at least the ratio.
+BASELINE_RUNS = 20
+MIN_BASELINE_RUNS = 3
+REGRESSION_Z_SCORE = 3.5
+REGRESSION_MIN_RATIO = 1.2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at REAL NOT NULL,
+    seconds REAL NOT NULL,
+    succeeded INTEGER NOT NULL,
+    network TEXT,
+    node_counts TEXT NOT NULL,
+    images TEXT NOT NULL,
+    api_requests INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS phases (
+    run_id INTEGER NOT NULL REFERENCES runs (id),
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    api_requests INTEGER NOT NULL,
+    PRIMARY KEY (run_id, name)
+);
+CREATE INDEX IF NOT EXISTS runs_by_node_counts ON runs (node_counts, succeeded, started_at);
+"""
+
+
+def main(args):
+    run_history = RunHistory(args.db)
+    runs = run_history.get_runs(limit=args.limit)
+    if not runs:
+        print('No starts recorded in {}.'.format(run_history.path))
+        return
+    print(format_table([('STARTED', 'SECONDS', 'RESULT', 'NODES', 'API REQUESTS', 'IMAGES')]
+                       + [(datetime.fromtimestamp(run['started_at']).strftime('%Y-%m-%d %H:%M'),
+                           '{:.0f}'.format(run['seconds']),
+                           'ok' if run['succeeded'] else 'failed',
+                           _format_node_counts(run['node_counts']),
+                           str(run['api_requests']),
+                           ', '.join(sorted(set(run['images'].values()))))
+                          for run in runs]))
+
+    latest_run = next((run for run in runs if run['succeeded']), None)
+    if latest_run is None:
+        return
+    print('\nPhases of the start at {} against up to {} earlier starts with the same '
+          'nodes:\n'.format(datetime.fromtimestamp(latest_run['started_at'])
+                            .strftime('%Y-%m-%d %H:%M'), BASELINE_RUNS))
+    trends = run_history.get_phase_trends(latest_run)
+    print(format_table([('PHASE', 'SECONDS', 'BASELINE MEDIAN', 'BASELINE P95', 'CHANGE', '')]
+                       + [(trend['phase'],
+                           '{:.1f}'.format(trend['seconds']),
+                           _format_optional(trend['baseline_median'], '{:.1f}'),
+                           _format_optional(trend['baseline_p95'], '{:.1f}'),
+                           _format_optional(trend['change'], '{:+.0%}'),
+                           'SLOWER' if trend['regression'] else '')
+                          for trend in trends]))
+    regressions = [trend['phase'] for trend in trends if trend['regression']]
+    if regressions:
+        logger.warning('Phases slower than their baseline: %s.', ', '.join(regressions))
+
+
+class RunHistory:
+    """The history of cluster starts, kept in an SQLite database.
+
+    Args:
+        path (:obj:`str`, optional): Path of the database, created along with its directory if
+            it doesn't exist. Default: :py:const:`DEFAULT_HISTORY_PATH`
+    """
+    def __init__(self, path=DEFAULT_HISTORY_PATH):
+        self.path = os.path.expanduser(path)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(self.path)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.executescript(SCHEMA)
+
+    def add_run(self, started_at, seconds, succeeded, network, node_counts, images,
+                api_requests, phases):
+        """Record a start.
+
+        Args:
+            started_at (:obj:`float`): When the start began, in seconds since the epoch.
+            seconds (:obj:`float`): How long the start took.
+            succeeded (:obj:`bool`): Whether the start finished without an error.
+            network (:obj:`str`): The network of the cluster.
+            node_counts (:obj:`dict`): Node groups mapped to their number of nodes.
+            images (:obj:`dict`): Node groups mapped to their image.
+            api_requests (:obj:`int`): Number of CM API requests sent.
+            phases (:obj:`list`): Tuples of the name, seconds and number of CM API requests of
+                every phase, in order.
+
+        Returns:
+            The :obj:`int` ID of the run.
+        """
+        with self._connection:
+            cursor = self._connection.execute(
+                'INSERT INTO runs (started_at, seconds, succeeded, network, node_counts, images, '
+                'api_requests) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (started_at, seconds, int(succeeded), network,
+                 json.dumps(node_counts, sort_keys=True), json.dumps(images, sort_keys=True),
+                 api_requests)
+            )
+            self._connection.executemany(
+                'INSERT INTO phases (run_id, position, name, seconds, api_requests) '
+                'VALUES (?, ?, ?, ?, ?)',
+                [(cursor.lastrowid, position, name, phase_seconds, phase_api_requests)
+                 for position, (name, phase_seconds, phase_api_requests) in enumerate(phases)]
+            )
+        return cursor.lastrowid
+
+    def get_runs(self, limit=None, node_counts=None, succeeded=None, before=None):
+        """Get recorded starts, latest first.
+
+        Args:
+            limit (:obj:`int`, optional): Maximum number of starts. Default: ``None`` (all)
+            node_counts (:obj:`dict`, optional): Only starts of clusters with these node counts.
+                Default: ``None``
+            succeeded (:obj:`bool`, optional): Only successful (or failed) starts.
+                Default: ``None``
+            before (:obj:`float`, optional): Only starts that began before this time.
+                Default: ``None``
+
+        Returns:
+            A :obj:`list` of dictionaries, each with the ``phases`` of the start as an
+            :py:class:`collections.OrderedDict` of phase names mapped to seconds.
+        """
+        conditions, parameters = [], []
+        if node_counts is not None:
+            conditions.append('node_counts = ?')
+            parameters.append(json.dumps(node_counts, sort_keys=True))
+        if succeeded is not None:
+            conditions.append('succeeded = ?')
+            parameters.append(int(succeeded))
+        if before is not None:
+            conditions.append('started_at < ?')
+            parameters.append(before)
+        query = 'SELECT * FROM runs{} ORDER BY started_at DESC'.format(
+            ' WHERE {}'.format(' AND '.join(conditions)) if conditions else ''
+        )
+        if limit is not None:
+            query += ' LIMIT {:d}'.format(limit)
+        runs = [dict(row, node_counts=json.loads(row['node_counts']),
+                     images=json.loads(row['images']), phases=OrderedDict())
+                for row in self._connection.execute(query, parameters)]
+
+        # All phases in one query rather than one per run.
+        runs_by_id = {run['id']: run for run in runs}
+        if runs_by_id:
+            for row in self._connection.execute(
+                'SELECT run_id, name, seconds FROM phases WHERE run_id IN ({}) '
+                'ORDER BY run_id, position'.format(', '.join('?' * len(runs_by_id))),
+                list(runs_by_id)
+            ):
+                runs_by_id[row['run_id']]['phases'][row['name']] = row['seconds']
+        return runs
+
+    def get_phase_durations(self, phase, node_counts, limit=BASELINE_RUNS, before=None):
+        """Get how long a phase took in the latest successful starts.
+
+        Args:
+            phase (:obj:`str`): The name of the phase.
+            node_counts (:obj:`dict`): Only starts of clusters with these node counts.
+            limit (:obj:`int`, optional): Maximum number of starts.
+                Default: :py:const:`BASELINE_RUNS`
+            before (:obj:`float`, optional): Only starts that began before this time.
+                Default: ``None``
+
+        Returns:
+            A :obj:`list` of seconds, latest first.
+        """
+        return [run['phases'][phase]
+                for run in self.get_runs(limit=limit, node_counts=node_counts, succeeded=True,
+                                         before=before)
+                if phase in run['phases']]
+
+    def get_timeout(self, phase, node_counts, default):
+        """Get the timeout of the waits of a phase from how long the phase took before.
+
+        Args:
+            phase (:obj:`str`): The name of the phase.
+            node_counts (:obj:`dict`): Node groups mapped to their number of nodes.
+            default (:obj:`int`): Seconds to use while there is too little history.
+
+        Returns:
+            An :obj:`int` of seconds.
+        """
+        durations = self.get_phase_durations(phase, node_counts)
+        if len(durations) < MIN_RUNS_FOR_TIMEOUTS:
+            return default
+        return max(MIN_TIMEOUT, int(_percentile(durations, TIMEOUT_PERCENTILE) * TIMEOUT_MARGIN))
+
+    def get_phase_trends(self, run):
+        """Compare the phases of a start with the same phases of earlier starts.
+
+        Args:
+            run (:obj:`dict`): The start, as returned by :py:meth:`get_runs`.
+
+        Returns:
+            A :obj:`list` of dictionaries with the ``phase``, its ``seconds``, the
+            ``baseline_median`` and ``baseline_p95`` of earlier starts, the relative ``change``
+            to the median and whether it is a ``regression``. Baseline values are ``None`` while
+            there are too few earlier starts.
+        """
+        trends = []
+        for phase, seconds in run['phases'].items():
+            baseline = self.get_phase_durations(phase, run['node_counts'],
+                                                before=run['started_at'])
+            trend = OrderedDict([('phase', phase), ('seconds', seconds),
+                                 ('baseline_median', None), ('baseline_p95', None),
+                                 ('change', None), ('regression', False)])
+            if len(baseline) >= MIN_BASELINE_RUNS:
+                median = statistics.median(baseline)
+                trend['baseline_median'] = median
+                trend['baseline_p95'] = _percentile(baseline, 95)
+                trend['change'] = seconds / median - 1 if median else None
+                trend['regression'] = _is_regression(seconds, baseline, median)
+            trends.append(trend)
+        return trends
+
+
+class RunRecorder:
+    """Times the phases of a start and adds it to a :py:class:`RunHistory` once it finishes.
+
+    Phases follow each other: beginning one ends the one before.
+
+    Args:
+        run_history (:py:class:`RunHistory`): The history to add the start to.
+    """
+    def __init__(self, run_history):
+        self.run_history = run_history
+        self.network = None
+        self.node_counts = {}
+        self.images = {}
+        self.api_client = None
+        self.phases = []
+        self._started_at = time.time()
+        self._phase = None
+
+    def set_cluster(self, cluster):
+        """Describe the started cluster, whose node counts also select the history to use.
+
+        Args:
+            cluster (:py:class:`clusterdock.models.Cluster`): The cluster.
+        """
+        self.network = cluster.network
+        self.node_counts = dict(Counter(node.group for node in cluster.nodes))
+        self.images = {node.group: node.image for node in cluster.nodes}
+
+    def set_api_client(self, api_client):
+        """Count the CM API requests of an API client towards the phases from now on.
+
+        Args:
+            api_client (:py:class:`cm_api.ApiClient`): The API client.
+        """
+        self.api_client = api_client
+
+    def begin_phase(self, name):
+        """End the current phase, if any, and begin another.
+
+        Args:
+            name (:obj:`str`): The name of the phase.
+        """
+        self._end_phase()
+        logger.debug('Beginning phase %s ...', name)
+        self._phase = (name, time.time(), self._get_api_requests())
+
+    def get_timeout(self, phase, default):
+        """Get the timeout of the waits of a phase.
+
+        Args:
+            phase (:obj:`str`): The name of the phase.
+            default (:obj:`int`): Seconds to use while there is too little history.
+
+        Returns:
+            An :obj:`int` of seconds.
+        """
+        timeout = self.run_history.get_timeout(phase, self.node_counts, default)
+        if timeout != default:
+            logger.debug('Using a timeout of %s seconds (instead of %s) for phase %s.',
+                         timeout, default, phase)
+        return timeout
+
+    def finish(self, succeeded):
+        """End the current phase and record the start.
+
+        Args:
+            succeeded (:obj:`bool`): Whether the start finished without an error.
+        """
+        self._end_phase()
+        seconds = time.time() - self._started_at
+        self.run_history.add_run(started_at=self._started_at, seconds=seconds,
+                                 succeeded=succeeded, network=self.network,
+                                 node_counts=self.node_counts, images=self.images,
+                                 api_requests=self._get_api_requests(), phases=self.phases)
+        logger.info('Recorded start (%.0f seconds, %s) in %s.', seconds,
+                    ', '.join('{} {:.0f}s'.format(name, phase_seconds)
+                              for name, phase_seconds, _ in self.phases),
+                    self.run_history.path)
+
+    def _get_api_requests(self):
+        return self.api_client.request_count if self.api_client else 0
+
+    def _end_phase(self):
+        if self._phase is not None:
+            name, started_at, api_requests = self._phase
+            self.phases.append((name, round(time.time() - started_at, 3),
+                                self._get_api_requests() - api_requests))
+            self._phase = None
+
+
+def format_table(rows):
+    """Format rows of strings as a table, with the first row as its header.
+
+    Args:
+        rows (:obj:`list`): Tuples of strings.
+
+    Returns:
+        A :obj:`str` of the table.
+    """
+    widths = [max(len(row[column]) for row in rows) for column in range(len(rows[0]))]
+    return '\n'.join('  '.join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+                     for row in rows)
+
+
+def _percentile(values, percentile):
+    ordered_values = sorted(values)
+    return ordered_values[min(len(ordered_values) - 1,
+                              int(len(ordered_values) * percentile / 100))]
+
+
+def _is_regression(seconds, baseline, median):
+    # The median absolute deviation, scaled to estimate a standard deviation, keeps a single
+    # slow baseline run from hiding a regression the way the mean and standard deviation would.
+    deviation = 1.4826 * statistics.median(abs(value - median) for value in baseline)
+    if seconds < median * REGRESSION_MIN_RATIO:
+        return False
+    return deviation == 0 or (seconds - median) / deviation > REGRESSION_Z_SCORE
+
+
+def _format_node_counts(node_counts):
+    return ', '.join('{} {}'.format(count, group) for group, count in sorted(node_counts.items()))
+
+
+def _format_optional(value, format_string):
+    return '' if value is None else format_string.format(value)
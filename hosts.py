@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The Cloudera Manager hosts of a cluster's nodes, loaded once and looked up by key."""
+
+import logging
+from collections import defaultdict
+
+from clusterdock.utils import wait_for_condition
+
+logger = logging.getLogger('clusterdock.{}'.format(__name__))
+
+# Fields of the CM hosts that are kept, out of everything a host in the hosts list comes with.
+HOST_FIELDS = ['hostId', 'hostname', 'ipAddress']
+
+
+class HostRegistry:
+    """The CM hosts matching a set of nodes, indexed by FQDN, host ID, IP address and node group.
+
+    Hosts are loaded with a single ``get_all_hosts`` call per refresh, keeping only
+    :py:const:`HOST_FIELDS`, and every node found gets its ``host_id`` attribute set.
+
+    Args:
+        deployment (:py:class:`cm.ClouderaManagerDeployment`): The CM deployment.
+        nodes (:obj:`list`): The :py:class:`clusterdock.models.Node` instances to track.
+    """
+    def __init__(self, deployment, nodes):
+        self.deployment = deployment
+        self._nodes_by_fqdn = {}
+        self._hosts_by_fqdn = {}
+        self._fqdns_by_host_id = {}
+        self._fqdns_by_ip_address = {}
+        self._fqdns_by_group = defaultdict(list)
+        self.add_nodes(nodes)
+
+    @property
+    def missing_fqdns(self):
+        """A :obj:`list` of the FQDNs of tracked nodes that CM does not know about yet."""
+        return [fqdn for fqdn in self._nodes_by_fqdn if fqdn not in self._hosts_by_fqdn]
+
+    def add_nodes(self, nodes):
+        """Start tracking more nodes. Their hosts are looked up by the next refresh.
+
+        Args:
+            nodes (:obj:`list`): A list of :py:class:`clusterdock.models.Node` instances.
+        """
+        for node in nodes:
+            if node.fqdn not in self._nodes_by_fqdn:
+                self._nodes_by_fqdn[node.fqdn] = node
+                self._fqdns_by_group[node.group].append(node.fqdn)
+
+    def remove_nodes(self, nodes):
+        """Stop tracking nodes, e.g. once their hosts were deleted from CM.
+
+        Args:
+            nodes (:obj:`list`): A list of :py:class:`clusterdock.models.Node` instances.
+        """
+        for node in nodes:
+            self._nodes_by_fqdn.pop(node.fqdn, None)
+            if node.fqdn in self._fqdns_by_group[node.group]:
+                self._fqdns_by_group[node.group].remove(node.fqdn)
+            host = self._hosts_by_fqdn.pop(node.fqdn, None)
+            if host:
+                self._fqdns_by_host_id.pop(host['hostId'], None)
+                self._fqdns_by_ip_address.pop(host.get('ipAddress'), None)
+
+    def refresh(self):
+        """Load the hosts of tracked nodes that are still missing.
+
+        Hosts already loaded are kept as they are and nothing is loaded once no node is missing.
+
+        Returns:
+            A :obj:`list` of the FQDNs of tracked nodes that are still missing.
+        """
+        if not self.missing_fqdns:
+            return []
+        for host in self.deployment.get_all_hosts(fields=HOST_FIELDS):
+            node = self._nodes_by_fqdn.get(host['hostname'])
+            if node and host['hostname'] not in self._hosts_by_fqdn:
+                self._hosts_by_fqdn[node.fqdn] = host
+                self._fqdns_by_host_id[host['hostId']] = node.fqdn
+                if host.get('ipAddress'):
+                    self._fqdns_by_ip_address[host['ipAddress']] = node.fqdn
+                node.host_id = host['hostId']
+        return self.missing_fqdns
+
+    def wait_for_hosts(self, timeout=180):
+        """Refresh until CM knows about every tracked node.
+
+        Args:
+            timeout (:obj:`int`, optional): Seconds to wait. Default: ``180``
+        """
+        def condition(registry):
+            missing_fqdns = registry.refresh()
+            if missing_fqdns:
+                logger.debug('Waiting for CM to see hosts (%s) ...', ', '.join(missing_fqdns))
+            return not missing_fqdns
+
+        def success(time):
+            logger.debug('CM saw all hosts after %s seconds.', time)
+
+        def failure(timeout):
+            raise TimeoutError('Timed out after {} seconds waiting for CM to see hosts '
+                               '({}).'.format(timeout, ', '.join(self.missing_fqdns)))
+
+        wait_for_condition(condition=condition, condition_args=[self],
+                           time_between_checks=1, timeout=timeout,
+                           success=success, failure=failure)
+
+    def get_host(self, fqdn):
+        """Get the CM host of a node.
+
+        Args:
+            fqdn (:obj:`str`): FQDN of the node.
+
+        Returns:
+            A :obj:`dict` of information about the host.
+        """
+        try:
+            return self._hosts_by_fqdn[fqdn]
+        except KeyError:
+            raise Exception('Could not find CM host with hostname {}.'.format(fqdn))
+
+    def get_host_ids(self, nodes=None, group=None):
+        """Get the host IDs of nodes.
+
+        Args:
+            nodes (:obj:`list`, optional): :py:class:`clusterdock.models.Node` instances.
+                Default: ``None`` (all tracked nodes)
+            group (:obj:`str`, optional): Only include nodes of this node group. Default: ``None``
+
+        Returns:
+            A :obj:`list` of host IDs.
+        """
+        if nodes is not None:
+            fqdns = [node.fqdn for node in nodes]
+        elif group is not None:
+            fqdns = self._fqdns_by_group.get(group, [])
+        else:
+            fqdns = list(self._nodes_by_fqdn)
+        if group is not None and nodes is not None:
+            fqdns = [fqdn for fqdn in fqdns if self._nodes_by_fqdn[fqdn].group == group]
+        return [self.get_host(fqdn)['hostId'] for fqdn in fqdns]
+
+    def get_fqdn(self, host_id=None, ip_address=None):
+        """Get the FQDN of a node by the host ID or IP address of its CM host.
+
+        Args:
+            host_id (:obj:`str`, optional): Host ID. Default: ``None``
+            ip_address (:obj:`str`, optional): IP address. Default: ``None``
+
+        Returns:
+            A :obj:`str` of the FQDN or ``None`` if no tracked node matches.
+        """
+        if host_id is not None:
+            return self._fqdns_by_host_id.get(host_id)
+        return self._fqdns_by_ip_address.get(ip_address)
+
+    def get_node(self, host_id=None, ip_address=None):
+        """Get a node by the host ID or IP address of its CM host.
+
+        Args:
+            host_id (:obj:`str`, optional): Host ID. Default: ``None``
+            ip_address (:obj:`str`, optional): IP address. Default: ``None``
+
+        Returns:
+            A :py:class:`clusterdock.models.Node` instance or ``None`` if none matches.
+        """
+        return self._nodes_by_fqdn.get(self.get_fqdn(host_id=host_id, ip_address=ip_address))
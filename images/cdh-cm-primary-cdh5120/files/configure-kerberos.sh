@@ -54,6 +54,11 @@ EOF
 
 echo "*/admin@${KERBEROS_REALM}  *" > /var/kerberos/krb5kdc/kadm5.acl
 
+# A KDC database created for another realm (e.g. the one the image was built with) is replaced.
+if [ ! -f /var/kerberos/krb5kdc/.k5.${KERBEROS_REALM} ]; then
+  rm -f /var/kerberos/krb5kdc/principal* /var/kerberos/krb5kdc/.k5.*
+fi
+
 echo 'Setting root password for Kerberos...'
 expect - <<EOF
 set timeout 60
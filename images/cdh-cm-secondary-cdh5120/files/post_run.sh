@@ -1,9 +1,16 @@
 #!/bin/bash
 
-echo "create 'tsdb-uid',  {NAME => 'id', COMPRESSION => 'GZ', BLOOMFILTER => 'ROW'},  {NAME => 'name', COMPRESSION => 'GZ', BLOOMFILTER => 'ROW'}" | hbase shell
-echo "create 'tsdb',  {NAME => 't', VERSIONS => 1, COMPRESSION => 'GZ', BLOOMFILTER => 'ROW'}" | hbase shell
-echo "create 'tsdb-tree',  {NAME => 't', VERSIONS => 1, COMPRESSION => 'GZ', BLOOMFILTER => 'ROW'}" | hbase shell
-echo "create 'tsdb-meta',  {NAME => 'name', COMPRESSION => 'GZ', BLOOMFILTER => 'ROW'}" | hbase shell
+# Extra services can be disabled on this node by the topology (see --opentsdb-nodes and
+# --grafana-nodes), in which case supervisord doesn't know about their programs.
+if supervisorctl avail | grep -q '^opentsdb '; then
+    echo "create 'tsdb-uid',  {NAME => 'id', COMPRESSION => 'GZ', BLOOMFILTER => 'ROW'},  {NAME => 'name', COMPRESSION => 'GZ', BLOOMFILTER => 'ROW'}" | hbase shell
+    echo "create 'tsdb',  {NAME => 't', VERSIONS => 1, COMPRESSION => 'GZ', BLOOMFILTER => 'ROW'}" | hbase shell
+    echo "create 'tsdb-tree',  {NAME => 't', VERSIONS => 1, COMPRESSION => 'GZ', BLOOMFILTER => 'ROW'}" | hbase shell
+    echo "create 'tsdb-meta',  {NAME => 'name', COMPRESSION => 'GZ', BLOOMFILTER => 'ROW'}" | hbase shell
 
-supervisorctl start opentsdb
-supervisorctl start grafana
\ No newline at end of file
+    supervisorctl start opentsdb
+fi
+
+if supervisorctl avail | grep -q '^grafana '; then
+    supervisorctl start grafana
+fi
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Incremental parsing of large JSON documents, such as the list responses of the CM API.
+
+Only the items of one array in a document are decoded, one at a time as its text arrives, and
+everything else is skipped. The text held at any time is about one item and one chunk long, so
+memory stays the same however long the array is.
+"""
+
+import json
+import re
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = re.compile(r'\s*')
+
+# Path element standing for every item of an array.
+EVERY_ITEM = '*'
+
+
+def iter_items(chunks, path=('items',)):
+    """Decode the items of an array in a JSON document, one at a time.
+
+    Args:
+        chunks: Iterable of :obj:`str` chunks of the document, e.g.
+            :py:meth:`requests.Response.iter_content` with ``decode_unicode=True``.
+        path (:obj:`tuple`, optional): Keys leading to the array, with :py:const:`EVERY_ITEM`
+            for every item of an array on the way, e.g. ``('items', '*', 'timeSeries')``.
+            Default: ``('items',)``
+
+    Yields:
+        The items of the array, or nothing if the document does not have it.
+    """
+    return _iter_path(_Reader(chunks), tuple(path))
+
+
+def project(item, fields):
+    """Keep only some fields of an item.
+
+    Args:
+        item (:obj:`dict`): The item.
+        fields (:obj:`list`): Names of the fields to keep, with dots for nested fields, e.g.
+            ``hostRef.hostId``. Fields the item does not have are left out.
+
+    Returns:
+        A :obj:`dict` of the fields kept.
+    """
+    projected = {}
+    for field in fields:
+        *parents, name = field.split('.')
+        source, target = item, projected
+        for parent in parents:
+            source = source.get(parent)
+            if not isinstance(source, dict):
+                break
+            target = target.setdefault(parent, {})
+        else:
+            if name in source:
+                target[name] = source[name]
+    return projected
+
+
+def _iter_path(reader, path):
+    if not path:
+        for _ in _iter_array(reader):
+            yield reader.decode()
+    elif path[0] == EVERY_ITEM:
+        for _ in _iter_array(reader):
+            yield from _iter_path(reader, path[1:])
+    else:
+        for key in _iter_object(reader):
+            if key == path[0]:
+                yield from _iter_path(reader, path[1:])
+            else:
+                reader.decode()
+
+
+def _iter_array(reader):
+    # Yields once for every item of the array, which the caller then has to consume.
+    reader.expect('[')
+    if reader.peek() == ']':
+        reader.expect(']')
+        return
+    while True:
+        yield
+        if reader.expect(',]') == ']':
+            return
+
+
+def _iter_object(reader):
+    # Yields every key of the object, whose value the caller then has to consume.
+    reader.expect('{')
+    if reader.peek() == '}':
+        reader.expect('}')
+        return
+    while True:
+        key = reader.decode()
+        reader.expect(':')
+        yield key
+        if reader.expect(',}') == '}':
+            return
+
+
+class _Reader:
+    """The text of a JSON document, read one chunk at a time as values are decoded."""
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = ''
+        self._position = 0
+
+    def peek(self):
+        """Get the next character other than whitespace without consuming it, or ``''`` at the
+        end of the document."""
+        while True:
+            self._position = _WHITESPACE.match(self._buffer, self._position).end()
+            if self._position < len(self._buffer):
+                return self._buffer[self._position]
+            if not self._read():
+                return ''
+
+    def expect(self, characters):
+        """Consume the next character other than whitespace, which has to be one of
+        ``characters``."""
+        character = self.peek()
+        if not character or character not in characters:
+            raise ValueError('Expected one of {} at {!r} of the JSON document.'.format(
+                characters, self._buffer[self._position:self._position + 20]
+            ))
+        self._position += 1
+        return character
+
+    def decode(self):
+        """Decode the next value, reading more of the document until it is complete."""
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self._buffer, self._position)
+            except json.JSONDecodeError:
+                if not self._read():
+                    raise
+                continue
+            # A number at the end of the text read so far may go on in the next chunk.
+            if end == len(self._buffer) and self._read():
+                continue
+            self._position = end
+            return value
+
+    def _read(self):
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            return False
+        # Text that was consumed already is dropped.
+        self._buffer = self._buffer[self._position:] + chunk
+        self._position = 0
+        return True
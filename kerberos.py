@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Snapshots of the KDC of a cluster, cached on the Docker host.
+
+A snapshot holds a ``kdb5_util dump`` of the KDC database, along with the master key stash, the
+KDC and client configurations and the admin keytab. Loading one takes the place of running
+``configure-kerberos.sh`` and restarting the KDC. Service principals are still left to CM, which
+randomizes their keys again whenever it configures the cluster for Kerberos.
+Snapshots are versioned by the primary image, the Kerberos realm and domain and the FQDN of the
+KDC, so a snapshot is only ever loaded into a cluster it was taken from an identical twin of.
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import os
+
+from . import cluster_utils
+from .distribute import distribute
+
+logger = logging.getLogger('clusterdock.{}'.format(__name__))
+
+KDC_DATA_DIR = '/var/kerberos/krb5kdc'
+KDC_DUMP_PATH = '/root/kdc.dump'
+KRB5_CONF_PATH = '/etc/krb5.conf'
+KEYTAB_FILE_PATH = '/root/cloudera-scm.keytab'
+KEYTAB_PRINCIPAL = 'cloudera-scm/admin'
+
+
+def create_keytab(primary_node, nodes):
+    """Create the admin keytab on the primary node and copy it to every other node.
+
+    Args:
+        primary_node (:py:class:`clusterdock.models.Node`): The primary node.
+        nodes (:obj:`list`): The :py:class:`clusterdock.models.Node` instances to copy it to. The
+            primary node is skipped.
+    """
+    cluster_utils.execute(primary_node, '/root/create-keytab.sh')
+    copy_keytab(primary_node, nodes)
+
+
+def copy_keytab(primary_node, nodes):
+    """Copy the admin keytab of the primary node to other nodes, all at the same time.
+
+    Args:
+        primary_node (:py:class:`clusterdock.models.Node`): The primary node.
+        nodes (:obj:`list`): The :py:class:`clusterdock.models.Node` instances to copy it to. The
+            primary node is skipped.
+    """
+    # The keytab is binary, which get_file does not handle, so it leaves the node base64-encoded.
+    keytab = base64.b64decode(cluster_utils.execute(primary_node,
+                                                    'base64 {}'.format(KEYTAB_FILE_PATH)))
+    distribute([node for node in nodes if node is not primary_node],
+               {KEYTAB_FILE_PATH: keytab},
+               mode=0o600)
+
+
+def get_realm(primary_node):
+    """Get the Kerberos realm of a running cluster.
+
+    Args:
+        primary_node (:py:class:`clusterdock.models.Node`): The primary node, running the KDC.
+
+    Returns:
+        A :obj:`str` of the realm.
+    """
+    return cluster_utils.execute(
+        primary_node, "sed -n 's/^ *default_realm *= *//p' {}".format(KRB5_CONF_PATH)
+    ).strip()
+
+
+def kinit(nodes):
+    """Obtain a ticket of the admin principal on several nodes at the same time.
+
+    Args:
+        nodes (:obj:`list`): A list of :py:class:`clusterdock.models.Node` instances.
+    """
+    cluster_utils.execute_concurrently(nodes, 'kinit -kt {} {}'.format(KEYTAB_FILE_PATH,
+                                                                        KEYTAB_PRINCIPAL))
+
+
+def get_snapshot_path(cache_dir, primary_node, kerberos_realm, kerberos_domain):
+    """Get the path of the KDC snapshot matching a cluster.
+
+    Args:
+        cache_dir (:obj:`str`): Directory on the Docker host in which snapshots are kept.
+        primary_node (:py:class:`clusterdock.models.Node`): The primary node (running the KDC).
+        kerberos_realm (:obj:`str`): The Kerberos realm of the cluster.
+        kerberos_domain (:obj:`str`): The Kerberos domain of the cluster.
+
+    Returns:
+        A :obj:`str` of the path (without extension) of the snapshot, which may not exist yet.
+    """
+    version = hashlib.sha256(json.dumps([primary_node.container.image.id, kerberos_realm,
+                                         kerberos_domain, primary_node.fqdn]).encode())
+    return os.path.join(cache_dir, 'kdc-{}'.format(version.hexdigest()[:16]))
+
+
+def save_snapshot(snapshot_path, primary_node, kerberos_realm):
+    """Dump the KDC database of a cluster and keep it, with everything needed to load it again.
+
+    Args:
+        snapshot_path (:obj:`str`): Path of the snapshot, as returned by
+            :py:func:`get_snapshot_path`.
+        primary_node (:py:class:`clusterdock.models.Node`): The primary node (running the KDC).
+        kerberos_realm (:obj:`str`): The Kerberos realm of the cluster.
+    """
+    files = [KDC_DUMP_PATH,
+             '{}/.k5.{}'.format(KDC_DATA_DIR, kerberos_realm),
+             '{}/kdc.conf'.format(KDC_DATA_DIR),
+             '{}/kadm5.acl'.format(KDC_DATA_DIR),
+             KRB5_CONF_PATH,
+             KEYTAB_FILE_PATH]
+    # Tar takes care of paths and permissions, base64 of getting binary data out of the node.
+    archive = base64.b64decode(cluster_utils.execute(
+        primary_node, 'kdb5_util dump {} && tar -cf - {} 2>/dev/null | base64'.format(
+            KDC_DUMP_PATH, ' '.join(files)
+        )
+    ))
+    os.makedirs(os.path.dirname(snapshot_path), exist_ok=True)
+    with open('{}.tar'.format(snapshot_path), 'wb') as archive_file:
+        archive_file.write(archive)
+    logger.info('Saved KDC snapshot to %s.tar.', snapshot_path)
+
+
+def load_snapshot(snapshot_path, primary_node):
+    """Load a KDC snapshot into a cluster in place of configuring its KDC from scratch.
+
+    Args:
+        snapshot_path (:obj:`str`): Path of the snapshot, as returned by
+            :py:func:`get_snapshot_path`.
+        primary_node (:py:class:`clusterdock.models.Node`): The primary node (running the KDC).
+
+    Returns:
+        ``True`` if the snapshot was loaded, ``False`` if there is none.
+    """
+    if not os.path.exists('{}.tar'.format(snapshot_path)):
+        return False
+
+    logger.info('Loading KDC snapshot from %s.tar ...', snapshot_path)
+    with open('{}.tar'.format(snapshot_path), 'rb') as archive_file:
+        primary_node.container.put_archive('/', archive_file.read())
+    cluster_utils.execute(primary_node,
+                          'rm -f {0}/principal* && kdb5_util load {1}'.format(KDC_DATA_DIR,
+                                                                             KDC_DUMP_PATH))
+    return True
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The Docker network a cluster runs on.
+
+clusterdock creates a plain bridge network unless one of the same name exists already, in which
+case it uses that. Creating the network here first is how its MTU, subnet and driver options
+get set. In host network mode, the single node of a cluster shares the network stack of the
+Docker host instead, which clusterdock can't do, so the node's container is created here too.
+"""
+
+import logging
+import socket
+
+import docker
+from clusterdock.config import defaults
+from clusterdock.models import client
+from clusterdock.utils import get_clusterdock_label, nested_get, wait_for_condition
+
+logger = logging.getLogger('clusterdock.{}'.format(__name__))
+
+BRIDGE_DRIVER = 'bridge'
+HOST_DRIVER = 'host'
+NETWORK_DRIVERS = (BRIDGE_DRIVER, HOST_DRIVER)
+
+# The name of Docker's network for containers sharing the host's network stack, which is what
+# other commands attach to (with -n host) to find a cluster started in host network mode.
+HOST_NETWORK = 'host'
+
+MTU_OPTION = 'com.docker.network.driver.mtu'
+
+# Host configuration of a node in host network mode, as clusterdock sets it for other nodes.
+HOST_NETWORK_HOST_CONFIG = {
+    'network_mode': 'host',
+    'cap_add': ['ALL'],
+    'security_opt': ['seccomp=unconfined'],
+}
+
+
+def parse_network_options(options):
+    """Parse driver options given on the command line.
+
+    Args:
+        options (:obj:`list`): Options like ``com.docker.network.bridge.enable_icc=true``.
+
+    Returns:
+        A :obj:`dict` of option names mapped to values.
+    """
+    parsed_options = {}
+    for option in options or []:
+        name, equals, value = option.partition('=')
+        if not (name and equals):
+            raise ValueError('Cannot parse network option {} (expected name=value).'.format(option))
+        parsed_options[name] = value
+    return parsed_options
+
+
+def create_network(name, cluster_name, driver=BRIDGE_DRIVER, mtu=None, subnet=None,
+                   options=None):
+    """Create the network of a cluster ahead of clusterdock, unless it exists already.
+
+    Args:
+        name (:obj:`str`): The name of the network.
+        cluster_name (:obj:`str`): The name of the cluster, for the clusterdock label.
+        driver (:obj:`str`, optional): The network driver. Default: :py:const:`BRIDGE_DRIVER`
+        mtu (:obj:`int`, optional): MTU of the network's interfaces, e.g. 9000 for jumbo frames.
+            Default: ``None`` (Docker's default)
+        subnet (:obj:`str`, optional): Subnet in CIDR notation. Default: ``None`` (picked by
+            Docker)
+        options (:obj:`dict`, optional): Further driver options. Default: ``None``
+    """
+    driver_options = dict(options or {})
+    if mtu:
+        driver_options[MTU_OPTION] = str(mtu)
+    ipam = (docker.types.IPAMConfig(pool_configs=[docker.types.IPAMPool(subnet=subnet)])
+            if subnet else None)
+
+    try:
+        existing_network = client.networks.get(name)
+    except docker.errors.NotFound:
+        existing_network = None
+    if existing_network:
+        existing_options = nested_get(existing_network.attrs, ['Options']) or {}
+        if (nested_get(existing_network.attrs, ['Driver']) != driver
+                or any(existing_options.get(option) != value
+                       for option, value in driver_options.items())):
+            logger.warning('Network %s already exists with driver %s and options (%s), which '
+                           'are kept.', name, nested_get(existing_network.attrs, ['Driver']),
+                           ', '.join('{}={}'.format(option, value)
+                                     for option, value in sorted(existing_options.items())))
+        return
+
+    logger.info('Creating %s network %s%s ...', driver, name,
+                ' (MTU {})'.format(mtu) if mtu else '')
+    client.networks.create(name=name,
+                           driver=driver,
+                           options=driver_options,
+                           ipam=ipam,
+                           check_duplicate=True,
+                           labels={defaults.get('DEFAULT_DOCKER_LABEL_KEY'):
+                                   get_clusterdock_label(cluster_name)})
+
+
+def start_host_network_cluster(cluster):
+    """Start a single-node cluster in the network stack of the Docker host.
+
+    The node takes the hostname and IP address of the Docker host, and its ports are the host's
+    ports, so no more than one node can run this way.
+
+    Args:
+        cluster (:py:class:`clusterdock.models.Cluster`): The cluster.
+    """
+    if len(cluster.nodes) != 1:
+        raise ValueError('Cannot start {} nodes in host network mode (only a single '
+                         'node).'.format(len(cluster.nodes)))
+    cluster.network = HOST_NETWORK
+    for node in cluster:
+        _start_host_network_node(node, cluster.name)
+
+
+def get_host_ip_address():
+    """Get the IP address of the Docker host's outbound interface.
+
+    Returns:
+        A :obj:`str` of the IP address.
+    """
+    # Connecting a UDP socket sends nothing, but picks the interface of the default route.
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp_socket:
+        udp_socket.connect(('10.255.255.255', 1))
+        return udp_socket.getsockname()[0]
+
+
+def _start_host_network_node(node, cluster_name):
+    binds = {'/etc/localtime': {'bind': '/etc/localtime', 'mode': 'rw'}}
+    for volume in node.volumes:
+        if not isinstance(volume, dict):
+            raise TypeError('Saw volume of type {} (must be dict).'.format(type(volume).__name__))
+        binds.update({source: {'bind': target, 'mode': 'rw'} for source, target in volume.items()})
+    host_config = client.api.create_host_config(binds=binds, devices=node.devices or None,
+                                                **HOST_NETWORK_HOST_CONFIG)
+
+    logger.info('Starting node %s in host network mode ...', node.hostname)
+    try:
+        client.images.get(node.image)
+    except docker.errors.ImageNotFound:
+        logger.info('Could not find %s locally. Attempting to pull ...', node.image)
+        client.images.pull(node.image)
+    container_id = client.api.create_container(image=node.image,
+                                               host_config=host_config,
+                                               volumes=[bind['bind'] for bind in binds.values()],
+                                               labels={defaults.get('DEFAULT_DOCKER_LABEL_KEY'):
+                                                       get_clusterdock_label(cluster_name)},
+                                               detach=True,
+                                               **node.create_container_kwargs)['Id']
+    client.api.start(container=container_id)
+    node.container = client.containers.get(container_id)
+
+    def condition(container):
+        container.reload()
+        return nested_get(container.attrs, ['State', 'Running'])
+
+    def failure(timeout):
+        raise TimeoutError('Timed out after {} seconds waiting for the container of {} to '
+                           'run.'.format(timeout, node.hostname))
+
+    wait_for_condition(condition=condition, condition_args=[node.container],
+                       time_between_checks=1, timeout=30, failure=failure)
+
+    # The Docker host's hostname and address are the node's. Each port of the node is the same
+    # port of the host.
+    node.fqdn = socket.getfqdn()
+    node.ip_address = get_host_ip_address()
+    node.host_ports = {port: port
+                       for entry in node.ports
+                       for port in (entry.values() if isinstance(entry, dict) else [entry])}
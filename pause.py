@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import logging
+
+from . import cluster_utils
+from .cm import ClouderaManagerDeployment
+from .kerberos import KEYTAB_FILE_PATH, KEYTAB_PRINCIPAL
+
+logger = logging.getLogger('clusterdock.{}'.format(__name__))
+
+# What pause stopped is recorded on the primary node, so that resume only restarts that.
+PAUSE_STATE_FILE_PATH = '/root/.clusterdock-pause-state.json'
+
+
+def main(args):
+    cluster = cluster_utils.attach_cluster(args.network)
+    primary_node = cluster.primary_node
+    deployment = ClouderaManagerDeployment(cluster_utils.get_server_url(primary_node))
+
+    cm_service_started = deployment.get_cm_service().get('serviceState') == 'STARTED'
+    if cm_service_started:
+        logger.info('Stopping CM services ...')
+        command = deployment.stop_cm_service()
+        cluster_utils.wait_for_command(deployment, command['id'], 'Stop CM service', timeout=180)
+
+    client_node = get_client_node(cluster)
+    if client_node:
+        logger.info('Quiescing HBase ...')
+        # With the balancer off and the memstores flushed, no region moves or flushes are
+        # in flight when the containers freeze.
+        run_hbase_shell(client_node, ['balance_switch false',
+                                      'list.each { |table| flush table }'])
+
+    kafka_nodes = [node for node in cluster
+                   if node.group == 'secondary' and supervisor_program_exists(node, 'kafka')]
+    if kafka_nodes:
+        logger.info('Stopping Kafka brokers ...')
+        for node in kafka_nodes:
+            node.execute('supervisorctl stop kafka', quiet=True)
+
+    primary_node.put_file(PAUSE_STATE_FILE_PATH,
+                          json.dumps({'cm_service_started': cm_service_started,
+                                      'kafka_nodes': [node.fqdn for node in kafka_nodes]}))
+
+    logger.info('Pausing containers ...')
+    for node in cluster:
+        node.container.pause()
+    logger.info('Paused %s.', ', '.join(node.fqdn for node in cluster))
+
+
+def get_client_node(cluster):
+    """Get a node with client configurations deployed, preferring edge nodes.
+
+    Args:
+        cluster (:py:class:`clusterdock.models.Cluster`): The cluster.
+
+    Returns:
+        A :py:class:`clusterdock.models.Node` instance or ``None`` if no such node exists.
+    """
+    return next((node for group in ('edge', 'secondary')
+                 for node in cluster if node.group == group), None)
+
+
+def run_hbase_shell(node, commands):
+    """Run commands in the HBase shell of a node as the Kerberos admin principal.
+
+    Args:
+        node (:py:class:`clusterdock.models.Node`): The node on which to run the shell.
+        commands (:obj:`list`): HBase shell commands.
+
+    Returns:
+        A :py:class:`collections.namedtuple` instance with `exit_code` and `output` attributes.
+    """
+    return node.execute("kinit -kt {} {} && printf '{}' | hbase shell".format(
+        KEYTAB_FILE_PATH, KEYTAB_PRINCIPAL, ''.join('{}\\n'.format(command) for command in commands)
+    ), quiet=True)
+
+
+def supervisor_program_exists(node, program):
+    """Check whether supervisord on a node knows a program.
+
+    Args:
+        node (:py:class:`clusterdock.models.Node`): The node.
+        program (:obj:`str`): The name of the supervisord program.
+
+    Returns:
+        A :obj:`bool`.
+    """
+    return node.execute("supervisorctl avail | grep -q '^{} '".format(program),
+                        quiet=True).exit_code == 0
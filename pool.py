@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A pool of warm clusters that CI jobs lease and release.
+
+``pool serve`` keeps a number of clusters started and serves a small HTTP API on localhost. Jobs
+lease a ready cluster with ``pool lease`` (or ``POST /lease``) and give it back with
+``pool release`` (or ``POST /release/<instance>``). Released clusters are reset or replaced in
+the background.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.parse import parse_qs, quote, urlparse
+from urllib.request import Request, urlopen
+
+from . import cluster_utils, reset
+
+logger = logging.getLogger('clusterdock.{}'.format(__name__))
+
+DEFAULT_POOL_PORT = 7190
+DEFAULT_POOL_STATE_FILE_PATH = os.path.expanduser('~/.clusterdock-pool/state.json')
+DEFAULT_INSTANCE_NAME_PREFIX = 'pool'
+
+# Seconds to wait before building a cluster again after its build failed, so that a broken setup
+# does not keep the Docker host busy with builds that fail right away.
+BUILD_RETRY_INTERVAL = 60
+# Builds of a cluster after which it is marked failed instead of built again, e.g. with a broken
+# image. Its place in the pool stays taken until the pool is restarted.
+MAX_BUILD_ATTEMPTS = 3
+
+# Number of most recent samples the pool keeps per metric.
+METRICS_SAMPLE_SIZE = 1000
+METRIC_NAMES = ['build_time', 'reset_time', 'queue_wait', 'lease_duration']
+
+BUILDING = 'building'
+READY = 'ready'
+LEASED = 'leased'
+RESETTING = 'resetting'
+RECYCLING = 'recycling'
+FAILED = 'failed'
+
+
+class ClusterPool:
+    """Keep a number of clusters started and ready to be leased.
+
+    Every cluster of the pool is an instance of this topology started with
+    ``clusterdock start --instance-name <prefix>-<n>``, so it gets its own network, Kerberos realm
+    and Cloudera Manager port.
+
+    Args:
+        size (:obj:`int`): Number of ready clusters to keep warm. With ``reset_on_release``,
+            leased clusters count toward it, since they come back once they are reset.
+        start_args (:obj:`list`): Additional arguments for ``clusterdock start``.
+        state_file_path (:obj:`str`): JSON file in which the pool keeps its instances and
+            metrics. Build logs are written next to it.
+        instance_name_prefix (:obj:`str`, optional): Prefix of the instance names.
+            Default: ``pool``
+        max_concurrent_builds (:obj:`int`, optional): Number of clusters started at the same
+            time. Default: ``1``
+        reset_on_release (:obj:`bool`, optional): Reset the data of released clusters with
+            :py:func:`reset.reset_cluster` instead of replacing them. Clusters whose reset fails
+            are still replaced. Default: ``False``
+    """
+    def __init__(self, size, start_args, state_file_path,
+                 instance_name_prefix=DEFAULT_INSTANCE_NAME_PREFIX, max_concurrent_builds=1,
+                 reset_on_release=False):
+        self.size = size
+        self.reset_on_release = reset_on_release
+        self.start_args = list(start_args)
+        self.state_file_path = state_file_path
+        self.instance_name_prefix = instance_name_prefix
+
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent_builds)
+        self._waiting_leases = 0
+
+        state = {}
+        if os.path.exists(state_file_path):
+            with open(state_file_path) as state_file:
+                state = json.load(state_file)
+        self._instances = state.get('instances', {})
+        self._next_index = state.get('next_index', 1)
+        self._metrics = {name: deque(state.get('metrics', {}).get(name, []),
+                                     maxlen=METRICS_SAMPLE_SIZE)
+                         for name in METRIC_NAMES}
+
+        # Builds and replacements cut short by a restart of the pool cannot be trusted, and
+        # clusters that failed to build are given another chance.
+        for name, instance in self._instances.items():
+            if instance['state'] in (BUILDING, RESETTING, RECYCLING, FAILED):
+                logger.info('Discarding %s cluster %s left over from before ...',
+                            instance['state'], name)
+                instance['state'] = RECYCLING
+                self._executor.submit(self._recycle, name)
+
+    def maintain(self):
+        """Start new clusters until enough are ready or on their way."""
+        # Failed clusters keep their place, so that a broken image is not built over and over.
+        warm_states = (BUILDING, RESETTING, READY, FAILED)
+        if self.reset_on_release:
+            warm_states += (LEASED,)
+        with self._condition:
+            warm_instances = sum(1 for instance in self._instances.values()
+                                 if instance['state'] in warm_states)
+            for _ in range(self.size - warm_instances):
+                name = '{}-{}'.format(self.instance_name_prefix, self._next_index)
+                self._next_index += 1
+                self._instances[name] = {'state': BUILDING, 'requested_at': time.time()}
+                self._executor.submit(self._build, name)
+            self._save_state()
+
+    def lease(self, holder=None, timeout=None):
+        """Lease a ready cluster, waiting for one if none is ready yet.
+
+        Args:
+            holder (:obj:`str`, optional): Who leases the cluster (e.g. a CI job URL).
+                Default: ``None``
+            timeout (:obj:`float`, optional): Seconds to wait for a ready cluster.
+                Default: ``None`` (wait forever)
+
+        Returns:
+            A :obj:`dict` describing the leased instance.
+        """
+        requested_at = time.time()
+        with self._condition:
+            self._waiting_leases += 1
+            try:
+                if not self._condition.wait_for(self._get_ready_instance_names, timeout=timeout):
+                    raise TimeoutError('Timed out after {} seconds waiting '
+                                       'for a ready cluster.'.format(timeout))
+            finally:
+                self._waiting_leases -= 1
+            # The cluster that has been ready the longest goes first.
+            name = min(self._get_ready_instance_names(),
+                       key=lambda name: self._instances[name]['ready_at'])
+            instance = self._instances[name]
+            instance.update(state=LEASED, holder=holder, leased_at=time.time())
+            self._record('queue_wait', instance['leased_at'] - requested_at)
+            self._save_state()
+            leased_instance = dict(instance, name=name)
+        logger.info('Leased cluster %s to %s.', name, holder)
+        self.maintain()
+        return leased_instance
+
+    def release(self, name):
+        """Give a leased cluster back to the pool, which resets or replaces it in the background.
+
+        Args:
+            name (:obj:`str`): The instance name of the cluster.
+        """
+        with self._condition:
+            instance = self._instances.get(name)
+            if not instance or instance['state'] != LEASED:
+                raise KeyError('Cluster {} is not leased.'.format(name))
+            self._record('lease_duration', time.time() - instance['leased_at'])
+            instance['state'] = RESETTING if self.reset_on_release else RECYCLING
+            self._save_state()
+        logger.info('Cluster %s was released.', name)
+        self._executor.submit(self._reset if self.reset_on_release else self._recycle, name)
+
+    def get_status(self):
+        """Get the instances of the pool and statistics of its metrics.
+
+        Returns:
+            A :obj:`dict` with ``instances``, ``waiting_leases`` and ``metrics`` keys.
+        """
+        with self._condition:
+            return {'instances': {name: dict(instance)
+                                  for name, instance in self._instances.items()},
+                    'waiting_leases': self._waiting_leases,
+                    'metrics': {name: _summarize(samples)
+                                for name, samples in self._metrics.items()}}
+
+    def _get_ready_instance_names(self):
+        return [name for name, instance in self._instances.items() if instance['state'] == READY]
+
+    def _build(self, name):
+        log_file_path = os.path.join(os.path.dirname(self.state_file_path), '{}.log'.format(name))
+        logger.info('Starting cluster %s (log in %s) ...', name, log_file_path)
+        start_time = time.time()
+        try:
+            with open(log_file_path, 'w') as log_file:
+                cluster_utils.start_cluster_instance(name, self.start_args, log_file=log_file)
+            primary_node = cluster_utils.attach_cluster(name).primary_node
+        except Exception:
+            logger.exception('Starting cluster %s failed.', name)
+            self._retry_build(name)
+            return
+
+        with self._condition:
+            self._instances[name].update(state=READY,
+                                         ready_at=time.time(),
+                                         primary_node=primary_node.fqdn,
+                                         server_url=cluster_utils.get_server_url(primary_node))
+            self._record('build_time', time.time() - start_time)
+            self._save_state()
+            self._condition.notify_all()
+        logger.info('Cluster %s is ready after %.0f seconds.', name, time.time() - start_time)
+
+    def _reset(self, name):
+        logger.info('Resetting cluster %s ...', name)
+        start_time = time.time()
+        try:
+            # OpenTSDB keeps its tables, since it only creates them in post_run.sh.
+            reset.reset_cluster(cluster_utils.attach_cluster(name),
+                                services=list(reset.RESETTABLE_SERVICES),
+                                keep_tsdb_tables=True)
+        except Exception:
+            logger.exception('Resetting cluster %s failed, replacing it.', name)
+            self._recycle(name)
+            return
+
+        with self._condition:
+            self._instances[name].update(state=READY, ready_at=time.time(), holder=None)
+            self._record('reset_time', time.time() - start_time)
+            self._save_state()
+            self._condition.notify_all()
+        logger.info('Cluster %s is ready again after %.0f seconds.', name, time.time() - start_time)
+
+    def _retry_build(self, name):
+        try:
+            cluster_utils.remove_cluster(name)
+        except Exception:
+            logger.exception('Failed to remove cluster %s.', name)
+        with self._condition:
+            instance = self._instances[name]
+            instance['failed_builds'] = instance.get('failed_builds', 0) + 1
+            if instance['failed_builds'] >= MAX_BUILD_ATTEMPTS:
+                instance['state'] = FAILED
+                self._save_state()
+                logger.error('Cluster %s failed to build %s times, giving up on it.',
+                             name, instance['failed_builds'])
+                return
+            instance['retry_at'] = time.time() + BUILD_RETRY_INTERVAL
+            self._save_state()
+        logger.info('Building cluster %s again in %s seconds ...', name, BUILD_RETRY_INTERVAL)
+        # The retry waits on a timer of its own instead of a build slot of the executor.
+        timer = threading.Timer(BUILD_RETRY_INTERVAL, self._executor.submit,
+                                args=[self._build, name])
+        timer.daemon = True
+        timer.start()
+
+    def _recycle(self, name):
+        try:
+            cluster_utils.remove_cluster(name)
+        except Exception:
+            logger.exception('Failed to remove cluster %s.', name)
+        with self._condition:
+            self._instances.pop(name, None)
+            self._save_state()
+        self.maintain()
+
+    def _record(self, metric, value):
+        self._metrics[metric].append(round(value, 3))
+
+    def _save_state(self):
+        state = {'instances': self._instances,
+                 'next_index': self._next_index,
+                 'metrics': {name: list(samples) for name, samples in self._metrics.items()}}
+        # Written to a temporary file first so that a crash never leaves a truncated state file.
+        temporary_file_path = '{}.tmp'.format(self.state_file_path)
+        with open(temporary_file_path, 'w') as state_file:
+            json.dump(state, state_file, indent=2)
+        os.replace(temporary_file_path, self.state_file_path)
+
+
+def _summarize(samples):
+    if not samples:
+        return {'count': 0}
+    ordered_samples = sorted(samples)
+    return {'count': len(ordered_samples),
+            'mean': round(sum(ordered_samples) / len(ordered_samples), 3),
+            'p50': ordered_samples[len(ordered_samples) // 2],
+            'p95': ordered_samples[min(len(ordered_samples) - 1,
+                                       int(len(ordered_samples) * 0.95))],
+            'max': ordered_samples[-1]}
+
+
+class _PoolRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if urlparse(self.path).path == '/status':
+            self._send_json(200, self.server.pool.get_status())
+        else:
+            self._send_json(404, {'error': 'Unknown path {}.'.format(self.path)})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        try:
+            if url.path == '/lease':
+                timeout = float(query['timeout']) if 'timeout' in query else None
+                self._send_json(200, self.server.pool.lease(holder=query.get('holder'),
+                                                            timeout=timeout))
+            elif url.path.startswith('/release/'):
+                self.server.pool.release(url.path[len('/release/'):])
+                self._send_json(200, {})
+            else:
+                self._send_json(404, {'error': 'Unknown path {}.'.format(self.path)})
+        except TimeoutError as exception:
+            self._send_json(503, {'error': str(exception)})
+        except KeyError as exception:
+            self._send_json(409, {'error': exception.args[0]})
+
+    def _send_json(self, status, body):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        logger.debug('%s - %s', self.address_string(), format % args)
+
+
+def main(args):
+    if args.pool_command == 'serve':
+        _serve(args)
+        return
+
+    url = 'http://localhost:{}'.format(args.port)
+    if args.pool_command == 'lease':
+        query = '&'.join('{}={}'.format(key, quote(str(value)))
+                         for key, value in [('holder', args.holder), ('timeout', args.timeout)]
+                         if value is not None)
+        response = _request(Request('{}/lease?{}'.format(url, query), method='POST'))
+    elif args.pool_command == 'release':
+        response = _request(Request('{}/release/{}'.format(url, args.instance), method='POST'))
+    else:
+        response = _request(Request('{}/status'.format(url)))
+    print(json.dumps(response, indent=2))
+
+
+def _serve(args):
+    os.makedirs(os.path.dirname(args.state_file), exist_ok=True)
+    # Everything after -- is handed to clusterdock start for every cluster of the pool.
+    start_args = [arg for arg in args.start_args if arg != '--']
+    pool = ClusterPool(size=args.size,
+                       start_args=start_args,
+                       state_file_path=args.state_file,
+                       instance_name_prefix=args.prefix,
+                       max_concurrent_builds=args.max_concurrent_builds,
+                       reset_on_release=args.reset_on_release)
+    pool.maintain()
+
+    server = ThreadingHTTPServer(('localhost', args.port), _PoolRequestHandler)
+    server.pool = pool
+    logger.info('Serving pool of %s cluster(s) on http://localhost:%s ...', args.size, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info('Stopped serving pool. Its clusters keep running.')
+
+
+def _request(request):
+    try:
+        with urlopen(request) as response:
+            return json.loads(response.read().decode())
+    except HTTPError as error:
+        raise Exception('Pool request failed ({}: {}).'.format(
+            error.code, json.loads(error.read().decode()).get('error')
+        ))
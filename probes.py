@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Readiness probes that tell when a service can actually be used.
+
+A CM start command finishes once every role of a service is running, which says nothing about
+e.g. HDFS having left safe mode, and a service is often usable long before its last role is up.
+Probes ask the services themselves instead. They run from a node of the cluster, all at the same
+time, and each one is a single cheap command (an HTTP request or a TCP exchange).
+"""
+
+import json
+import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from clusterdock.utils import wait_for_condition
+
+logger = logging.getLogger('clusterdock.{}'.format(__name__))
+
+NAMENODE_HTTP_PORT = 50070
+RESOURCEMANAGER_HTTP_PORT = 8088
+HBASE_MASTER_HTTP_PORT = 60010
+HIVESERVER2_PORT = 10000
+ZOOKEEPER_PORT = 2181
+
+
+class Probe:
+    """A readiness check of a single service endpoint.
+
+    Args:
+        name (:obj:`str`): What is checked, used in log and error messages.
+        command (:obj:`str`): Command run on the probing node.
+        is_ready (optional): Called with the output of a successful command and returns whether
+            the service is ready. Default: ``None`` (the command succeeding is enough)
+    """
+    def __init__(self, name, command, is_ready=None):
+        self.name = name
+        self.command = command
+        self.is_ready = is_ready
+
+    def check(self, node):
+        """Run the probe once.
+
+        Args:
+            node (:py:class:`clusterdock.models.Node`): The node to run the probe from.
+
+        Returns:
+            ``True`` if the service is ready.
+        """
+        result = node.execute(self.command, quiet=True)
+        if result.exit_code != 0:
+            return False
+        if self.is_ready is None:
+            return True
+        try:
+            return bool(self.is_ready(result.output))
+        except (ValueError, KeyError, IndexError, TypeError):
+            # A half-started service may answer with an error page or partial data.
+            return False
+
+
+def _get_jmx_beans(output):
+    return {bean['name']: bean for bean in json.loads(output)['beans']}
+
+
+def _tcp_exchange_command(host, port, request):
+    # Plain bash, since nc is not available on every image.
+    return ("bash -c 'exec 3<>/dev/tcp/{0}/{1} && echo {2} >&3 && cat <&3'".format(host, port,
+                                                                                    request))
+
+
+def namenode_probe(fqdn):
+    """A NameNode is ready once it has left safe mode."""
+    def is_ready(output):
+        return _get_jmx_beans(output)['Hadoop:service=NameNode,name=NameNodeInfo']['Safemode'] == ''
+
+    return Probe(name='NameNode on {}'.format(fqdn),
+                 command="curl -sf 'http://{}:{}/jmx?qry=Hadoop:service=NameNode,"
+                         "name=NameNodeInfo'".format(fqdn, NAMENODE_HTTP_PORT),
+                 is_ready=is_ready)
+
+
+def resourcemanager_probe(fqdn):
+    """A ResourceManager is ready once a NodeManager has registered with it."""
+    def is_ready(output):
+        return json.loads(output)['clusterMetrics']['activeNodes'] > 0
+
+    return Probe(name='ResourceManager on {}'.format(fqdn),
+                 command='curl -sf http://{}:{}/ws/v1/cluster/metrics'.format(
+                     fqdn, RESOURCEMANAGER_HTTP_PORT
+                 ),
+                 is_ready=is_ready)
+
+
+def hbase_master_probe(fqdn):
+    """An HBase Master is ready once it is the active master, at least one RegionServer checked
+    in and no region is in transition, which is when it finishes initializing (i.e. has assigned
+    ``hbase:meta`` and the namespace table)."""
+    def is_ready(output):
+        beans = _get_jmx_beans(output)
+        server = beans['Hadoop:service=HBase,name=Master,sub=Server']
+        # HBase 1.x misspells the name of this bean (AssignmentManger). It is registered only
+        # once the master becomes active, after its Server bean.
+        assignment_manager = next((bean for name, bean in beans.items()
+                                   if name.startswith('Hadoop:service=HBase,name=Master,'
+                                                      'sub=AssignmentMan')),
+                                  None)
+        if assignment_manager is None:
+            return False
+        return (server['tag.isActiveMaster'] == 'true'
+                and server['numRegionServers'] > 0
+                and assignment_manager['ritCount'] == 0)
+
+    return Probe(name='HBase Master on {}'.format(fqdn),
+                 command="curl -sf 'http://{}:{}/jmx?qry=Hadoop:service=HBase,name=Master,"
+                         "sub=*'".format(fqdn, HBASE_MASTER_HTTP_PORT),
+                 is_ready=is_ready)
+
+
+def zookeeper_probe(fqdn, port=ZOOKEEPER_PORT):
+    """A ZooKeeper server is ready once it answers ``ruok`` with ``imok``."""
+    return Probe(name='ZooKeeper on {}'.format(fqdn),
+                 command=_tcp_exchange_command(fqdn, port, 'ruok'),
+                 is_ready=lambda output: output.strip() == 'imok')
+
+
+def port_probe(name, fqdn, port):
+    """A service is ready once it accepts connections on a port."""
+    return Probe(name='{} on {}'.format(name, fqdn),
+                 command="bash -c 'exec 3<>/dev/tcp/{}/{}'".format(fqdn, port))
+
+
+def kafka_brokers_probe(zookeeper_fqdn, brokers, port=ZOOKEEPER_PORT):
+    """Kafka is ready once a number of brokers have registered in ZooKeeper.
+
+    The ephemeral nodes under ``/brokers/ids`` are listed with the ``dump`` command, which saves
+    starting a ZooKeeper client JVM for every check.
+    """
+    def is_ready(output):
+        broker_ids = {line.strip() for line in output.splitlines()
+                      if line.strip().startswith('/brokers/ids/')}
+        return len(broker_ids) >= brokers
+
+    return Probe(name='Kafka brokers registered in ZooKeeper on {}'.format(zookeeper_fqdn),
+                 command=_tcp_exchange_command(zookeeper_fqdn, port, 'dump'),
+                 is_ready=is_ready)
+
+
+# Probes of the roles of CM services, by role type. Each one is created with the FQDN of the
+# role's host.
+ROLE_PROBES = {
+    'SERVER': zookeeper_probe,
+    'NAMENODE': namenode_probe,
+    'RESOURCEMANAGER': resourcemanager_probe,
+    'MASTER': hbase_master_probe,
+    'HIVESERVER2': lambda fqdn: port_probe('HiveServer2', fqdn, HIVESERVER2_PORT),
+}
+
+
+def get_service_probes(deployment, hosts, cluster_name, service_name):
+    """Get the probes of the roles of a CM service.
+
+    Args:
+        deployment (:py:class:`cm.ClouderaManagerDeployment`): The CM deployment.
+        hosts (:py:class:`hosts.HostRegistry`): The hosts of the cluster.
+        cluster_name (:obj:`str`): The name of the cluster.
+        service_name (:obj:`str`): The name of the service.
+
+    Returns:
+        A :obj:`list` of :py:class:`Probe` instances, empty if none of the roles can be probed.
+    """
+    fqdns_by_role_type = defaultdict(list)
+    for role in deployment.get_service_roles(cluster_name=cluster_name,
+                                             service_name=service_name,
+                                             fields=['type', 'hostRef.hostId']):
+        if role['type'] in ROLE_PROBES:
+            fqdns_by_role_type[role['type']].append(
+                hosts.get_fqdn(host_id=role['hostRef']['hostId'])
+            )
+    return [ROLE_PROBES[role_type](fqdn)
+            for role_type, fqdns in fqdns_by_role_type.items()
+            for fqdn in sorted(fqdns)]
+
+
+def wait_for_probes(node, probes, timeout=600, abort=None):
+    """Wait until every probe passes, checking all of them at the same time.
+
+    Args:
+        node (:py:class:`clusterdock.models.Node`): The node to run the probes from.
+        probes (:obj:`list`): A list of :py:class:`Probe` instances.
+        timeout (:obj:`int`, optional): Seconds to wait. Default: ``600``
+        abort (optional): Called before every check. It raises to stop waiting, e.g. once the
+            command that starts the service has failed. Default: ``None``
+    """
+    def wait_for_probe(probe):
+        def condition(probe):
+            if abort is not None:
+                abort()
+            ready = probe.check(node)
+            logger.debug('%s is %sready.', probe.name, '' if ready else 'not ')
+            return ready
+
+        def success(time):
+            logger.debug('%s became ready after %s seconds.', probe.name, time)
+
+        def failure(timeout):
+            raise TimeoutError('Timed out after {} seconds waiting for {} '
+                               'to become ready.'.format(timeout, probe.name))
+
+        wait_for_condition(condition=condition, condition_args=[probe],
+                           time_between_checks=1, timeout=timeout,
+                           success=success, failure=failure)
+
+    if probes:
+        with ThreadPoolExecutor(max_workers=len(probes)) as executor:
+            list(executor.map(wait_for_probe, probes))
@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""pytest plugin that runs integration tests against a cluster of this topology.
+
+Enable it with ``-p topology_clusterdock_de_cdh5120.pytest_plugin`` (with the directory that
+contains the topology on ``PYTHONPATH``) or with ``pytest_plugins`` in a ``conftest.py``. Tests then
+use the session-scoped ``clusterdock_cluster`` fixture and the per-test ``clusterdock_namespace``
+fixture.
+"""
+
+import base64
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import shlex
+import uuid
+from collections import defaultdict
+
+import pytest
+from clusterdock.models import client
+
+from . import cluster_utils, kerberos, reset
+from .cm import ClouderaManagerDeployment
+from .kerberos import KEYTAB_FILE_PATH, KEYTAB_PRINCIPAL
+from .pause import get_client_node, supervisor_program_exists
+from .start import DEFAULT_CLUSTER_NAME
+
+logger = logging.getLogger('clusterdock.{}'.format(__name__))
+
+DEFAULT_INSTANCE_NAME = 'pytest'
+
+# A cluster is reused by later sessions as long as it was started with the same start arguments
+# by the same topology code, which is recorded in this file on its primary node.
+FINGERPRINT_FILE_PATH = '/root/.clusterdock-fingerprint'
+# Patterns of the files of the topology directory that make up the topology code. Every module is
+# included, since start imports most of them.
+FINGERPRINTED_FILE_PATTERNS = ['*.py', 'topology.yaml', 'images/*/Dockerfile']
+
+# Role types of CM services mapped to endpoint names and the address format of each role host.
+ROLE_ENDPOINTS = [
+    ('NAMENODE', 'hdfs', 'hdfs://{hostname}:8020'),
+    ('RESOURCEMANAGER', 'yarn_resourcemanager', '{hostname}:8032'),
+    ('SERVER', 'zookeeper', '{hostname}:2181'),
+    ('MASTER', 'hbase_master', '{hostname}:60000'),
+    ('HIVEMETASTORE', 'hive_metastore', 'thrift://{hostname}:9083'),
+    ('HIVESERVER2', 'hiveserver2',
+     'jdbc:hive2://{hostname}:10000/default;principal=hive/{hostname}@{realm}'),
+    ('OOZIE_SERVER', 'oozie', 'http://{hostname}:11000/oozie'),
+    ('HUE_SERVER', 'hue', 'http://{hostname}:8888'),
+]
+KAFKA_BROKER_PORT = 9092
+
+HDFS_TEST_ROOT = '/user/cloudera-scm/pytest'
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('clusterdock')
+    group.addoption('--clusterdock-instance',
+                    default=DEFAULT_INSTANCE_NAME,
+                    help='Instance name of the cluster that is started (or reused) for the tests '
+                         '(default: {})'.format(DEFAULT_INSTANCE_NAME))
+    group.addoption('--clusterdock-start-args',
+                    default='',
+                    help='Arguments for clusterdock start, as a single string')
+    group.addoption('--clusterdock-network',
+                    help='Run the tests against the cluster already running on this Docker '
+                         'network, as it is')
+    group.addoption('--clusterdock-keep-namespaces',
+                    action='store_true',
+                    help='Leave the HDFS directories, HBase namespaces, Kafka topics and Hive '
+                         'databases of tests in place')
+
+
+@pytest.fixture(scope='session')
+def clusterdock_cluster(request, tmp_path_factory):
+    """The cluster of the test session, started or reused as needed."""
+    network = request.config.getoption('clusterdock_network')
+    if network:
+        cluster = cluster_utils.attach_cluster(network)
+    else:
+        cluster = get_fingerprinted_cluster(
+            instance_name=request.config.getoption('clusterdock_instance'),
+            start_args=shlex.split(request.config.getoption('clusterdock_start_args'))
+        )
+    return ClusterFixture(cluster, str(tmp_path_factory.mktemp('clusterdock')))
+
+
+@pytest.fixture
+def clusterdock_namespace(request, clusterdock_cluster):
+    """Resources of a single test, created on first use and removed after the test."""
+    name = '{}_{}'.format(re.sub(r'[^a-z0-9]+', '_', request.node.name.lower())[:40],
+                          uuid.uuid4().hex[:8])
+    namespace = TestNamespace(clusterdock_cluster, name)
+    yield namespace
+    if not request.config.getoption('clusterdock_keep_namespaces'):
+        namespace.remove()
+
+
+def get_fingerprinted_cluster(instance_name, start_args):
+    """Get a running cluster instance started with the given arguments by the current topology
+    code, starting it afresh if the running one does not match (or there is none).
+
+    Args:
+        instance_name (:obj:`str`): The instance name of the cluster.
+        start_args (:obj:`list`): Additional arguments for ``clusterdock start``.
+
+    Returns:
+        A :py:class:`clusterdock.models.Cluster` instance, as returned by
+        :py:func:`cluster_utils.attach_cluster`.
+    """
+    fingerprint = _get_fingerprint(start_args)
+    try:
+        cluster = cluster_utils.attach_cluster(instance_name)
+    except Exception as exception:
+        logger.debug('No cluster to reuse (%s).', exception)
+    else:
+        cluster_fingerprint = cluster.primary_node.execute(
+            'cat {} 2>/dev/null'.format(FINGERPRINT_FILE_PATH), quiet=True
+        ).output.strip()
+        if cluster_fingerprint == fingerprint and _images_are_current(cluster):
+            logger.info('Reusing cluster %s.', instance_name)
+            return cluster
+        logger.info('Cluster %s does not match, replacing it ...', instance_name)
+        cluster_utils.remove_cluster(instance_name)
+
+    logger.info('Starting cluster %s ...', instance_name)
+    cluster_utils.start_cluster_instance(instance_name, start_args)
+    cluster = cluster_utils.attach_cluster(instance_name)
+    cluster.primary_node.put_file(FINGERPRINT_FILE_PATH, fingerprint)
+    return cluster
+
+
+def _get_fingerprint(start_args):
+    fingerprint = hashlib.sha256(json.dumps(list(start_args)).encode())
+    file_paths = sorted(file_path
+                        for pattern in FINGERPRINTED_FILE_PATTERNS
+                        for file_path in glob.glob(os.path.join(cluster_utils.TOPOLOGY_DIRECTORY,
+                                                                pattern)))
+    for file_path in file_paths:
+        fingerprint.update(os.path.relpath(file_path, cluster_utils.TOPOLOGY_DIRECTORY).encode())
+        with open(file_path, 'rb') as file_:
+            fingerprint.update(file_.read())
+    return fingerprint.hexdigest()
+
+
+def _images_are_current(cluster):
+    # A cluster started from images that were pulled again since is not reused.
+    for node in cluster:
+        if node.container.image.id != client.images.get(node.image).id:
+            logger.debug('Image %s of %s changed.', node.image, node.fqdn)
+            return False
+    return True
+
+
+class ClusterFixture:
+    """A running cluster, as seen by tests.
+
+    Args:
+        cluster (:py:class:`clusterdock.models.Cluster`): The cluster, as returned by
+            :py:func:`cluster_utils.attach_cluster`.
+        client_config_dir (:obj:`str`): Local directory for the Kerberos client configuration.
+
+    Attributes:
+        cluster: The :py:class:`clusterdock.models.Cluster` instance.
+        primary_node: The primary :py:class:`clusterdock.models.Node`.
+        client_node: The :py:class:`clusterdock.models.Node` with client configurations on which
+            commands run by default (an edge node, if there is one).
+        nodes: A :obj:`dict` of hostnames mapped to :py:class:`clusterdock.models.Node` instances.
+        deployment: The cluster's :py:class:`ClouderaManagerDeployment`.
+        kerberos_realm: The Kerberos realm of the cluster.
+        endpoints: A :obj:`dict` of endpoint names (e.g. ``hdfs``, ``hiveserver2``, ``kafka``)
+            mapped to comma-separated addresses.
+        kafka_nodes: A :obj:`list` of the nodes running Kafka.
+    """
+    def __init__(self, cluster, client_config_dir):
+        self.cluster = cluster
+        self.primary_node = cluster.primary_node
+        self.client_node = get_client_node(cluster)
+        self.nodes = {node.hostname: node for node in cluster}
+        self.deployment = ClouderaManagerDeployment(cluster_utils.get_server_url(self.primary_node))
+        self.kerberos_realm = kerberos.get_realm(self.primary_node)
+        self.kafka_nodes = [node for node in cluster
+                            if node.group == 'secondary'
+                            and supervisor_program_exists(node, 'kafka')]
+        self.endpoints = self._get_endpoints()
+        self._client_config_dir = client_config_dir
+        self._client_environment = None
+
+    def execute(self, command, node=None):
+        """Execute a command with a Kerberos ticket of the admin principal.
+
+        Args:
+            command (:obj:`str`): The command.
+            node (:py:class:`clusterdock.models.Node`, optional): The node on which to execute the
+                command. Default: ``None`` (the client node)
+
+        Returns:
+            A :obj:`str` of the command's output.
+        """
+        return cluster_utils.execute(node or self.client_node, 'kinit -kt {} {} && {}'.format(
+            KEYTAB_FILE_PATH, KEYTAB_PRINCIPAL, command
+        ))
+
+    @property
+    def client_environment(self):
+        """Environment variables under which Kerberos clients on this host use the cluster's
+        realm and admin principal. ``kinit -k`` obtains a ticket with them."""
+        if self._client_environment is None:
+            krb5_conf_path = os.path.join(self._client_config_dir, 'krb5.conf')
+            with open(krb5_conf_path, 'w') as krb5_conf:
+                krb5_conf.write(self.primary_node.get_file('/etc/krb5.conf'))
+            # The keytab is binary, which get_file does not handle.
+            keytab_path = os.path.join(self._client_config_dir, 'cloudera-scm.keytab')
+            with open(keytab_path, 'wb') as keytab:
+                keytab.write(base64.b64decode(cluster_utils.execute(
+                    self.primary_node, 'base64 {}'.format(KEYTAB_FILE_PATH)
+                )))
+            os.chmod(keytab_path, 0o600)
+            self._client_environment = {
+                'KRB5_CONFIG': krb5_conf_path,
+                'KRB5_CLIENT_KTNAME': keytab_path,
+                'KRB5CCNAME': os.path.join(self._client_config_dir, 'krb5cc'),
+                'KRB5_PRINCIPAL': '{}@{}'.format(KEYTAB_PRINCIPAL, self.kerberos_realm),
+            }
+        return dict(self._client_environment)
+
+    def _get_endpoints(self):
+        hostnames = {host['hostId']: host['hostname']
+                     for host in self.deployment.get_all_hosts(fields=['hostId', 'hostname'])}
+        role_hosts = defaultdict(list)
+        for service in self.deployment.get_cluster_services(DEFAULT_CLUSTER_NAME):
+            for role in self.deployment.get_service_roles(DEFAULT_CLUSTER_NAME, service['name'],
+                                                          fields=['type', 'hostRef.hostId']):
+                role_hosts[role['type']].append(hostnames[role['hostRef']['hostId']])
+
+        endpoints = {'cloudera_manager': self.deployment.api_client.server_url}
+        for role_type, name, address_format in ROLE_ENDPOINTS:
+            if role_hosts[role_type]:
+                endpoints[name] = ','.join(address_format.format(hostname=hostname,
+                                                                 realm=self.kerberos_realm)
+                                           for hostname in sorted(role_hosts[role_type]))
+        if self.kafka_nodes:
+            endpoints['kafka'] = ','.join('{}:{}'.format(node.fqdn, KAFKA_BROKER_PORT)
+                                          for node in self.kafka_nodes)
+        return endpoints
+
+
+class TestNamespace:
+    """Resources that keep the data of a single test apart from that of any other test.
+
+    HDFS directories, HBase namespaces and Hive databases are only created when a test first asks
+    for them, so tests pay only for what they use.
+
+    Args:
+        cluster_fixture (:py:class:`ClusterFixture`): The cluster.
+        name (:obj:`str`): Name of the namespace, unique to the test.
+
+    Attributes:
+        name: Name of the namespace.
+        kafka_topic_prefix: Prefix for the Kafka topics of the test. Topics with this prefix are
+            deleted after the test.
+    """
+    # Keep pytest from collecting this class as a test case.
+    __test__ = False
+
+    def __init__(self, cluster_fixture, name):
+        self.name = name
+        self.kafka_topic_prefix = '{}.'.format(name)
+        self._cluster_fixture = cluster_fixture
+        self._created = set()
+
+    @property
+    def hdfs_dir(self):
+        """The HDFS home directory of the test."""
+        path = '{}/{}'.format(HDFS_TEST_ROOT, self.name)
+        if 'hdfs' not in self._created:
+            self._cluster_fixture.execute('hdfs dfs -mkdir -p {}'.format(path))
+            self._created.add('hdfs')
+        return path
+
+    @property
+    def hbase_namespace(self):
+        """The HBase namespace of the test."""
+        if 'hbase' not in self._created:
+            self._hbase_shell('create_namespace "{}"'.format(self.name))
+            self._created.add('hbase')
+        return self.name
+
+    @property
+    def hive_database(self):
+        """The Hive database of the test."""
+        if 'hive' not in self._created:
+            self._cluster_fixture.execute("hive -S -e 'CREATE DATABASE {}'".format(self.name))
+            self._created.add('hive')
+        return self.name
+
+    def remove(self):
+        """Remove everything the test created in its namespace."""
+        if 'hdfs' in self._created:
+            self._cluster_fixture.execute('hdfs dfs -rm -r -f -skipTrash {}/{}'.format(
+                HDFS_TEST_ROOT, self.name
+            ))
+        if 'hbase' in self._created:
+            self._hbase_shell('list.select {{ |t| t.start_with?("{0}:") }}'
+                              '.each {{ |t| disable t; drop t }}; '
+                              'drop_namespace "{0}"'.format(self.name))
+        if 'hive' in self._created:
+            self._cluster_fixture.execute(
+                "hive -S -e 'DROP DATABASE IF EXISTS {} CASCADE'".format(self.name)
+            )
+        for node in self._cluster_fixture.kafka_nodes:
+            topics = [topic for topic in reset.list_kafka_topics(node)
+                      if topic.startswith(self.kafka_topic_prefix)]
+            if topics:
+                reset.enable_kafka_topic_deletion(node)
+                reset.delete_kafka_topics(node, topics)
+        self._created.clear()
+
+    def _hbase_shell(self, script):
+        output = self._cluster_fixture.execute("printf '{}\\n' | hbase shell".format(script))
+        if 'ERROR' in output:
+            raise Exception('HBase shell reported an error: {}'.format(output))
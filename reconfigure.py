@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import logging
+from collections import OrderedDict, defaultdict
+
+from . import cluster_utils, probes
+from .cm import ClouderaManagerDeployment
+from .hosts import HostRegistry
+from .start import DEFAULT_CLUSTER_NAME
+
+logger = logging.getLogger('clusterdock.{}'.format(__name__))
+
+# A role needs a restart to pick up a new configuration, unless CM can refresh it in place.
+STALE = 'STALE'
+STALE_REFRESHABLE = 'STALE_REFRESHABLE'
+
+# Service configs naming the service another one depends on (e.g. hbase's hdfs_service) end
+# with this.
+DEPENDENCY_CONFIG_SUFFIX = '_service'
+
+
+def main(args):
+    cluster = cluster_utils.attach_cluster(args.network)
+    deployment = ClouderaManagerDeployment(cluster_utils.get_server_url(cluster.primary_node))
+
+    changes = OrderedDict()
+    if args.file:
+        with open(args.file) as changes_file:
+            for target, configs in json.load(changes_file).items():
+                changes.setdefault(target, OrderedDict()).update(configs)
+    for change in args.changes:
+        target, name, value = parse_change(change)
+        changes.setdefault(target, OrderedDict())[name] = value
+
+    reconfigure(cluster, deployment, changes, restart=not args.no_restart)
+
+
+def parse_change(change):
+    """Parse a config change given on the command line.
+
+    Args:
+        change (:obj:`str`): A change like ``hdfs:dfs_replication=2`` or
+            ``hbase/hbase-REGIONSERVER-BASE:hbase_regionserver_handler_count=60``.
+
+    Returns:
+        A :obj:`tuple` of the target (service name, optionally followed by a slash and the name of
+        a role config group), the config name and the value.
+    """
+    target, separator, config = change.partition(':')
+    name, equals, value = config.partition('=')
+    if not (separator and equals and target and name):
+        raise ValueError('Cannot parse config change {} (expected '
+                         'service[/role_config_group]:name=value).'.format(change))
+    return target, name, value
+
+
+def reconfigure(cluster, deployment, changes, cluster_name=DEFAULT_CLUSTER_NAME, restart=True):
+    """Apply config changes and restart only the roles whose configuration became stale.
+
+    Roles are restarted service by service in dependency order, with services that don't depend
+    on each other restarted at the same time, and every stage waits until its services pass
+    their readiness probes. Roles that CM can refresh are refreshed instead, and client configs
+    are only deployed for services whose client configuration became stale.
+
+    Args:
+        cluster (:py:class:`clusterdock.models.Cluster`): The cluster.
+        deployment (:py:class:`cm.ClouderaManagerDeployment`): The CM deployment.
+        changes (:obj:`dict`): Targets (see :py:func:`parse_change`) mapped to dictionaries of
+            config names and values.
+        cluster_name (:obj:`str`, optional): The name of the cluster.
+            Default: :py:const:`start.DEFAULT_CLUSTER_NAME`
+        restart (:obj:`bool`, optional): Restart, refresh and deploy as needed, instead of only
+            logging what that would take. Default: ``True``
+    """
+    for target, configs in changes.items():
+        service_name, _, role_config_group_name = target.partition('/')
+        logger.info('Updating %s of %s ...', ', '.join(configs), target)
+        if role_config_group_name:
+            deployment.update_service_role_config_group_config(
+                cluster_name=cluster_name, service_name=service_name,
+                role_config_group_name=role_config_group_name, configs=configs
+            )
+        else:
+            deployment.update_service_config(cluster_name=cluster_name,
+                                             service_name=service_name,
+                                             configs=configs)
+
+    services = deployment.get_cluster_services(cluster_name=cluster_name)
+    roles_by_service = {service['name']: deployment.get_service_roles(cluster_name=cluster_name,
+                                                                      service_name=service['name'])
+                        for service in services}
+    stale_roles = {service_name: [role['name'] for role in roles
+                                  if role.get('configStalenessStatus') == STALE]
+                   for service_name, roles in roles_by_service.items()}
+    refreshable_roles = {service_name: [role['name'] for role in roles
+                                        if role.get('configStalenessStatus') == STALE_REFRESHABLE]
+                         for service_name, roles in roles_by_service.items()}
+    stale_client_services = [service['name'] for service in services
+                             if service.get('clientConfigStalenessStatus') in (STALE,
+                                                                               STALE_REFRESHABLE)]
+
+    stages = [[service_name for service_name in stage if stale_roles[service_name]]
+              for stage in get_restart_stages(deployment, cluster_name, services)]
+    stages = [stage for stage in stages if stage]
+    for index, stage in enumerate(stages, start=1):
+        logger.info('Stage %s: restarting %s.', index,
+                    '; '.join('{} ({})'.format(service_name, ', '.join(stale_roles[service_name]))
+                              for service_name in stage))
+    for service_name, role_names in refreshable_roles.items():
+        if role_names:
+            logger.info('Refreshing %s of %s.', ', '.join(role_names), service_name)
+    if stale_client_services:
+        logger.info('Deploying client config of %s.', ', '.join(stale_client_services))
+    if not (stages or any(refreshable_roles.values()) or stale_client_services):
+        logger.info('No role has a stale configuration.')
+    if not restart:
+        return
+
+    refresh_commands = [command
+                        for service_name, role_names in refreshable_roles.items() if role_names
+                        for command in deployment.refresh_service_roles(cluster_name=cluster_name,
+                                                                        service_name=service_name,
+                                                                        role_names=role_names)]
+    if refresh_commands:
+        cluster_utils.wait_for_commands(deployment, [command['id'] for command in refresh_commands],
+                                        'Refresh roles')
+
+    hosts = HostRegistry(deployment, cluster.nodes)
+    hosts.wait_for_hosts()
+    for stage in stages:
+        restart_commands = [command for service_name in stage
+                            for command in deployment.restart_service_roles(
+                                cluster_name=cluster_name, service_name=service_name,
+                                role_names=stale_roles[service_name]
+                            )]
+        cluster_utils.wait_for_commands(deployment, [command['id'] for command in restart_commands],
+                                        'Restart {}'.format(', '.join(stage)))
+        probes.wait_for_probes(node=cluster.primary_node,
+                               probes=[probe for service_name in stage
+                                       for probe in probes.get_service_probes(
+                                           deployment=deployment, hosts=hosts,
+                                           cluster_name=cluster_name, service_name=service_name
+                                       )])
+
+    deploy_commands = [deployment.deploy_service_client_config(
+        cluster_name=cluster_name, service_name=service_name,
+        role_names=[role['name'] for role in roles_by_service[service_name]]
+    ) for service_name in stale_client_services]
+    if deploy_commands:
+        cluster_utils.wait_for_commands(deployment, [command['id'] for command in deploy_commands],
+                                        'Deploy client config')
+
+
+def get_restart_stages(deployment, cluster_name, services):
+    """Group services into stages such that every service comes after the ones it depends on.
+
+    Args:
+        deployment (:py:class:`cm.ClouderaManagerDeployment`): The CM deployment.
+        cluster_name (:obj:`str`): The name of the cluster.
+        services (:obj:`list`): The services of the cluster.
+
+    Returns:
+        A :obj:`list` of lists of service names.
+    """
+    service_names = {service['name'] for service in services}
+    dependencies = defaultdict(set)
+    for service_name in service_names:
+        config = deployment.get_service_config(cluster_name=cluster_name,
+                                               service_name=service_name)
+        dependencies[service_name] = {value for name, value in config.items()
+                                      if name.endswith(DEPENDENCY_CONFIG_SUFFIX)
+                                      and value in service_names and value != service_name}
+
+    stages = []
+    remaining_service_names = set(service_names)
+    while remaining_service_names:
+        stage = sorted(service_name for service_name in remaining_service_names
+                       if not dependencies[service_name] & remaining_service_names)
+        if not stage:
+            raise Exception('Cannot order services with circular dependencies ({}).'.format(
+                ', '.join(sorted(remaining_service_names))
+            ))
+        stages.append(stage)
+        remaining_service_names -= set(stage)
+    return stages
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import logging
+import re
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from clusterdock.utils import wait_for_condition
+
+from . import cluster_utils
+from .cluster_utils import execute
+from .cm import ClouderaManagerDeployment
+from .kerberos import KEYTAB_FILE_PATH, KEYTAB_PRINCIPAL
+from .pause import get_client_node, supervisor_program_exists
+from .start import DEFAULT_CLUSTER_NAME
+from .storage import KAFKA_SERVER_PROPERTIES_PATH
+
+logger = logging.getLogger('clusterdock.{}'.format(__name__))
+
+# Services that can be reset, mapped to the type of their CM service (Kafka runs outside of CM).
+RESETTABLE_SERVICES = OrderedDict([
+    ('hdfs', 'HDFS'),
+    ('hbase', 'HBASE'),
+    ('kafka', None),
+    ('hive', 'HIVE'),
+    ('yarn', 'YARN'),
+])
+
+DEFAULT_HDFS_ROOTS = ['/tmp', '/user/cloudera-scm']
+HBASE_MODES = ('drop', 'truncate')
+
+# HDFS is reset as the hdfs superuser with the keytab CM hands to the NameNode, in a credential
+# cache of its own so that the admin principal's tickets on the primary node stay in place.
+HDFS_KEYTAB_GLOB = '/var/run/cloudera-scm-agent/process/*-hdfs-NAMENODE/hdfs.keytab'
+HDFS_CREDENTIAL_CACHE = '/tmp/krb5cc_clusterdock_reset'
+
+KAFKA_TOPICS_PATH = '/opt/kafka/bin/kafka-topics.sh'
+KAFKA_ZOOKEEPER = 'localhost:2181'
+# kafka-topics.sh --describe starts with a line like
+# Topic:test-topic	PartitionCount:10	ReplicationFactor:1	Configs:
+KAFKA_TOPIC_SPEC_PATTERN = r'(PartitionCount|ReplicationFactor|Configs):(\S*)'
+
+YARN_UNFINISHED_APPLICATION_STATES = 'NEW,NEW_SAVING,SUBMITTED,ACCEPTED,RUNNING'
+
+# Services reset from the client node with the admin principal's tickets.
+CLIENT_NODE_SERVICES = ('hbase', 'hive', 'yarn')
+
+
+def main(args):
+    cluster = cluster_utils.attach_cluster(args.network)
+    reset_cluster(cluster,
+                  services=args.services or list(RESETTABLE_SERVICES),
+                  hdfs_roots=args.hdfs_roots or DEFAULT_HDFS_ROOTS,
+                  hbase_mode=args.hbase_mode,
+                  hbase_namespaces=args.hbase_namespaces,
+                  keep_tsdb_tables=args.keep_tsdb_tables)
+
+
+def reset_cluster(cluster, services, hdfs_roots=DEFAULT_HDFS_ROOTS, hbase_mode='drop',
+                  hbase_namespaces=None, keep_tsdb_tables=False):
+    """Reset the user-visible data of a running cluster in place, every service in a thread of its
+    own, without restarting any service.
+
+    Args:
+        cluster (:py:class:`clusterdock.models.Cluster`): The cluster, as returned by
+            :py:func:`cluster_utils.attach_cluster`.
+        services (:obj:`list`): Names of the services to reset (see :py:data:`RESETTABLE_SERVICES`).
+        hdfs_roots (:obj:`list`, optional): HDFS directories whose contents are deleted.
+            Default: :py:data:`DEFAULT_HDFS_ROOTS`
+        hbase_mode (:obj:`str`, optional): ``drop`` or ``truncate`` HBase tables. Default: ``drop``
+        hbase_namespaces (:obj:`list`, optional): HBase namespaces to reset. Default: ``None``
+            (every namespace but ``hbase``)
+        keep_tsdb_tables (:obj:`bool`, optional): Leave OpenTSDB's ``tsdb*`` tables alone.
+            Default: ``False``
+
+    Returns:
+        An :py:class:`collections.OrderedDict` of the reset services mapped to the seconds
+        their reset took.
+    """
+    deployment = ClouderaManagerDeployment(cluster_utils.get_server_url(cluster.primary_node))
+    started_service_types = {service['type']
+                             for service in deployment.get_cluster_services(DEFAULT_CLUSTER_NAME)
+                             if service.get('serviceState') == 'STARTED'}
+    client_node = get_client_node(cluster) or cluster.primary_node
+    kafka_nodes = [node for node in cluster
+                   if node.group == 'secondary' and supervisor_program_exists(node, 'kafka')]
+
+    resets = OrderedDict([
+        ('hdfs', lambda: _reset_hdfs(cluster.primary_node, hdfs_roots)),
+        ('hbase', lambda: _reset_hbase(client_node, hbase_mode, hbase_namespaces,
+                                       keep_tsdb_tables)),
+        ('kafka', lambda: _reset_kafka(kafka_nodes)),
+        ('hive', lambda: _reset_hive(client_node)),
+        ('yarn', lambda: _reset_yarn(client_node)),
+    ])
+    for service in services:
+        if service not in resets:
+            raise ValueError('Cannot reset {} (must be one of {}).'.format(
+                service, ', '.join(resets)
+            ))
+        service_type = RESETTABLE_SERVICES[service]
+        if service_type and service_type not in started_service_types:
+            logger.info('Skipping %s, which is not started.', service)
+            resets.pop(service)
+        elif service == 'kafka' and not kafka_nodes:
+            logger.info('Skipping kafka, which runs on no secondary node.')
+            resets.pop(service)
+    resets = OrderedDict((service, reset) for service, reset in resets.items()
+                         if service in services)
+
+    # The resets share the client node's default credential cache, so the ticket is obtained once
+    # up front rather than by every thread, where one kinit could replace another's ticket.
+    if any(service in CLIENT_NODE_SERVICES for service in resets):
+        execute(client_node, 'kinit -kt {} {}'.format(KEYTAB_FILE_PATH, KEYTAB_PRINCIPAL))
+
+    logger.info('Resetting %s ...', ', '.join(resets))
+    with ThreadPoolExecutor(max_workers=len(resets) or 1) as executor:
+        futures = OrderedDict((service, executor.submit(_timed, reset))
+                              for service, reset in resets.items())
+
+    timings = OrderedDict()
+    failed_services = []
+    for service, future in futures.items():
+        try:
+            timings[service] = future.result()
+            logger.info('Reset %s in %.1f seconds.', service, timings[service])
+        except Exception:
+            logger.exception('Failed to reset %s.', service)
+            failed_services.append(service)
+    if failed_services:
+        raise Exception('Failed to reset {}.'.format(', '.join(failed_services)))
+    return timings
+
+
+def _timed(function):
+    start_time = time.time()
+    function()
+    return time.time() - start_time
+
+
+def _reset_hdfs(primary_node, hdfs_roots):
+    # The globs are quoted so that HDFS expands them, not the shell. The roots themselves stay.
+    paths = ' '.join("'{}/*'".format(root.rstrip('/')) for root in hdfs_roots)
+    execute(primary_node,
+            'export KRB5CCNAME={0}; keytab=$(ls -t {1} | head -1) '
+            "&& kinit -kt $keytab $(klist -kt $keytab | awk '/hdfs\\//{{print $4; exit}}') "
+            '&& hdfs dfs -rm -r -f -skipTrash {2}; status=$?; kdestroy; exit $status'.format(
+                HDFS_CREDENTIAL_CACHE, HDFS_KEYTAB_GLOB, paths
+            ))
+
+
+def _reset_hbase(client_node, hbase_mode, hbase_namespaces, keep_tsdb_tables):
+    # One shell session, since starting the HBase shell takes longer than the reset itself. The
+    # script is passed through printf, hence only double quotes and no percent signs.
+    conditions = ['!t.start_with?("hbase:")']
+    if hbase_namespaces:
+        conditions.append('[{}].include?(t.include?(":") ? t.split(":")[0] : "default")'.format(
+            ', '.join('"{}"'.format(namespace) for namespace in hbase_namespaces)
+        ))
+    if keep_tsdb_tables:
+        conditions.append('!t.start_with?("tsdb")')
+    action = 'disable t; drop t' if hbase_mode == 'drop' else 'truncate_preserve t'
+    result = execute(client_node, "printf '{}\\n' | hbase shell".format(
+        'list.select {{ |t| {} }}.each {{ |t| {} }}'.format(' && '.join(conditions), action)
+    ))
+    if 'ERROR' in result:
+        raise Exception('HBase shell reported an error: {}'.format(result))
+
+
+def _reset_kafka(kafka_nodes):
+    for node in kafka_nodes:
+        enable_kafka_topic_deletion(node)
+        topics = [topic for topic in list_kafka_topics(node) if not topic.startswith('__')]
+        if not topics:
+            continue
+
+        # Topics are recreated with the partition count, replication factor and configs they had.
+        topic_specs = {}
+        for topic in topics:
+            description = execute(node, '{} --zookeeper {} --describe --topic {}'.format(
+                KAFKA_TOPICS_PATH, KAFKA_ZOOKEEPER, topic
+            ))
+            topic_specs[topic] = dict(re.findall(KAFKA_TOPIC_SPEC_PATTERN, description))
+
+        delete_kafka_topics(node, topics)
+
+        for topic in topics:
+            spec = topic_specs[topic]
+            configs = ''.join(' --config {}'.format(config)
+                              for config in spec.get('Configs', '').split(',') if config)
+            execute(node, '{} --zookeeper {} --create --topic {} '
+                          '--partitions {} --replication-factor {}{}'.format(
+                              KAFKA_TOPICS_PATH, KAFKA_ZOOKEEPER, topic,
+                              spec['PartitionCount'], spec['ReplicationFactor'], configs
+                          ))
+
+
+def enable_kafka_topic_deletion(node):
+    """Allow the Kafka broker of a node to delete topics, restarting it if it did not already.
+
+    Args:
+        node (:py:class:`clusterdock.models.Node`): A node running Kafka.
+    """
+    execute(node, "grep -q '^delete.topic.enable=true' {0} "
+                  "|| (echo 'delete.topic.enable=true' >> {0} && supervisorctl restart kafka)"
+                  "".format(KAFKA_SERVER_PROPERTIES_PATH))
+
+
+def list_kafka_topics(node):
+    """List the topics of the Kafka broker of a node, leaving out topics marked for deletion.
+
+    Args:
+        node (:py:class:`clusterdock.models.Node`): A node running Kafka.
+
+    Returns:
+        A :obj:`list` of topic names.
+    """
+    # Keep log4j warnings on stderr out of the list, which has one topic per line.
+    return [line.strip() for line in execute(node, '{} --zookeeper {} --list 2>/dev/null'.format(
+        KAFKA_TOPICS_PATH, KAFKA_ZOOKEEPER
+    )).splitlines() if line.strip() and 'marked for deletion' not in line]
+
+
+def delete_kafka_topics(node, topics):
+    """Delete topics of the Kafka broker of a node and wait until they are gone.
+
+    Args:
+        node (:py:class:`clusterdock.models.Node`): A node running Kafka, with topic deletion
+            enabled (see :py:func:`enable_kafka_topic_deletion`).
+        topics (:obj:`list`): Names of the topics to delete.
+    """
+    logger.debug('Deleting Kafka topics (%s) on %s ...', ', '.join(topics), node.fqdn)
+    for topic in topics:
+        execute(node, '{} --zookeeper {} --delete --topic {}'.format(KAFKA_TOPICS_PATH,
+                                                                      KAFKA_ZOOKEEPER,
+                                                                      topic))
+    _wait_for_kafka_topics_deletion(node, topics)
+
+
+def _wait_for_kafka_topics_deletion(node, topics):
+    def condition(node, topics):
+        # Topics marked for deletion are still listed (with a marker) until they are gone.
+        listed_topics = {line.split()[0] for line in execute(
+            node, '{} --zookeeper {} --list 2>/dev/null'.format(KAFKA_TOPICS_PATH, KAFKA_ZOOKEEPER)
+        ).splitlines() if line.strip()}
+        remaining_topics = set(topics) & listed_topics
+        logger.debug('Waiting for deletion of Kafka topics (%s) on %s ...',
+                     ', '.join(sorted(remaining_topics)), node.fqdn)
+        return not remaining_topics
+
+    def success(time):
+        logger.debug('Kafka topics on %s were deleted after %s seconds.', node.fqdn, time)
+
+    def failure(timeout):
+        raise TimeoutError('Timed out after {} seconds waiting '
+                           'for Kafka topics on {} to be deleted.'.format(timeout, node.fqdn))
+
+    wait_for_condition(condition=condition, condition_args=[node, topics],
+                       time_between_checks=1, timeout=120, success=success, failure=failure)
+
+
+def _reset_hive(client_node):
+    hive = "hive -S -e '{}'"
+
+    def list_names(statement):
+        # docker exec merges stderr into the output, so leave out Hive's warnings to get one name
+        # per line.
+        return [line.strip() for line in execute(client_node,
+                                                 '{} 2>/dev/null'.format(hive.format(statement)))
+                .splitlines() if line.strip()]
+
+    databases = [database for database in list_names('SHOW DATABASES') if database != 'default']
+    default_tables = list_names('SHOW TABLES IN default')
+    statements = (['DROP DATABASE IF EXISTS {} CASCADE'.format(database) for database in databases]
+                  + ['DROP TABLE IF EXISTS default.{}'.format(table) for table in default_tables])
+    if statements:
+        logger.debug('Dropping Hive databases (%s) and default tables (%s) ...',
+                     ', '.join(databases), ', '.join(default_tables))
+        execute(client_node, hive.format('; '.join(statements)))
+
+
+def _reset_yarn(client_node):
+    applications = re.findall(r'^(application_\d+_\d+)', execute(
+        client_node, 'yarn application -list -appStates {}'.format(
+            YARN_UNFINISHED_APPLICATION_STATES
+        )
+    ), re.MULTILINE)
+    for application in applications:
+        logger.debug('Killing YARN application %s ...', application)
+        execute(client_node, 'yarn application -kill {}'.format(application))
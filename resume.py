@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import logging
+from datetime import datetime, timezone
+
+from clusterdock.utils import wait_for_condition
+
+from . import cluster_utils, kerberos
+from .cm import ClouderaManagerDeployment
+from .cm_utils import parse_cm_timestamp
+from .pause import PAUSE_STATE_FILE_PATH, get_client_node, run_hbase_shell
+from .start import DEFAULT_CLUSTER_NAME
+
+logger = logging.getLogger('clusterdock.{}'.format(__name__))
+
+
+def main(args):
+    cluster = cluster_utils.attach_cluster(args.network)
+    primary_node = cluster.primary_node
+
+    logger.info('Unpausing containers ...')
+    resume_time = datetime.now(timezone.utc)
+    for node in cluster:
+        if node.container.status == 'paused':
+            node.container.unpause()
+
+    pause_state = json.loads(primary_node.execute('cat {} 2>/dev/null'.format(PAUSE_STATE_FILE_PATH),
+                                                  quiet=True).output or '{}')
+
+    deployment = ClouderaManagerDeployment(cluster_utils.get_server_url(primary_node))
+    _wait_for_heartbeats(deployment=deployment, since=resume_time)
+
+    # Tickets of the admin principal may have expired while the cluster was paused.
+    kerberos.kinit(cluster.nodes)
+
+    kafka_fqdns = pause_state.get('kafka_nodes', [])
+    if kafka_fqdns:
+        logger.info('Starting Kafka brokers ...')
+        for node in cluster:
+            if node.fqdn in kafka_fqdns:
+                node.execute('supervisorctl start kafka', quiet=True)
+
+    client_node = get_client_node(cluster)
+    if client_node:
+        logger.info('Re-enabling HBase balancer ...')
+        run_hbase_shell(client_node, ['balance_switch true'])
+
+    if pause_state.get('cm_service_started'):
+        logger.info('Starting CM services ...')
+        command = deployment.start_cm_service()
+        cluster_utils.wait_for_command(deployment, command['id'], 'Start CM service', timeout=180)
+        _wait_for_service_health(deployment=deployment, cluster_name=DEFAULT_CLUSTER_NAME)
+
+    primary_node.execute('rm -f {}'.format(PAUSE_STATE_FILE_PATH), quiet=True)
+    logger.info('Cluster is ready.')
+
+
+def _wait_for_heartbeats(deployment, since):
+    def condition(deployment, since):
+        hosts = deployment.get_all_hosts(fields=['hostname', 'lastHeartbeat'])
+        stale_hosts = [host['hostname'] for host in hosts
+                       if not host.get('lastHeartbeat')
+                       or parse_cm_timestamp(host['lastHeartbeat']) < since]
+        logger.debug('Waiting for heartbeats from %s ...', ', '.join(stale_hosts))
+        return not stale_hosts
+
+    def success(time):
+        logger.info('All CM agents heartbeated %s seconds after resume.', time)
+
+    def failure(timeout):
+        raise TimeoutError('Timed out after {} seconds waiting '
+                           'for CM agent heartbeats.'.format(timeout))
+
+    wait_for_condition(condition=condition, condition_args=[deployment, since],
+                       time_between_checks=1, timeout=120, success=success, failure=failure)
+
+
+def _wait_for_service_health(deployment, cluster_name):
+    def condition(deployment, cluster_name):
+        unhealthy_services = [service['name']
+                              for service in deployment.get_cluster_services(cluster_name)
+                              if service.get('serviceState') == 'STARTED'
+                              and service.get('healthSummary') not in ('GOOD', 'CONCERNING')]
+        logger.debug('Services with poor health: %s', ', '.join(unhealthy_services))
+        return not unhealthy_services
+
+    def success(time):
+        logger.debug('Started services became healthy after %s seconds.', time)
+
+    def failure(timeout):
+        raise TimeoutError('Timed out after {} seconds waiting '
+                           'for services to become healthy.'.format(timeout))
+
+    wait_for_condition(condition=condition, condition_args=[deployment, cluster_name],
+                       time_between_checks=2, timeout=300, success=success, failure=failure)
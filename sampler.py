@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Sample the resource usage of a cluster while a workload runs on it.
+
+Metrics come from the CM time-series API (one tsquery each) and from the Docker stats of the
+containers. Every metric of every entity (role or container) is a :py:class:`Series` of two
+arrays of doubles, whose size is bounded by downsampling.
+"""
+
+import csv
+import json
+import logging
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from . import cluster_utils
+from .cm import ClouderaManagerDeployment
+from .cm_utils import format_cm_timestamp, parse_cm_timestamp
+
+logger = logging.getLogger('clusterdock.{}'.format(__name__))
+
+DEFAULT_INTERVAL = 10
+DEFAULT_CAPACITY = 4096
+
+# tsqueries sampled by default: CPU, memory, heap and GC of every role, HDFS I/O of DataNodes
+# and request rates of RegionServers.
+DEFAULT_QUERIES = [
+    'select cpu_user_rate, cpu_system_rate, mem_rss where category = ROLE',
+    'select jvm_heap_used_mb, jvm_gc_time_ms_rate where category = ROLE',
+    'select bytes_read_rate, bytes_written_rate where roleType = DATANODE',
+    'select read_requests_rate, write_requests_rate where roleType = REGIONSERVER',
+]
+
+# CM receives the metrics of roles in batches, so data points show up a while after their time.
+# Every poll looks back this many seconds and only adds the points it has not seen yet.
+CM_LOOKBACK = 180
+# Fields of the time series that samples are made of.
+TIME_SERIES_FIELDS = ['metadata.metricName', 'metadata.entityName', 'metadata.attributes.roleType',
+                      'metadata.attributes.hostname', 'data']
+SUMMARY_PERCENTILES = (50, 95, 99)
+
+
+def main(args):
+    cluster = cluster_utils.attach_cluster(args.network)
+    deployment = ClouderaManagerDeployment(cluster_utils.get_server_url(cluster.primary_node))
+    sampler = Sampler(cluster, deployment, queries=args.queries, interval=args.interval,
+                      capacity=args.capacity, container_stats=not args.no_container_stats)
+
+    logger.info('Sampling every %s seconds%s (interrupt to stop) ...', args.interval,
+                ' for {} seconds'.format(args.duration) if args.duration else '')
+    with sampler:
+        try:
+            if args.duration:
+                time.sleep(args.duration)
+            else:
+                while True:
+                    time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+    sampler.write(args.output)
+    logger.info('Wrote %s series to %s.', len(sampler.series), args.output)
+
+
+class Series:
+    """The samples of one metric of one entity.
+
+    Timestamps and values are kept in two arrays of doubles. Once ``capacity`` points are held,
+    every two adjacent points are averaged into one and later samples are averaged in groups of
+    the same size, so a series always covers the whole run, at a resolution that halves whenever
+    it fills up.
+
+    Args:
+        capacity (:obj:`int`): Maximum number of points.
+    """
+    def __init__(self, capacity):
+        self.capacity = max(2, capacity)
+        self.timestamps = array('d')
+        self.values = array('d')
+        # Number of samples averaged into every point and the samples waiting for a point.
+        self.stride = 1
+        self._pending_timestamps = array('d')
+        self._pending_values = array('d')
+        # The timestamp of the latest sample as it was added, or ``None`` if there is none. The
+        # timestamps of the points are averages, which lie before it.
+        self.last_timestamp = None
+
+    def __len__(self):
+        return len(self.values)
+
+    def append(self, timestamp, value):
+        """Add a sample.
+
+        Args:
+            timestamp (:obj:`float`): Seconds since the epoch.
+            value (:obj:`float`): The value.
+        """
+        self.last_timestamp = timestamp
+        self._pending_timestamps.append(timestamp)
+        self._pending_values.append(value)
+        if len(self._pending_values) < self.stride:
+            return
+        self.timestamps.append(sum(self._pending_timestamps) / self.stride)
+        self.values.append(sum(self._pending_values) / self.stride)
+        self._pending_timestamps = array('d')
+        self._pending_values = array('d')
+        if len(self.values) >= self.capacity:
+            self._downsample()
+
+    def _downsample(self):
+        # With an odd number of points, the last one goes on as the samples it averages, which
+        # then make up half of the next point.
+        if len(self.values) % 2:
+            self._pending_timestamps = array('d', [self.timestamps[-1]] * self.stride)
+            self._pending_values = array('d', [self.values[-1]] * self.stride)
+        self.timestamps = array('d', ((self.timestamps[index] + self.timestamps[index + 1]) / 2
+                                      for index in range(0, len(self.timestamps) - 1, 2)))
+        self.values = array('d', ((self.values[index] + self.values[index + 1]) / 2
+                                  for index in range(0, len(self.values) - 1, 2)))
+        self.stride *= 2
+
+    def summarize(self):
+        """Summarize the values of the series.
+
+        Returns:
+            A :obj:`dict` of the count, mean, percentiles and maximum of the values.
+        """
+        if not self.values:
+            return {'count': 0}
+        ordered_values = sorted(self.values)
+        summary = OrderedDict([('count', len(ordered_values)),
+                               ('mean', round(sum(ordered_values) / len(ordered_values), 3))])
+        for percentile in SUMMARY_PERCENTILES:
+            summary['p{}'.format(percentile)] = ordered_values[
+                min(len(ordered_values) - 1, int(len(ordered_values) * percentile / 100))
+            ]
+        summary['max'] = ordered_values[-1]
+        return summary
+
+
+class Sampler:
+    """Poll CM time series and container stats of a cluster at a fixed interval.
+
+    Args:
+        cluster (:py:class:`clusterdock.models.Cluster`): The cluster.
+        deployment (:py:class:`cm.ClouderaManagerDeployment`): The CM deployment.
+        queries (:obj:`list`, optional): tsqueries to sample. Default: :py:data:`DEFAULT_QUERIES`
+        interval (:obj:`float`, optional): Seconds between polls. Default:
+            :py:const:`DEFAULT_INTERVAL`
+        capacity (:obj:`int`, optional): Maximum number of points per series. Default:
+            :py:const:`DEFAULT_CAPACITY`
+        container_stats (:obj:`bool`, optional): Also sample the Docker stats of the containers.
+            Default: ``True``
+    """
+    def __init__(self, cluster, deployment, queries=None, interval=DEFAULT_INTERVAL,
+                 capacity=DEFAULT_CAPACITY, container_stats=True):
+        self.cluster = cluster
+        self.deployment = deployment
+        self.queries = queries or DEFAULT_QUERIES
+        self.interval = interval
+        self.capacity = capacity
+        self.container_stats = container_stats
+
+        # (metric, entity) mapped to series, and entities mapped to their attributes.
+        self.series = OrderedDict()
+        self.entities = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._start_time = None
+        self._last_poll_time = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        """Start polling in a background thread."""
+        self._start_time = self._last_poll_time = time.time()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Poll one last time and stop."""
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        try:
+            self.poll()
+        except Exception as exception:
+            # The samples collected so far are kept either way.
+            logger.warning('Last sampling failed (%s).', exception)
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as exception:
+                # A missed poll only leaves a gap in the data, so the run goes on.
+                logger.warning('Sampling failed (%s).', exception)
+
+    def poll(self):
+        """Collect the samples since the previous poll."""
+        poll_time = time.time()
+        last_poll_time = self._last_poll_time or poll_time - self.interval
+        from_time = format_cm_timestamp(max(self._start_time or last_poll_time,
+                                             last_poll_time - CM_LOOKBACK))
+        to_time = format_cm_timestamp(poll_time)
+        for query in self.queries:
+            for time_series in self.deployment.get_timeseries(query=query, from_time=from_time,
+                                                              to_time=to_time,
+                                                              fields=TIME_SERIES_FIELDS):
+                metadata = time_series['metadata']
+                entity = metadata['entityName']
+                attributes = metadata.get('attributes', {})
+                self.entities.setdefault(entity, {'role_type': attributes.get('roleType'),
+                                                  'hostname': attributes.get('hostname')})
+                for point in time_series['data']:
+                    self._add(metadata['metricName'], entity,
+                              parse_cm_timestamp(point['timestamp']).timestamp(), point['value'])
+
+        if self.container_stats:
+            nodes = list(self.cluster.nodes)
+            with ThreadPoolExecutor(max_workers=len(nodes)) as executor:
+                node_stats = list(executor.map(_get_container_stats, nodes))
+            for node, stats in zip(nodes, node_stats):
+                self.entities.setdefault(node.fqdn, {'role_type': 'CONTAINER',
+                                                     'hostname': node.fqdn})
+                for metric, value in stats.items():
+                    self._add(metric, node.fqdn, poll_time, value)
+        self._last_poll_time = poll_time
+
+    def _add(self, metric, entity, timestamp, value):
+        with self._lock:
+            series = self.series.get((metric, entity))
+            if series is None:
+                series = self.series[(metric, entity)] = Series(self.capacity)
+            # Polls overlap (see CM_LOOKBACK), so points already seen are skipped.
+            if series.last_timestamp is None or timestamp > series.last_timestamp:
+                series.append(timestamp, value)
+
+    def summarize(self):
+        """Summarize every series.
+
+        Returns:
+            A :obj:`list` of :obj:`dict` objects, one per metric and entity, each with the role
+            type and host of the entity and the count, mean, percentiles and maximum of the
+            values.
+        """
+        with self._lock:
+            return [OrderedDict([('metric', metric), ('entity', entity)],
+                                **self.entities.get(entity, {}), **series.summarize())
+                    for (metric, entity), series in self.series.items()]
+
+    def write_csv(self, path):
+        """Write every sample to a CSV file with metric, entity, timestamp and value columns.
+
+        Args:
+            path (:obj:`str`): Path of the file.
+        """
+        with self._lock, open(path, 'w', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(['metric', 'entity', 'timestamp', 'value'])
+            for (metric, entity), series in self.series.items():
+                writer.writerows((metric, entity, round(timestamp, 3), value)
+                                 for timestamp, value in zip(series.timestamps, series.values))
+
+    def write_parquet(self, path):
+        """Write every sample to a Parquet file with the same columns as :py:meth:`write_csv`.
+
+        This needs ``pyarrow``, which is not required by anything else.
+
+        Args:
+            path (:obj:`str`): Path of the file.
+        """
+        import pyarrow
+        import pyarrow.parquet
+
+        with self._lock:
+            columns = OrderedDict([('metric', []), ('entity', []),
+                                   ('timestamp', array('d')), ('value', array('d'))])
+            for (metric, entity), series in self.series.items():
+                columns['metric'].extend([metric] * len(series))
+                columns['entity'].extend([entity] * len(series))
+                columns['timestamp'].extend(series.timestamps)
+                columns['value'].extend(series.values)
+        pyarrow.parquet.write_table(pyarrow.table(columns), path)
+
+    def write(self, path):
+        """Write every sample to a file, as Parquet if its name ends with ``.parquet`` and as CSV
+        otherwise, and the summary next to it as JSON (``<path>.summary.json``).
+
+        Args:
+            path (:obj:`str`): Path of the file.
+        """
+        if path.endswith('.parquet'):
+            self.write_parquet(path)
+        else:
+            self.write_csv(path)
+        with open('{}.summary.json'.format(path), 'w') as summary_file:
+            json.dump(self.summarize(), summary_file, indent=2)
+
+
+def _get_container_stats(node):
+    stats = node.container.stats(stream=False)
+    cpu_stats, precpu_stats = stats['cpu_stats'], stats['precpu_stats']
+    cpu_delta = (cpu_stats['cpu_usage']['total_usage']
+                 - precpu_stats['cpu_usage']['total_usage'])
+    system_delta = cpu_stats.get('system_cpu_usage', 0) - precpu_stats.get('system_cpu_usage', 0)
+    online_cpus = (cpu_stats.get('online_cpus')
+                   or len(cpu_stats['cpu_usage'].get('percpu_usage') or [None]))
+    memory_stats = stats.get('memory_stats', {})
+    networks = stats.get('networks', {})
+    return OrderedDict([
+        ('container_cpu_percent', (100.0 * cpu_delta / system_delta * online_cpus
+                                   if system_delta > 0 else 0.0)),
+        # Page cache is reclaimable, so it does not count as used memory.
+        ('container_memory_bytes', float(memory_stats.get('usage', 0)
+                                         - memory_stats.get('stats', {}).get('cache', 0))),
+        ('container_network_rx_bytes', float(sum(network['rx_bytes']
+                                                 for network in networks.values()))),
+        ('container_network_tx_bytes', float(sum(network['tx_bytes']
+                                                 for network in networks.values()))),
+    ])
+
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import logging
+from collections import Counter, defaultdict
+
+from clusterdock.models import client
+from clusterdock.utils import nested_get
+
+from . import cluster_utils
+from .cm import ClouderaManagerDeployment
+from .start import DEFAULT_CLUSTER_NAME
+from .storage import DATA_MOUNT_PATH
+
+logger = logging.getLogger('clusterdock.{}'.format(__name__))
+
+# Role types that CM can decommission gracefully. Decommissioning a RegionServer moves its
+# regions to the remaining RegionServers before it is stopped.
+DECOMMISSIONABLE_ROLE_TYPES = ['DATANODE', 'NODEMANAGER', 'REGIONSERVER']
+HDFS_DEFAULT_REPLICATION = 3
+
+
+def main(args):
+    cluster = cluster_utils.attach_cluster(args.network)
+    primary_node = cluster.primary_node
+
+    nodes_by_hostname = {node.hostname: node for node in cluster}
+    unknown_hostnames = [hostname for hostname in args.nodes
+                         if getattr(nodes_by_hostname.get(hostname), 'group', None) != 'secondary']
+    if unknown_hostnames:
+        raise Exception('Can only remove secondary nodes (saw {}).'.format(
+            ', '.join(unknown_hostnames)
+        ))
+    nodes = [nodes_by_hostname[hostname] for hostname in args.nodes]
+
+    remaining_secondaries = sum(1 for node in cluster
+                                if node.group == 'secondary' and node not in nodes)
+    if remaining_secondaries < HDFS_DEFAULT_REPLICATION:
+        logger.warning('Only %s secondary node(s) will remain. DataNode decommissioning waits for '
+                       'blocks to be re-replicated and will not finish if fewer DataNodes remain '
+                       'than the replication factor of the files.', remaining_secondaries)
+
+    deployment = ClouderaManagerDeployment(cluster_utils.get_server_url(primary_node))
+    host_ids = {host['hostname']: host['hostId']
+                for host in deployment.get_all_hosts(fields=['hostname', 'hostId'])}
+    node_host_ids = [host_ids[node.fqdn] for node in nodes if node.fqdn in host_ids]
+
+    roles_by_service = _get_host_roles(deployment=deployment, cluster_name=DEFAULT_CLUSTER_NAME,
+                                       host_ids=node_host_ids)
+
+    logger.info('Decommissioning roles on %s ...', ', '.join(node.fqdn for node in nodes))
+    _decommission_roles(deployment=deployment, cluster_name=DEFAULT_CLUSTER_NAME,
+                        roles_by_service=roles_by_service)
+
+    logger.info('Stopping remaining roles ...')
+    stop_commands = []
+    for service_name, roles in roles_by_service.items():
+        role_names = [role['name'] for role in roles if role['type'] != 'GATEWAY']
+        if role_names:
+            stop_commands.extend(deployment.stop_service_roles(cluster_name=DEFAULT_CLUSTER_NAME,
+                                                               service_name=service_name,
+                                                               role_names=role_names))
+    cluster_utils.wait_for_commands(deployment, [command['id'] for command in stop_commands],
+                                    'Stop roles')
+
+    logger.info('Deleting roles ...')
+    for service_name, roles in roles_by_service.items():
+        for role in roles:
+            deployment.delete_service_role(cluster_name=DEFAULT_CLUSTER_NAME,
+                                           service_name=service_name,
+                                           role_name=role['name'])
+
+    # The agents have to be stopped first, or their next heartbeat adds the hosts to CM again.
+    for node in nodes:
+        node.execute('service cloudera-scm-agent stop', quiet=True)
+
+    logger.info('Removing hosts from cluster and Cloudera Manager ...')
+    for host_id in node_host_ids:
+        deployment.remove_cluster_host(cluster_name=DEFAULT_CLUSTER_NAME, host_id=host_id)
+        deployment.delete_host(host_id=host_id)
+
+    logger.info('Revoking Kerberos principals ...')
+    _revoke_principals(primary_node=primary_node, nodes=nodes)
+
+    logger.info('Removing containers ...')
+    for node in nodes:
+        # Removing a container only takes its anonymous volumes with it, not the named volume of
+        # the volume storage backend.
+        volume_names = [mount['Name']
+                        for mount in nested_get(node.container.attrs, ['Mounts']) or []
+                        if mount.get('Type') == 'volume'
+                        and mount.get('Destination') == DATA_MOUNT_PATH]
+        node.stop(remove=True)
+        for volume_name in volume_names:
+            logger.debug('Removing volume %s ...', volume_name)
+            client.volumes.get(volume_name).remove()
+        cluster_utils.remove_node_from_etc_hosts(node.fqdn)
+
+    logger.info('Removed %s from the cluster.', ', '.join(node.fqdn for node in nodes))
+
+
+def _get_host_roles(deployment, cluster_name, host_ids):
+    roles_by_service = defaultdict(list)
+    for service in deployment.get_cluster_services(cluster_name=cluster_name):
+        for role in deployment.get_service_roles(cluster_name=cluster_name,
+                                                 service_name=service['name']):
+            if role['hostRef']['hostId'] in host_ids:
+                roles_by_service[service['name']].append(role)
+    return roles_by_service
+
+
+def _decommission_roles(deployment, cluster_name, roles_by_service):
+    # One decommission command per service, all running at the same time.
+    commands = []
+    decommissioned_roles = {}
+    for service_name, roles in roles_by_service.items():
+        role_names = [role['name'] for role in roles
+                      if role['type'] in DECOMMISSIONABLE_ROLE_TYPES]
+        if role_names:
+            logger.debug('Decommissioning roles (%s) of service %s ...',
+                         ', '.join(role_names), service_name)
+            commands.append(deployment.decommission_service_roles(cluster_name=cluster_name,
+                                                                  service_name=service_name,
+                                                                  role_names=role_names))
+            decommissioned_roles[service_name] = set(role_names)
+
+    def progress():
+        commission_states = Counter(
+            role.get('commissionState')
+            for service_name, role_names in decommissioned_roles.items()
+            for role in deployment.get_service_roles(cluster_name=cluster_name,
+                                                     service_name=service_name)
+            if role['name'] in role_names
+        )
+        logger.info('Role commission states: %s',
+                    ', '.join('{} {}'.format(count, state)
+                              for state, count in sorted(commission_states.items())))
+
+    cluster_utils.wait_for_commands(deployment, [command['id'] for command in commands],
+                                    'Decommission roles', timeout=3600, progress=progress)
+
+
+def _revoke_principals(primary_node, nodes):
+    principals = primary_node.execute('kadmin.local -q listprincs', quiet=True).output.split()
+    revoked_principals = [principal for principal in principals
+                          if any('/{}@'.format(node.fqdn) in principal for node in nodes)]
+    if revoked_principals:
+        logger.debug('Deleting principals (%s) ...', ', '.join(revoked_principals))
+        # kadmin.local reads one request per line from stdin, so all principals go in one call.
+        primary_node.execute("printf '{}' | kadmin.local".format(
+            ''.join('delprinc -force {}\\n'.format(principal) for principal in revoked_principals)
+        ), quiet=True)
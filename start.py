@@ -11,28 +11,69 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import functools
 import io
 import logging
-import socket
 import time
 
-from clusterdock.models import Cluster, client, Node, NodeGroup
+from clusterdock.models import Cluster, Node, NodeGroup
 from clusterdock.utils import nested_get, wait_for_condition
 from configobj import ConfigObj
 from requests import HTTPError
 
+from . import (cluster_utils, database, extras, history, kerberos, networking, probes, storage,
+               validate)
 from .cm import ClouderaManagerDeployment
+from .distribute import distribute
+from .hosts import HostRegistry
 
-CM_PORT = 7180
+CM_PORT = cluster_utils.CM_PORT
 CM_AGENT_CONFIG_FILE_PATH = '/etc/cloudera-scm-agent/config.ini'
 CM_SERVER_ETC_DEFAULT = '/etc/default/cloudera-scm-server'
-DEFAULT_CLUSTER_NAME = 'cluster'
+DEFAULT_CLUSTER_NAME = cluster_utils.DEFAULT_CLUSTER_NAME
+DEFAULT_KERBEROS_REALM = 'CLOUDERA'
 SECONDARY_NODE_TEMPLATE_NAME = 'Secondary'
+# Host templates applied to hosts of a node group when they join the cluster.
+HOST_TEMPLATE_NAMES = {'secondary': 'secondary', 'edge': 'edgenode'}
+
+# System users (i.e. below YARN's minimum user ID) whose containers YARN runs. The CM default
+# plus cloudera-scm, the user of the admin principal jobs are submitted as.
+YARN_ALLOWED_SYSTEM_USERS = ['nobody', 'impala', 'hive', 'llama', 'hbase', 'cloudera-scm']
+
+# Roles of the Cloudera Management Service kept by the ``lite`` profile. Host Monitor and
+# Service Monitor are all that's needed for the health of hosts and services to be reported.
+CM_SERVICE_LITE_ROLE_TYPES = ['HOSTMONITOR', 'SERVICEMONITOR']
+CM_SERVICE_LITE_CONFIGS = {
+    'firehose_heapsize': str(256 * 1024 * 1024),
+    'firehose_non_java_memory_bytes': str(768 * 1024 * 1024),
+    'firehose_time_series_storage_bytes': str(1024 * 1024 * 1024),
+}
+# Configs of the Cloudera Management Service roles with databases, by role type. The Navigator
+# roles only run on licensed clusters, but their role config groups are always there.
+CM_SERVICE_DATABASE_HOST_CONFIGS = {'ACTIVITYMONITOR': 'firehose_database_host',
+                                    'REPORTSMANAGER': 'headlamp_database_host',
+                                    'NAVIGATOR': 'navigator_database_host',
+                                    'NAVIGATORMETASERVER': 'nav_metaserver_database_host'}
 
 logger = logging.getLogger('clusterdock.{}'.format(__name__))
 
 
 def main(args):
+    run = history.RunRecorder(history.RunHistory(args.history_db))
+    try:
+        _start(args, run)
+    except BaseException:
+        run.finish(succeeded=False)
+        raise
+    run.finish(succeeded=True)
+
+
+def _start(args, run):
+    """Start a cluster, beginning a phase of ``run`` at every step worth timing.
+
+    The waits of a phase use timeouts sized from the history of earlier starts, once there is
+    enough of it, instead of their defaults.
+    """
     primary_node_image = "{0}/{1}/{2}:cdh-cm-primary-{3}".format(
         args.registry,
         args.clusterdock_namespace,
@@ -54,6 +95,13 @@ def main(args):
         args.version_string
     )
 
+    database_node_image = "{0}/{1}/{2}:cdh-cm-database-{3}".format(
+        args.registry,
+        args.clusterdock_namespace,
+        args.image_name,
+        args.version_string
+    )
+
     # Docker's API for healthcheck uses units of nanoseconds. Define a constant
     # to make this more readable.
     SECONDS = 1000000000
@@ -64,16 +112,48 @@ def main(args):
         'retries': 1,
         'start_period': 30 * SECONDS
     }
+    # An instance name namespaces everything that would otherwise clash between clusters
+    # running side by side on the same Docker host: the network (and with it, the FQDNs of the
+    # nodes and the names of their volumes), the Kerberos realm and the published CM port.
+    network = args.instance_name or args.network
+    kerberos_realm = get_kerberos_realm(args.instance_name)
+    cm_ports = [CM_PORT] if args.instance_name else [{CM_PORT: CM_PORT}]
+
+    # Node groups can't be emptied on the command line, so host network mode, which runs a
+    # single node, leaves out every node but the primary.
+    secondary_hostnames, edge_hostnames = args.secondary_nodes, args.edge_nodes
+    database_hostnames = args.database_node
+    if args.network_driver == networking.HOST_DRIVER and (secondary_hostnames or edge_hostnames
+                                                          or database_hostnames):
+        logger.info('Starting only %s in host network mode.', args.primary_node[0])
+        secondary_hostnames, edge_hostnames, database_hostnames = [], [], []
+
+    primary_storage = storage.parse_storage_backend(args.primary_storage)
+    secondary_storage = storage.parse_storage_backend(args.secondary_storage)
+
     primary_node = Node(hostname=args.primary_node[0], group='primary',
-                        image=primary_node_image, ports=[{CM_PORT: CM_PORT}],
+                        image=primary_node_image, ports=cm_ports,
+                        volumes=storage.get_node_volumes(primary_storage,
+                                                         args.primary_node[0],
+                                                         network),
                         healthcheck=cm_server_healthcheck)
-    secondary_nodes = [Node(hostname=hostname, group='secondary', image=secondary_node_image)
-                       for hostname in args.secondary_nodes]
+    secondary_nodes = [Node(hostname=hostname, group='secondary', image=secondary_node_image,
+                            volumes=storage.get_node_volumes(secondary_storage,
+                                                             hostname,
+                                                             network))
+                       for hostname in secondary_hostnames]
 
     edge_nodes = [Node(hostname=hostname, group='edge', image=edge_node_image)
-                  for hostname in args.edge_nodes]
+                  for hostname in edge_hostnames]
+
+    # The metadata databases run on the primary node, unless a database node is started.
+    database_node = (Node(hostname=database_hostnames[0], group='database',
+                          image=database_node_image)
+                     if database_hostnames else None)
 
     all_nodes = [primary_node] + secondary_nodes + edge_nodes
+    if database_node:
+        all_nodes.insert(1, database_node)
 
     cluster = Cluster(*all_nodes)
 
@@ -82,19 +162,46 @@ def main(args):
     secondary_node_group = NodeGroup(secondary_nodes)
     edge_node_group = NodeGroup(edge_nodes)
 
-    cluster.start(args.network)
-
-    filesystem_fix_commands = ['cp {0} {0}.1; umount {0}; mv -f {0}.1 {0}'.format(file_)
-                               for file_ in ['/etc/hosts',
-                                             '/etc/resolv.conf',
-                                             '/etc/hostname',
-                                             '/etc/localtime']]
-    cluster.execute("bash -c '{}'".format('; '.join(filesystem_fix_commands)))
-
-    # Use BSD tar instead of tar because it works bether with docker
-    cluster.execute("ln -fs /usr/bin/bsdtar /bin/tar")
-
-    _configure_cm_agents(cluster)
+    run.begin_phase('containers')
+    if args.network_driver == networking.HOST_DRIVER:
+        networking.start_host_network_cluster(cluster)
+    else:
+        networking.create_network(network, cluster_name=cluster.name,
+                                  driver=args.network_driver,
+                                  mtu=int(args.network_mtu) if args.network_mtu else None,
+                                  subnet=args.network_subnet,
+                                  options=networking.parse_network_options(args.network_options))
+        cluster.start(network)
+        cluster.network = network
+    run.set_cluster(cluster)
+    # The domain of the nodes' FQDNs, i.e. the network or, in host network mode, the host's.
+    kerberos_domain = primary_node.fqdn.partition('.')[2] or primary_node.fqdn
+
+    prepare_nodes(primary_node=primary_node, nodes=cluster.nodes)
+
+    database_pool_size = int(args.database_pool_size)
+    if database_node:
+        run.begin_phase('database')
+        database.configure_database_node(
+            database_node,
+            settings=database.get_settings(shared_buffers=args.database_shared_buffers,
+                                           max_connections=int(args.database_max_connections),
+                                           durability=args.database_durability),
+            pool_size=database_pool_size
+        )
+        database.move_cm_database(primary_node=primary_node, database_node=database_node)
+        database_host, database_port = database.get_service_endpoint(database_node,
+                                                                     database_pool_size)
+    else:
+        database_host, database_port = primary_node.fqdn, database.DATABASE_PORT
+
+    extra_services_placement = extras.get_placement(args, secondary_nodes)
+    prepare_secondary_nodes(secondary_nodes=secondary_nodes,
+                            placement=extra_services_placement,
+                            secondary_storage=secondary_storage,
+                            zookeeper_quorum=primary_node.fqdn,
+                            kerberos_realm=kerberos_realm)
+    _prepare_primary_storage(primary_node=primary_node, primary_storage=primary_storage)
 
     if args.change_hostfile:
         update_hosts_file(cluster)
@@ -103,67 +210,81 @@ def main(args):
     # larger than 2 nodes is started, some modifications need to be done to the nodes to
     # prevent duplicate heartbeats and things like that.
     if len(secondary_nodes) > 1:
-        _remove_files(nodes=secondary_nodes[1:],
-                      files=['/var/lib/cloudera-scm-agent/uuid',
-                             '/dfs*/dn/current/*'])
+        remove_cloned_identities(nodes=secondary_nodes[1:], secondary_storage=secondary_storage)
 
+    run.begin_phase('kerberos')
     logger.info('Configuring Kerberos...')
 
-    cluster.primary_node.execute('/root/configure-kerberos.sh', quiet=True)
+    kdc_snapshot_path = (kerberos.get_snapshot_path(cache_dir=args.kdc_cache,
+                                                    primary_node=primary_node,
+                                                    kerberos_realm=kerberos_realm,
+                                                    kerberos_domain=kerberos_domain)
+                         if args.kdc_cache else None)
+    kdc_snapshot_loaded = bool(kdc_snapshot_path) and kerberos.load_snapshot(
+        snapshot_path=kdc_snapshot_path, primary_node=primary_node
+    )
+    if not kdc_snapshot_loaded:
+        cluster.primary_node.execute('KERBEROS_REALM={} KERBEROS_DOMAIN={} KERBEROS_HOSTNAME={} '
+                                     '/root/configure-kerberos.sh'.format(kerberos_realm,
+                                                                          kerberos_domain,
+                                                                          primary_node.fqdn),
+                                     quiet=True)
+    distribute([node for node in cluster.nodes if node is not primary_node],
+               {kerberos.KRB5_CONF_PATH: primary_node.get_file(kerberos.KRB5_CONF_PATH)})
     cluster.primary_node.execute('service krb5kdc start', quiet=True)
     cluster.primary_node.execute('service kadmin start', quiet=True)
 
     logger.info('Restarting Cloudera Manager agents ...')
     # _restart_cm_agents(cluster)
 
+    run.begin_phase('cm_server')
     logger.info('Waiting for Cloudera Manager server to come online ...')
-    _wait_for_cm_server(primary_node)
+    _wait_for_cm_server(primary_node, timeout=run.get_timeout('cm_server', default=180))
 
-    # Docker for Mac exposes ports that can be accessed only with ``localhost:<port>`` so
-    # use that instead of the hostname if the host name is ``moby``.
-    hostname = 'localhost' if client.info().get('Name') == 'moby' else socket.gethostname()
-    port = primary_node.host_ports.get(CM_PORT)
-    server_url = 'http://{}:{}'.format(hostname, port)
+    server_url = cluster_utils.get_server_url(primary_node)
     logger.info('Cloudera Manager server is now reachable at %s', server_url)
 
     # The work we need to do through CM itself begins here...
+    run.begin_phase('cm_hosts')
     deployment = ClouderaManagerDeployment(server_url)
+    run.set_api_client(deployment.api_client)
 
     deployment.stop_cm_service()
     time.sleep(10)
 
-    logger.info('Starting krb5kdc and kadmin ...')
-    cluster.primary_node.execute('service krb5kdc start', quiet=True)
-    cluster.primary_node.execute('service kadmin start', quiet=True)
+    # A KDC loaded from a snapshot came up with its database complete, so it is left running.
+    if not kdc_snapshot_loaded:
+        logger.info('Starting krb5kdc and kadmin ...')
+        cluster.primary_node.execute('service krb5kdc start', quiet=True)
+        cluster.primary_node.execute('service kadmin start', quiet=True)
+
+    # CM hosts are looked up once here and by host ID, FQDN or node group from then on.
+    hosts = HostRegistry(deployment, cluster.nodes)
+    hosts.wait_for_hosts(timeout=run.get_timeout('cm_hosts', default=180))
 
     logger.info("Regenerating keytabs...")
-    regenerate_keytabs(cluster, primary_node, deployment)
+    regenerate_keytabs(cluster, primary_node, deployment, host_ids=hosts.get_host_ids())
 
     logger.info("Adding hosts to cluster ...")
     # Add all CM hosts to the cluster (i.e. only new hosts that weren't part of the original
     # images).
-    all_host_ids = {}
-    for host in deployment.get_all_hosts():
-        all_host_ids[host['hostId']] = host['hostname']
-        for node in cluster:
-            if node.fqdn == host['hostname']:
-                node.host_id = host['hostId']
-                break
-        else:
-            raise Exception('Could not find CM host with hostname {}.'.format(node.fqdn))
     cluster_host_ids = {host['hostId']
                         for host in deployment.get_cluster_hosts(cluster_name=DEFAULT_CLUSTER_NAME)}
-    host_ids_to_add = set(all_host_ids.keys()) - cluster_host_ids
+    nodes_to_add = [node for node in cluster if node.host_id not in cluster_host_ids]
 
-    if host_ids_to_add:
+    if nodes_to_add:
         logger.debug('Adding %s to cluster %s ...',
-                     'host{} ({})'.format('s' if len(host_ids_to_add) > 1 else '',
-                                          ', '.join(all_host_ids[host_id]
-                                                    for host_id in host_ids_to_add)),
+                     'host{} ({})'.format('s' if len(nodes_to_add) > 1 else '',
+                                          ', '.join(node.fqdn for node in nodes_to_add)),
                      DEFAULT_CLUSTER_NAME)
-        deployment.add_cluster_hosts(cluster_name=DEFAULT_CLUSTER_NAME, host_ids=host_ids_to_add)
+        deployment.add_cluster_hosts(cluster_name=DEFAULT_CLUSTER_NAME,
+                                     host_ids=hosts.get_host_ids(nodes=nodes_to_add))
+
+    run.begin_phase('parcel')
+    _wait_for_activated_cdh_parcel(deployment=deployment, cluster_name=DEFAULT_CLUSTER_NAME,
+                                   timeout=run.get_timeout('parcel', default=500))
 
-    _wait_for_activated_cdh_parcel(deployment=deployment, cluster_name=DEFAULT_CLUSTER_NAME)
+    run.begin_phase('configure')
 
     # create and Apply host templates
     deployment.create_host_template(cluster_name='cluster', host_template_name='secondary',
@@ -173,30 +294,42 @@ def main(args):
                                     role_config_group_names=['hive-GATEWAY-BASE', 'hbase-GATEWAY-BASE',
                                                              'hdfs-GATEWAY-BASE', 'spark_on_yarn-GATEWAY-BASE'])
 
-    deployment.apply_host_template(cluster_name=DEFAULT_CLUSTER_NAME,
-                                   host_template_name='secondary',
-                                   start_roles=False,
-                                   host_ids=host_ids_to_add)
-
-    deployment.apply_host_template(cluster_name=DEFAULT_CLUSTER_NAME,
-                                   host_template_name='edgenode',
-                                   start_roles=False,
-                                   host_ids=host_ids_to_add)
+    for group, host_template_name in HOST_TEMPLATE_NAMES.items():
+        group_host_ids = hosts.get_host_ids(nodes=nodes_to_add, group=group)
+        if group_host_ids:
+            deployment.apply_host_template(cluster_name=DEFAULT_CLUSTER_NAME,
+                                           host_template_name=host_template_name,
+                                           start_roles=False,
+                                           host_ids=group_host_ids)
 
     logger.info('Updating database configurations ...')
     _update_database_configs(deployment=deployment,
                              cluster_name=DEFAULT_CLUSTER_NAME,
-                             primary_node=primary_node)
+                             database_host=database_host,
+                             database_port=database_port)
+    if database_node:
+        _update_cm_service_database_configs(deployment=deployment,
+                                            database_host=database_node.fqdn)
+
+    _update_storage_configs(deployment=deployment,
+                            cluster_name=DEFAULT_CLUSTER_NAME,
+                            primary_storage=primary_storage,
+                            secondary_storage=secondary_storage)
 
     # deployment.update_database_configs()
     # deployment.update_hive_metastore_namenodes()
 
+    _apply_cm_service_profile(deployment=deployment, profile=args.cm_service_profile)
+
     logger.info("Update KDC Config  ")
     deployment.update_cm_config(
-        {'SECURITY_REALM': 'CLOUDERA', 'KDC_HOST': 'node-1.cluster', 'KRB_MANAGE_KRB5_CONF': 'true'})
+        {'SECURITY_REALM': kerberos_realm, 'KDC_HOST': primary_node.fqdn, 'KRB_MANAGE_KRB5_CONF': 'true'})
 
     deployment.update_service_config(service_name='hbase', cluster_name=DEFAULT_CLUSTER_NAME,
                                      configs={'hbase_superuser': 'cloudera-scm'})
+    deployment.update_service_config(service_name='yarn', cluster_name=DEFAULT_CLUSTER_NAME,
+                                     configs={'container_executor_allowed_system_users':
+                                              ','.join(YARN_ALLOWED_SYSTEM_USERS)})
 
     deployment.update_service_role_config_group_config(service_name='hive', cluster_name=DEFAULT_CLUSTER_NAME,
                                                        role_config_group_name='hive-HIVESERVER2-BASE',
@@ -205,8 +338,9 @@ def main(args):
     logger.info("Importing Credentials..")
 
     cluster.primary_node.execute(
-        "curl -XPOST -u admin:admin http://{0}:{1}/api/v14/cm/commands/importAdminCredentials?username=cloudera-scm/admin@CLOUDERA&password=cloudera".format(
-            primary_node.fqdn, CM_PORT), quiet=True)
+        "curl -XPOST -u admin:admin http://{0}:{1}/api/v14/cm/commands/importAdminCredentials?username=cloudera-scm/admin@{2}&password=cloudera".format(
+            primary_node.fqdn, CM_PORT, kerberos_realm), quiet=True)
+    run.begin_phase('client_config')
     logger.info("deploy cluster client config ...")
     deployment.deploy_cluster_client_config(cluster_name=DEFAULT_CLUSTER_NAME)
 
@@ -216,75 +350,126 @@ def main(args):
             primary_node.fqdn, CM_PORT, DEFAULT_CLUSTER_NAME), quiet=True)
 
     logger.info("Creating keytab files ...")
-    cluster.execute('/root/create-keytab.sh', quiet=True)
+    kerberos.create_keytab(primary_node=primary_node, nodes=cluster.nodes)
 
     logger.info('Deploying client config ...')
-    _deploy_client_config(deployment=deployment, cluster_name=DEFAULT_CLUSTER_NAME)
+    _deploy_client_config(deployment=deployment, cluster_name=DEFAULT_CLUSTER_NAME,
+                          timeout=run.get_timeout('client_config', default=180))
 
     if not args.dont_start_cluster:
+        run.begin_phase('services')
+        services_timeout = run.get_timeout('services', default=600)
         logger.info('Starting cluster services ...')
-        _start_service_command(deployment=deployment, cluster_name=DEFAULT_CLUSTER_NAME, service_name="zookeeper",
-                               command="start")
-        _start_service_command(deployment=deployment, cluster_name=DEFAULT_CLUSTER_NAME, service_name="hdfs",
-                               command="start")
+        # Services with readiness probes are only waited on until they are usable, so their
+        # start commands may still be running (e.g. for the last few DataNodes) and are checked
+        # once every service has been started.
+        start_command_ids = []
+        start_service = functools.partial(_start_service, deployment=deployment, hosts=hosts,
+                                          node=primary_node, cluster_name=DEFAULT_CLUSTER_NAME,
+                                          pending_command_ids=start_command_ids,
+                                          timeout=services_timeout)
+        start_service(service_name='zookeeper')
+        start_service(service_name='hdfs')
         if not args.skip_accumulo:
             _start_service_command(deployment=deployment, cluster_name=DEFAULT_CLUSTER_NAME, service_name="accumulo16",
-                                   command="CreateHdfsDirCommand")
-            _start_service_command(deployment=deployment, cluster_name=DEFAULT_CLUSTER_NAME, service_name="accumulo16",
-                                   command="CreateAccumuloUserDirCommand")
+                                   command="CreateHdfsDirCommand", timeout=services_timeout)
             _start_service_command(deployment=deployment, cluster_name=DEFAULT_CLUSTER_NAME, service_name="accumulo16",
-                                   command="AccumuloInitServiceCommand")
+                                   command="CreateAccumuloUserDirCommand", timeout=services_timeout)
             _start_service_command(deployment=deployment, cluster_name=DEFAULT_CLUSTER_NAME, service_name="accumulo16",
-                                   command="start")
+                                   command="AccumuloInitServiceCommand", timeout=services_timeout)
+            start_service(service_name='accumulo16')
         if not args.skip_yarn:
-            _start_service_command(deployment=deployment, cluster_name=DEFAULT_CLUSTER_NAME, service_name="yarn",
-                                   command="start")
+            start_service(service_name='yarn')
         if not args.skip_hbase:
-            _start_service_command(deployment=deployment, cluster_name=DEFAULT_CLUSTER_NAME, service_name="hbase",
-                                   command="start")
+            start_service(service_name='hbase')
         if not args.skip_flume:
-            _start_service_command(deployment=deployment, cluster_name=DEFAULT_CLUSTER_NAME, service_name="flume",
-                                   command="start")
+            start_service(service_name='flume')
         if not args.skip_spark:
-            _start_service_command(deployment=deployment, cluster_name=DEFAULT_CLUSTER_NAME, service_name="spark_on_yarn",
-                                   command="start")
+            start_service(service_name='spark_on_yarn')
         if not args.skip_sqoop:
-            _start_service_command(deployment=deployment, cluster_name=DEFAULT_CLUSTER_NAME, service_name="sqoop",
-                                   command="start")
+            start_service(service_name='sqoop')
         if not args.skip_hive:
-            _start_service_command(deployment=deployment, cluster_name=DEFAULT_CLUSTER_NAME, service_name="hive",
-                                   command="start")
+            start_service(service_name='hive')
         if not args.skip_oozie:
-            _start_service_command(deployment=deployment, cluster_name=DEFAULT_CLUSTER_NAME, service_name="oozie",
-                                   command="start")
+            start_service(service_name='oozie')
         if not args.skip_hue:
-            _start_service_command(deployment=deployment, cluster_name=DEFAULT_CLUSTER_NAME, service_name="hue",
-                                   command="start")
-
-        logger.info('Starting CM services ...')
-        _start_cm_service(deployment=deployment)
-
+            start_service(service_name='hue')
+        if start_command_ids:
+            cluster_utils.wait_for_commands(deployment, start_command_ids,
+                                            'Start cluster services', timeout=services_timeout)
+
+        if args.cm_service_profile != 'none':
+            run.begin_phase('cm_service')
+            logger.info('Starting CM services ...')
+            _start_cm_service(deployment=deployment,
+                              timeout=run.get_timeout('cm_service', default=180))
+
+    run.begin_phase('post_start')
     logger.info("Setting up HDFS Homedir ...")
 
     cluster.primary_node.execute(
-        "kinit -kt /var/run/cloudera-scm-agent/process/*-hdfs-NAMENODE/hdfs.keytab hdfs/node-1.cluster@CLOUDERA",
+        "kinit -kt /var/run/cloudera-scm-agent/process/*-hdfs-NAMENODE/hdfs.keytab hdfs/{}@{}".format(
+            primary_node.fqdn, kerberos_realm),
         quiet=True)
     cluster.primary_node.execute("hadoop fs -mkdir /user/cloudera-scm", quiet=True)
     cluster.primary_node.execute("hadoop fs -chown cloudera-scm:cloudera-scm /user/cloudera-scm", quiet=True)
 
     logger.info("Kinit cloudera-scm/admin ...")
-    cluster.execute('kinit -kt /root/cloudera-scm.keytab cloudera-scm/admin', quiet=True)
+    kerberos.kinit(cluster.nodes)
+
+    if kdc_snapshot_path and not kdc_snapshot_loaded:
+        logger.info('Saving KDC snapshot ...')
+        kerberos.save_snapshot(snapshot_path=kdc_snapshot_path, primary_node=primary_node,
+                               kerberos_realm=kerberos_realm)
+
+    if extra_services_placement['kafka']:
+        # Every Kafka broker registers with the standalone ZooKeeper on its own node.
+        logger.info('Waiting for Kafka brokers ...')
+        probes.wait_for_probes(node=primary_node,
+                               probes=[probes.kafka_brokers_probe(zookeeper_fqdn=node.fqdn,
+                                                                  brokers=1)
+                                       for node in extra_services_placement['kafka']])
 
     logger.info("Executing post run script ...")
     secondary_node_group.execute("/root/post_run.sh")
     edge_node_group.execute("/root/post_run.sh")
 
+    extras.configure_grafana_datasource(placement=extra_services_placement)
+
+    if args.validate and not args.dont_start_cluster:
+        run.begin_phase('validate')
+        validate.raise_for_failures(validate.validate_cluster(
+            cluster, deployment, cluster_name=DEFAULT_CLUSTER_NAME,
+            budget=int(args.validate_budget), hosts=hosts,
+            kafka_nodes=extra_services_placement['kafka'],
+            opentsdb_nodes=extra_services_placement['opentsdb'],
+            cm_service=args.cm_service_profile != 'none'
+        ))
+
+
+def get_kerberos_realm(instance_name=None):
+    """Get the Kerberos realm of a cluster instance.
+
+    Args:
+        instance_name (:obj:`str`, optional): The instance name of the cluster. Default: ``None``
+
+    Returns:
+        A :obj:`str` of the realm, ``CLOUDERA`` for a cluster started without an instance name.
+    """
+    return instance_name.upper() if instance_name else DEFAULT_KERBEROS_REALM
+
 
 def update_hosts_file(cluster):
-    # clean old clusterdock hosts-file entries.
+    if cluster.network == networking.HOST_NETWORK:
+        logger.info('Leaving /etc/hosts alone, since nodes in host network mode use the '
+                    'hostname of the Docker host.')
+        return
+
+    # clean old clusterdock hosts-file entries of this cluster's network, leaving those of
+    # other cluster instances alone.
     with open('/etc/hosts', 'r') as etc_hosts:
         host_lines = etc_hosts.readlines()
-    clusterdock_signature = '# Added by clusterdock'
+    clusterdock_signature = '# Added by clusterdock ({})'.format(cluster.network)
     if any(clusterdock_signature in line for line in host_lines):
         logger.info('Clearing container entries from /etc/hosts ...')
         with open('/etc/hosts', 'w') as etc_hosts:
@@ -293,24 +478,45 @@ def update_hosts_file(cluster):
         logger.info('Successfully cleared container entries from /etc/hosts.')
 
     # update hosts file
-    etc_hosts_string = ''.join("{0}   {1}.{2} # Added by clusterdock\n".format(node.ip_address,
-                                                                               node.hostname,
-                                                                               DEFAULT_CLUSTER_NAME) for
+    etc_hosts_string = ''.join("{0}   {1} {2}\n".format(node.ip_address,
+                                                        node.fqdn,
+                                                        clusterdock_signature) for
                                node in cluster.nodes)
     logger.info('Writing new container entries to /etc/hosts ...')
     with open('/etc/hosts', 'a') as etc_hosts:
         etc_hosts.write(etc_hosts_string)
 
 
-def _configure_cm_agents(cluster):
-    for node in cluster:
-        logger.info('Changing CM agent configs on %s ...', node.fqdn)
+def prepare_nodes(primary_node, nodes):
+    """Prepare freshly started nodes for Cloudera Manager.
 
-        cm_agent_config = io.StringIO(cluster.primary_node.get_file(CM_AGENT_CONFIG_FILE_PATH))
-        config = ConfigObj(cm_agent_config, list_item_delimiter=',')
+    Args:
+        primary_node (:py:class:`clusterdock.models.Node`): The primary node of the cluster.
+        nodes (:obj:`list`): A list of :py:class:`clusterdock.models.Node` instances to prepare.
+    """
+    filesystem_fix_commands = ['cp {0} {0}.1; umount {0}; mv -f {0}.1 {0}'.format(file_)
+                               for file_ in ['/etc/hosts',
+                                             '/etc/resolv.conf',
+                                             '/etc/hostname',
+                                             '/etc/localtime']]
+    for node in nodes:
+        node.execute("bash -c '{}'".format('; '.join(filesystem_fix_commands)))
+
+        # Use BSD tar instead of tar because it works bether with docker
+        node.execute("ln -fs /usr/bin/bsdtar /bin/tar")
+
+    _configure_cm_agents(primary_node=primary_node, nodes=nodes)
 
-        logger.debug('Changing server_host to %s ...', cluster.primary_node.fqdn)
-        config['General']['server_host'] = cluster.primary_node.fqdn
+
+def _configure_cm_agents(primary_node, nodes):
+    cm_agent_config = primary_node.get_file(CM_AGENT_CONFIG_FILE_PATH)
+
+    def render_config(node):
+        logger.info('Changing CM agent configs on %s ...', node.fqdn)
+        config = ConfigObj(io.StringIO(cm_agent_config), list_item_delimiter=',')
+
+        logger.debug('Changing server_host to %s ...', primary_node.fqdn)
+        config['General']['server_host'] = primary_node.fqdn
 
         # During container start, a race condition can occur where the hostname passed in
         # to Docker gets overriden by a start script in /etc/rc.sysinit. To avoid this,
@@ -324,12 +530,122 @@ def _configure_cm_agents(cluster):
         logger.debug('Changing reported hostname to %s ...', node.fqdn)
         config['General']['reported_hostname'] = node.fqdn
 
-        for filesystem in ['aufs', 'overlay']:
+        for filesystem in ['aufs', 'overlay', 'tmpfs']:
             if filesystem not in config['General']['local_filesystem_whitelist']:
                 config['General']['local_filesystem_whitelist'].append(filesystem)
 
         # ConfigObj.write returns a list of strings.
-        node.put_file(CM_AGENT_CONFIG_FILE_PATH, '\n'.join(config.write()))
+        return '\n'.join(config.write())
+
+    distribute(nodes, {CM_AGENT_CONFIG_FILE_PATH: render_config})
+
+
+def prepare_secondary_nodes(secondary_nodes, placement, secondary_storage, zookeeper_quorum,
+                            kerberos_realm):
+    """Place the extra services on freshly started secondary nodes and prepare their storage.
+
+    Args:
+        secondary_nodes (:obj:`list`): A list of :py:class:`clusterdock.models.Node` instances to
+            prepare.
+        placement (:obj:`dict`): Extra service names mapped to lists of nodes, as returned by
+            :py:func:`extras.get_placement`. It may include nodes of the cluster other than
+            ``secondary_nodes``, which are left alone.
+        secondary_storage (:py:class:`storage.StorageBackend`): The storage backend of the nodes.
+        zookeeper_quorum (:obj:`str`): Comma-separated ZooKeeper hosts used by HBase.
+        kerberos_realm (:obj:`str`): The Kerberos realm of the cluster.
+    """
+    if not secondary_nodes:
+        return
+    extras.apply_placement(placement=placement, secondary_nodes=secondary_nodes)
+    node_placement = {service: [node for node in nodes if node in secondary_nodes]
+                      for service, nodes in placement.items()}
+    extras.configure_opentsdb(placement=node_placement,
+                              zookeeper_quorum=zookeeper_quorum,
+                              kerberos_realm=kerberos_realm)
+
+    if secondary_storage.kind != 'overlay':
+        logger.info('Preparing %s storage on secondary nodes ...', secondary_storage.kind)
+        if secondary_storage.kind == 'tmpfs':
+            storage.mount_tmpfs(nodes=secondary_nodes, backend=secondary_storage)
+        storage.create_data_dirs(nodes=secondary_nodes,
+                                 dirs={storage.DATANODE_DATA_DIR: ('hdfs:hadoop', '700'),
+                                       storage.NODEMANAGER_LOCAL_DIR: ('yarn:hadoop', '755'),
+                                       storage.KAFKA_LOG_DIR: ('root:root', '755')})
+        # The DataNodes keep the blocks of what HDFS holds in the images.
+        storage.copy_image_data(nodes=secondary_nodes,
+                                dirs={storage.IMAGE_DATANODE_DATA_DIR: storage.DATANODE_DATA_DIR})
+        storage.configure_kafka_log_dirs(nodes=node_placement['kafka'])
+
+
+def remove_cloned_identities(nodes, secondary_storage):
+    """Remove the CM agent UUID and DataNode storage that nodes started from the same image
+    share, which would clash with those of the first node.
+
+    Args:
+        nodes (:obj:`list`): A list of :py:class:`clusterdock.models.Node` instances.
+        secondary_storage (:py:class:`storage.StorageBackend`): The storage backend of the nodes.
+    """
+    _remove_files(nodes=nodes,
+                  files=['/var/lib/cloudera-scm-agent/uuid',
+                         '{}/current'.format(storage.get_datanode_data_dir(secondary_storage))])
+
+
+def _prepare_primary_storage(primary_node, primary_storage):
+    if primary_storage.kind != 'overlay':
+        logger.info('Preparing %s storage on primary node ...', primary_storage.kind)
+        if primary_storage.kind == 'tmpfs':
+            storage.mount_tmpfs(nodes=[primary_node], backend=primary_storage)
+        owner = 'cloudera-scm:cloudera-scm'
+        storage.create_data_dirs(nodes=[primary_node],
+                                 dirs={storage.HOST_MONITOR_STORAGE_DIR: (owner, '755'),
+                                       storage.SERVICE_MONITOR_STORAGE_DIR: (owner, '755')})
+
+
+def _update_storage_configs(deployment, cluster_name, primary_storage, secondary_storage):
+    if primary_storage.kind != 'overlay':
+        logger.info('Moving Cloudera Management Service storage to %s ...',
+                    storage.DATA_MOUNT_PATH)
+        deployment.update_cm_service_role_config_group_config(
+            role_config_group_name='mgmt-HOSTMONITOR-BASE',
+            configs={'firehose_storage_dir': storage.HOST_MONITOR_STORAGE_DIR}
+        )
+        deployment.update_cm_service_role_config_group_config(
+            role_config_group_name='mgmt-SERVICEMONITOR-BASE',
+            configs={'firehose_storage_dir': storage.SERVICE_MONITOR_STORAGE_DIR}
+        )
+
+    if secondary_storage.kind != 'overlay':
+        logger.info('Pointing DataNode and NodeManager data directories at %s ...',
+                    storage.DATA_MOUNT_PATH)
+        deployment.update_service_role_config_group_config(
+            cluster_name=cluster_name, service_name='hdfs',
+            role_config_group_name='hdfs-DATANODE-BASE',
+            configs={'dfs_data_dir_list': storage.DATANODE_DATA_DIR}
+        )
+        deployment.update_service_role_config_group_config(
+            cluster_name=cluster_name, service_name='yarn',
+            role_config_group_name='yarn-NODEMANAGER-BASE',
+            configs={'yarn_nodemanager_local_dirs': storage.NODEMANAGER_LOCAL_DIR}
+        )
+
+
+def _apply_cm_service_profile(deployment, profile):
+    if profile == 'full':
+        return
+    elif profile == 'none':
+        logger.info('Cloudera Management Service will not be started.')
+        return
+
+    logger.info('Applying lite Cloudera Management Service profile ...')
+    for role in deployment.get_cm_service_roles(fields=['name', 'type']):
+        if role['type'] not in CM_SERVICE_LITE_ROLE_TYPES:
+            logger.debug('Deleting Cloudera Management Service role %s ...', role['name'])
+            deployment.delete_cm_service_role(role_name=role['name'])
+    for role_type in CM_SERVICE_LITE_ROLE_TYPES:
+        deployment.update_cm_service_role_config_group_config(
+            role_config_group_name='mgmt-{}-BASE'.format(role_type),
+            configs=CM_SERVICE_LITE_CONFIGS
+        )
 
 
 def _remove_files(nodes, files):
@@ -349,7 +665,7 @@ def _restart_cm_agents(cluster):
     cluster.execute(command=command, quiet=False)
 
 
-def _wait_for_cm_server(primary_node):
+def _wait_for_cm_server(primary_node, timeout=180):
     def condition(container):
         container.reload()
         health_status = nested_get(container.attrs, ['State', 'Health', 'Status'])
@@ -364,10 +680,10 @@ def _wait_for_cm_server(primary_node):
                            'for Cloudera Manager to start.'.format(timeout))
 
     wait_for_condition(condition=condition, condition_args=[primary_node.container],
-                       time_between_checks=3, timeout=180, success=success, failure=failure)
+                       time_between_checks=3, timeout=timeout, success=success, failure=failure)
 
 
-def _wait_for_activated_cdh_parcel(deployment, cluster_name):
+def _wait_for_activated_cdh_parcel(deployment, cluster_name, timeout=500):
     parcels = deployment.get_cluster_parcels(cluster_name=cluster_name)
     parcel_version = next(parcel['version'] for parcel in parcels
                           if parcel['product'] == 'CDH' and parcel['stage'] in ('ACTIVATING',
@@ -398,7 +714,7 @@ def _wait_for_activated_cdh_parcel(deployment, cluster_name):
                            'CDH parcel to become activated.'.format(timeout))
 
     wait_for_condition(condition=condition, condition_args=[deployment, cluster_name],
-                       time_between_checks=1, timeout=500, time_to_success=10,
+                       time_between_checks=1, timeout=timeout, time_to_success=10,
                        success=success, failure=failure)
 
 
@@ -415,13 +731,13 @@ def _create_secondary_node_template(deployment, cluster_name, secondary_node):
                                     role_config_group_names=role_config_group_names)
 
 
-def regenerate_keytabs(cluster, node, deployment):
+def regenerate_keytabs(cluster, node, deployment, host_ids):
     cluster.primary_node.execute(
         "curl -sc cookiejar -XGET -u admin:admin http://{0}:{1}/api/v14/clusters/cluster".format(node.fqdn,
                                                                                                  CM_PORT), quiet=True)
     cluster.primary_node.execute(
-        "curl -sb cookiejar -XPOST http://{0}:{1}/cmf/hardware/regenerateKeytab --data 'hostId=2&hostId=3&hostId=1' -H 'Referer: http://{0}:{1}/cmf/hardware/hosts'".format(
-            node.fqdn, CM_PORT), quiet=True)
+        "curl -sb cookiejar -XPOST http://{0}:{1}/cmf/hardware/regenerateKeytab --data '{2}' -H 'Referer: http://{0}:{1}/cmf/hardware/hosts'".format(
+            node.fqdn, CM_PORT, '&'.join('hostId={}'.format(host_id) for host_id in host_ids)), quiet=True)
 
     # Wait for keytab regeneration...
     while True:
@@ -432,20 +748,22 @@ def regenerate_keytabs(cluster, node, deployment):
         time.sleep(1)
 
 
-def _update_database_configs(deployment, cluster_name, primary_node):
+def _update_database_configs(deployment, cluster_name, database_host, database_port):
     for service in deployment.get_cluster_services(cluster_name=cluster_name):
         if service['type'] == 'HIVE':
-            configs = {'hive_metastore_database_host': primary_node.fqdn}
+            configs = {'hive_metastore_database_host': database_host,
+                       'hive_metastore_database_port': str(database_port)}
             deployment.update_service_config(cluster_name=cluster_name,
                                              service_name=service['name'],
                                              configs=configs)
         elif service['type'] == 'HUE':
-            configs = {'database_host': primary_node.fqdn}
+            configs = {'database_host': database_host,
+                       'database_port': str(database_port)}
             deployment.update_service_config(cluster_name=cluster_name,
                                              service_name=service['name'],
                                              configs=configs)
         elif service['type'] == 'OOZIE':
-            configs = {'oozie_database_host': '{}:7432'.format(primary_node.fqdn)}
+            configs = {'oozie_database_host': '{}:{}'.format(database_host, database_port)}
             service_name = service['name']
             args = [cluster_name, service_name]
             for role_config_group in deployment.get_service_role_config_groups(*args):
@@ -453,12 +771,23 @@ def _update_database_configs(deployment, cluster_name, primary_node):
                     args = [cluster_name, service_name, role_config_group['name'], configs]
                     deployment.update_service_role_config_group_config(*args)
         elif service['type'] == 'SENTRY':
-            configs = {'sentry_server_database_host': primary_node.fqdn}
+            configs = {'sentry_server_database_host': database_host,
+                       'sentry_server_database_port': str(database_port)}
             deployment.update_service_config(cluster_name=cluster_name,
                                              service_name=service['name'],
                                              configs=configs)
 
 
+def _update_cm_service_database_configs(deployment, database_host):
+    # Every role with a database keeps it next to CM's own, which is stopped on the primary node.
+    logger.info('Moving Cloudera Management Service databases to %s ...', database_host)
+    for role_type, config_name in CM_SERVICE_DATABASE_HOST_CONFIGS.items():
+        deployment.update_cm_service_role_config_group_config(
+            role_config_group_name='mgmt-{}-BASE'.format(role_type),
+            configs={config_name: '{}:{}'.format(database_host, database.DATABASE_PORT)}
+        )
+
+
 def _update_hive_metastore_namenodes(deployment, cluster_name):
     for service in deployment.get_cluster_services(cluster_name=cluster_name):
         if service['type'] == 'HIVE':
@@ -486,7 +815,7 @@ def _update_hive_metastore_namenodes(deployment, cluster_name):
                        time_between_checks=3, timeout=180, success=success, failure=failure)
 
 
-def _deploy_client_config(deployment, cluster_name):
+def _deploy_client_config(deployment, cluster_name, timeout=180):
     command_id = deployment.deploy_cluster_client_config(cluster_name=cluster_name)['id']
 
     def condition(deployment, command_id):
@@ -512,7 +841,7 @@ def _deploy_client_config(deployment, cluster_name):
                            'for cluster client config to deploy.'.format(timeout))
 
     wait_for_condition(condition=condition, condition_args=[deployment, command_id],
-                       time_between_checks=3, timeout=180, success=success, failure=failure)
+                       time_between_checks=3, timeout=timeout, success=success, failure=failure)
 
 
 def _start_cluster(deployment, cluster_name):
@@ -538,7 +867,7 @@ def _start_cluster(deployment, cluster_name):
                        time_between_checks=3, timeout=600, success=success, failure=failure)
 
 
-def _start_service_command(deployment, cluster_name, service_name, command):
+def _start_service_command(deployment, cluster_name, service_name, command, timeout=600):
     command_id = \
     deployment.start_cluster_service_command(cluster_name=cluster_name, service_name=service_name, command=command)[
         'id']
@@ -560,10 +889,42 @@ def _start_service_command(deployment, cluster_name, service_name, command):
                            'for cluster service to start.'.format(timeout))
 
     wait_for_condition(condition=condition, condition_args=[deployment, command_id],
-                       time_between_checks=1, timeout=600, success=success, failure=failure)
+                       time_between_checks=1, timeout=timeout, success=success, failure=failure)
+
+
+def _start_service(deployment, hosts, node, cluster_name, service_name, pending_command_ids,
+                   timeout=600):
+    """Start a cluster service and wait until it is usable.
+
+    Services without readiness probes are waited on until their start command finishes. For
+    the others, the probes run from ``node`` and the command is added to ``pending_command_ids``
+    as soon as they pass.
+    """
+    service_probes = probes.get_service_probes(deployment=deployment, hosts=hosts,
+                                               cluster_name=cluster_name,
+                                               service_name=service_name)
+    if not service_probes:
+        _start_service_command(deployment=deployment, cluster_name=cluster_name,
+                               service_name=service_name, command='start', timeout=timeout)
+        return
+
+    command_id = deployment.start_cluster_service_command(cluster_name=cluster_name,
+                                                          service_name=service_name,
+                                                          command='start')['id']
+
+    def abort():
+        command_information = deployment.api_client.get_command_information(command_id)
+        if not command_information.get('active') and not command_information.get('success'):
+            raise Exception('Failed to start {} ({}).'.format(
+                service_name, command_information.get('resultMessage')
+            ))
 
+    logger.debug('Waiting for %s to become ready ...', service_name)
+    probes.wait_for_probes(node=node, probes=service_probes, timeout=timeout, abort=abort)
+    pending_command_ids.append(command_id)
 
-def _start_cm_service(deployment):
+
+def _start_cm_service(deployment, timeout=180):
     command_id = deployment.start_cm_service()['id']
 
     def condition(deployment, command_id):
@@ -583,33 +944,4 @@ def _start_cm_service(deployment):
                            'for CM service to start.'.format(timeout))
 
     wait_for_condition(condition=condition, condition_args=[deployment, command_id],
-                       time_between_checks=3, timeout=180, success=success, failure=failure)
-
-
-def _validate_service_health(deployment, cluster_name):
-    def condition(deployment, cluster_name):
-        services = (deployment.get_cluster_services(cluster_name=cluster_name)
-                    + [deployment.get_cm_service()])
-        if all(service.get('serviceState') == 'NA' or
-                                       service.get('serviceState') == 'STARTED' and service.get(
-                           'healthSummary') == 'GOOD'
-               for service in services):
-            return True
-        else:
-            logger.debug('Services with poor health: %s',
-                         ', '.join(service['name']
-                                   for service in services
-                                   if (service.get('healthSummary') != 'GOOD'
-                                       and service.get('serviceState') != 'NA')
-                                   or service.get('serviceState') not in ('STARTED', 'NA')))
-
-    def success(time):
-        logger.debug('Validated service health in %s seconds.', time)
-
-    def failure(timeout):
-        raise TimeoutError('Timed out after {} seconds waiting '
-                           'to validate service health.'.format(timeout))
-
-    wait_for_condition(condition=condition, condition_args=[deployment, cluster_name],
-                       time_between_checks=3, timeout=600, time_to_success=30,
-                       success=success, failure=failure)
+                       time_between_checks=3, timeout=timeout, success=success, failure=failure)
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""The state of a running cluster at a glance.
+
+Everything is collected at the same time: an inspect per container, one CM API call each for the
+hosts, services, parcels and Kerberos configuration, one per service for its roles, and a check of
+the KDC on the primary node. The number of calls grows with the services, not with the nodes.
+"""
+
+import logging
+import sys
+import time
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from clusterdock.utils import nested_get
+
+from . import cluster_utils
+from .cm import ClouderaManagerDeployment
+from .cm_utils import parse_cm_timestamp
+from .history import format_table
+
+logger = logging.getLogger('clusterdock.{}'.format(__name__))
+
+DEFAULT_WATCH_INTERVAL = 5
+
+HOST_FIELDS = ['hostId', 'hostname', 'lastHeartbeat', 'healthSummary', 'maintenanceMode']
+ROLE_FIELDS = ['type', 'hostRef.hostId', 'roleState', 'healthSummary']
+# Parcels CM only knows about from its repositories aren't of interest.
+REMOTE_PARCEL_STAGE = 'AVAILABLE_REMOTELY'
+
+# Escape sequences of the terminal for watch mode.
+CLEAR_SCREEN = '\x1b[2J'
+CLEAR_TO_END_OF_SCREEN = '\x1b[J'
+CLEAR_LINE = '\x1b[2K'
+MOVE_TO_LINE = '\x1b[{};1H'
+
+
+def main(args):
+    cluster = cluster_utils.attach_cluster(args.network)
+    deployment = ClouderaManagerDeployment(cluster_utils.get_server_url(cluster.primary_node))
+    if not args.watch:
+        print(render(collect_status(cluster, deployment)))
+        return
+
+    screen = Screen()
+    try:
+        while True:
+            try:
+                lines = render(collect_status(cluster, deployment)).split('\n')
+            except Exception as exception:
+                # A cluster that's paused or restarting is watched until it's back.
+                lines = ['Could not collect the status of the cluster at {} ({}).'.format(
+                    datetime.now().strftime('%H:%M:%S'), exception
+                )]
+            screen.draw(lines)
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+
+
+def collect_status(cluster, deployment, cluster_name=cluster_utils.DEFAULT_CLUSTER_NAME):
+    """Collect the state of the containers, CM hosts, services, roles, parcels and Kerberos of a
+    cluster, all at the same time.
+
+    Args:
+        cluster (:py:class:`clusterdock.models.Cluster`): The cluster.
+        deployment (:py:class:`cm.ClouderaManagerDeployment`): The CM deployment.
+        cluster_name (:obj:`str`, optional): The name of the cluster.
+            Default: :py:const:`cluster_utils.DEFAULT_CLUSTER_NAME`
+
+    Returns:
+        A :obj:`dict` of the state, as :py:func:`render` takes it.
+    """
+    start_time = time.time()
+    request_count = deployment.api_client.request_count
+    nodes = list(cluster.nodes)
+    with ThreadPoolExecutor(max_workers=len(nodes) + 6) as executor:
+        reloads = [executor.submit(node.container.reload) for node in nodes]
+        hosts = executor.submit(deployment.get_all_hosts, view='full', fields=HOST_FIELDS)
+        services = executor.submit(deployment.get_cluster_services, cluster_name=cluster_name)
+        parcels = executor.submit(deployment.get_cluster_parcels, cluster_name=cluster_name)
+        kerberos_info = executor.submit(deployment.get_cluster_kerberos_info,
+                                        cluster_name=cluster_name)
+        kdc = executor.submit(cluster.primary_node.execute,
+                              'service krb5kdc status && service kadmin status', quiet=True)
+        roles = OrderedDict((service['name'],
+                             executor.submit(deployment.get_service_roles,
+                                             cluster_name=cluster_name,
+                                             service_name=service['name'],
+                                             fields=ROLE_FIELDS))
+                            for service in services.result())
+        for reload in reloads:
+            reload.result()
+
+        status = {
+            'cluster': cluster,
+            'server_url': deployment.api_client.server_url,
+            'collected_at': datetime.now(timezone.utc),
+            'hosts': hosts.result(),
+            'services': services.result(),
+            'roles': OrderedDict((service_name, future.result())
+                                 for service_name, future in roles.items()),
+            'parcels': parcels.result(),
+            'kerberos': kerberos_info.result(),
+            'kdc_running': kdc.result().exit_code == 0,
+        }
+    status['seconds'] = time.time() - start_time
+    status['api_requests'] = deployment.api_client.request_count - request_count
+    logger.debug('Collected cluster status in %.2f seconds with %s CM API requests.',
+                 status['seconds'], status['api_requests'])
+    return status
+
+
+def render(status):
+    """Render the state of a cluster as tables.
+
+    Args:
+        status (:obj:`dict`): The state, see :py:func:`collect_status`.
+
+    Returns:
+        A :obj:`str` of the tables.
+    """
+    cluster = status['cluster']
+    collected_at = status['collected_at']
+    fqdns_by_host_id = {host['hostId']: host['hostname'] for host in status['hosts']}
+
+    container_rows = [('CONTAINER', 'GROUP', 'STATE', 'HEALTH', 'IP ADDRESS')]
+    for node in cluster.nodes:
+        container_rows.append((node.fqdn, node.group,
+                               nested_get(node.container.attrs, ['State', 'Status']) or '-',
+                               nested_get(node.container.attrs, ['State', 'Health', 'Status'])
+                               or '-',
+                               node.ip_address or '-'))
+
+    host_rows = [('HOST', 'HEARTBEAT', 'HEALTH', 'MAINTENANCE')]
+    for host in sorted(status['hosts'], key=lambda host: host['hostname']):
+        host_rows.append((host['hostname'],
+                          _format_heartbeat(host.get('lastHeartbeat'), collected_at),
+                          host.get('healthSummary', '-'),
+                          'yes' if host.get('maintenanceMode') else 'no'))
+
+    service_rows = [('SERVICE', 'TYPE', 'STATE', 'HEALTH')]
+    for service in status['services']:
+        service_rows.append((service['name'], service['type'],
+                             service.get('serviceState', '-'), service.get('healthSummary', '-')))
+
+    # Roles are counted per service and role type, so the table stays as long as the number of
+    # role types however many nodes there are. Roles that aren't in good health are named.
+    role_rows = [('SERVICE', 'ROLE TYPE', 'ROLES', 'STATES', 'HEALTH', 'NOT GOOD ON')]
+    for service_name, roles in status['roles'].items():
+        roles_by_type = defaultdict(list)
+        for role in roles:
+            roles_by_type[role['type']].append(role)
+        for role_type, typed_roles in sorted(roles_by_type.items()):
+            not_good_fqdns = sorted(
+                fqdns_by_host_id.get(nested_get(role, ['hostRef', 'hostId']), '?')
+                for role in typed_roles if role.get('healthSummary') not in ('GOOD', None)
+            )
+            role_rows.append((service_name, role_type, str(len(typed_roles)),
+                              _format_counts(role.get('roleState') for role in typed_roles),
+                              _format_counts(role.get('healthSummary') for role in typed_roles),
+                              ', '.join(not_good_fqdns)))
+
+    parcel_rows = [('PARCEL', 'VERSION', 'STAGE')]
+    for parcel in status['parcels']:
+        if parcel['stage'] != REMOTE_PARCEL_STAGE:
+            parcel_rows.append((parcel['product'], parcel['version'], parcel['stage']))
+
+    kerberos = status['kerberos']
+    kerberos_line = 'Kerberos: {}, realm {}, KDC on {} ({})'.format(
+        'enabled' if kerberos.get('kerberized') else 'not enabled',
+        kerberos.get('kerberosRealm', '-'),
+        kerberos.get('kdcHost', '-'),
+        'running' if status['kdc_running'] else 'not running'
+    )
+
+    header = 'Cluster {} on network {}, Cloudera Manager at {} ({}, {:.1f} seconds)'.format(
+        cluster.name, cluster.network, status['server_url'],
+        collected_at.astimezone().strftime('%H:%M:%S'), status['seconds']
+    )
+    sections = [header, kerberos_line] + [format_table(rows)
+                                          for rows in (container_rows, host_rows, service_rows,
+                                                       role_rows, parcel_rows)
+                                          if len(rows) > 1]
+    return '\n\n'.join(sections)
+
+
+class Screen:
+    """A terminal screen on which lines are redrawn, rewriting only the lines that changed.
+
+    Args:
+        stream (optional): The stream of the terminal. Default: ``sys.stdout``
+    """
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self._lines = None
+
+    def draw(self, lines):
+        """Draw lines in place of those drawn before.
+
+        Args:
+            lines (:obj:`list`): The lines, as :obj:`str` instances.
+        """
+        if self._lines is None:
+            self.stream.write(CLEAR_SCREEN)
+            self._lines = []
+        for index, line in enumerate(lines):
+            if index >= len(self._lines) or self._lines[index] != line:
+                self.stream.write(MOVE_TO_LINE.format(index + 1) + CLEAR_LINE + line)
+        self.stream.write(MOVE_TO_LINE.format(len(lines) + 1))
+        if len(lines) < len(self._lines):
+            self.stream.write(CLEAR_TO_END_OF_SCREEN)
+        self.stream.flush()
+        self._lines = list(lines)
+
+
+def _format_heartbeat(last_heartbeat, now):
+    if not last_heartbeat:
+        return 'never'
+    heartbeat_time = parse_cm_timestamp(last_heartbeat)
+    return '{:.0f}s ago'.format(max(0, (now - heartbeat_time).total_seconds()))
+
+
+def _format_counts(values):
+    return ', '.join('{} {}'.format(value, count)
+                     for value, count in sorted(Counter(value or '-' for value in values).items()))
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import logging
+import os
+import re
+from collections import namedtuple
+
+from clusterdock.utils import nested_get
+
+logger = logging.getLogger('clusterdock.{}'.format(__name__))
+
+# The images keep the data of the services here, including the NameNode metadata formatted when
+# they were built, so storage backends must not be mounted over it.
+IMAGE_DATA_PATH = '/data'  #:
+IMAGE_DATANODE_DATA_DIR = '{}/dfs/dn'.format(IMAGE_DATA_PATH)  #:
+
+# Every storage backend other than ``overlay`` is mounted on this path inside the container. The
+# data directories of the services are then created underneath it.
+DATA_MOUNT_PATH = '/storage'  #:
+
+DATANODE_DATA_DIR = '{}/dfs/dn'.format(DATA_MOUNT_PATH)  #:
+NODEMANAGER_LOCAL_DIR = '{}/yarn/nm'.format(DATA_MOUNT_PATH)  #:
+KAFKA_LOG_DIR = '{}/kafka-logs'.format(DATA_MOUNT_PATH)  #:
+HOST_MONITOR_STORAGE_DIR = '{}/cloudera-host-monitor'.format(DATA_MOUNT_PATH)  #:
+SERVICE_MONITOR_STORAGE_DIR = '{}/cloudera-service-monitor'.format(DATA_MOUNT_PATH)  #:
+
+KAFKA_SERVER_PROPERTIES_PATH = '/opt/kafka/config/server.properties'
+
+STORAGE_BACKENDS = ('overlay', 'volume', 'bind', 'tmpfs')
+
+StorageBackend = namedtuple('StorageBackend', ['kind', 'option'])
+
+
+def parse_storage_backend(spec):
+    """Parse a storage backend specification as given in topology.yaml.
+
+    The following formats are supported:
+
+    - ``overlay``: keep data on the container's own filesystem (default).
+    - ``volume`` or ``volume:<prefix>``: a named Docker volume per node.
+    - ``bind:<host directory>``: a host directory, with one subdirectory per node.
+    - ``tmpfs:<size>``: a tmpfs mount capped at the given size (e.g. ``4g``).
+
+    Args:
+        spec (:obj:`str`): The storage backend specification.
+
+    Returns:
+        A :py:class:`StorageBackend` instance.
+    """
+    kind, _, option = (spec or 'overlay').partition(':')
+    if kind not in STORAGE_BACKENDS:
+        raise ValueError('Unknown storage backend {} (must be one of {}).'.format(
+            kind, ', '.join(STORAGE_BACKENDS)
+        ))
+    if kind == 'bind' and not os.path.isabs(option):
+        raise ValueError('Storage backend bind requires an absolute host path (saw {}).'.format(
+            option or 'None'
+        ))
+    if kind == 'tmpfs' and not option:
+        raise ValueError('Storage backend tmpfs requires a size (e.g. tmpfs:4g).')
+    return StorageBackend(kind=kind, option=option or None)
+
+
+def get_storage_backend(node):
+    """Work out the storage backend a running node was started with.
+
+    Args:
+        node (:py:class:`clusterdock.models.Node`): The node, with its container.
+
+    Returns:
+        A :py:class:`StorageBackend` instance.
+    """
+    for mount in nested_get(node.container.attrs, ['Mounts']) or []:
+        if mount.get('Destination') != DATA_MOUNT_PATH:
+            continue
+        if mount.get('Type') == 'volume':
+            # Volumes are named <prefix>-<hostname>-data, see get_node_volumes.
+            suffix = '-{}-data'.format(node.hostname)
+            return StorageBackend(kind='volume', option=mount['Name'][:-len(suffix)])
+        if mount.get('Type') == 'bind':
+            return StorageBackend(kind='bind', option=os.path.dirname(mount['Source']))
+    # A tmpfs is mounted from inside the container, so only the container knows about it.
+    mounts = node.execute('cat /proc/mounts', quiet=True).output
+    match = re.search(r'^\S+ {} tmpfs \S*\bsize=(\w+)'.format(re.escape(DATA_MOUNT_PATH)),
+                      mounts, re.MULTILINE)
+    if match:
+        return StorageBackend(kind='tmpfs', option=match.group(1))
+    return StorageBackend(kind='overlay', option=None)
+
+
+def get_node_volumes(backend, hostname, namespace):
+    """Get the volumes to pass to a :py:class:`clusterdock.models.Node` for a storage backend.
+
+    Args:
+        backend (:py:class:`StorageBackend`): The storage backend of the node.
+        hostname (:obj:`str`): Hostname of the node.
+        namespace (:obj:`str`): Name used to keep volumes of different clusters apart.
+
+    Returns:
+        A list of volumes (possibly empty).
+    """
+    if backend.kind == 'volume':
+        # Docker treats a bind source that is not an absolute path as the name of a volume.
+        volume_name = '{}-{}-data'.format(backend.option or namespace, hostname)
+        return [{volume_name: DATA_MOUNT_PATH}]
+    elif backend.kind == 'bind':
+        return [{os.path.join(backend.option, hostname): DATA_MOUNT_PATH}]
+    return []
+
+
+def mount_tmpfs(nodes, backend):
+    """Mount a size-capped tmpfs on :py:const:`DATA_MOUNT_PATH` of every node.
+
+    Args:
+        nodes (:obj:`list`): A list of :py:class:`clusterdock.models.Node` instances.
+        backend (:py:class:`StorageBackend`): A ``tmpfs`` storage backend.
+    """
+    command = 'mkdir -p {0} && mount -t tmpfs -o size={1},mode=755 tmpfs {0}'.format(
+        DATA_MOUNT_PATH, backend.option
+    )
+    for node in nodes:
+        logger.debug('Mounting tmpfs (size: %s) on %s:%s ...',
+                     backend.option, node.fqdn, DATA_MOUNT_PATH)
+        result = node.execute(command, quiet=True)
+        if result.exit_code != 0:
+            raise Exception('Failed to mount tmpfs on {} ({}).'.format(node.fqdn,
+                                                                       result.output.strip()))
+
+
+def get_datanode_data_dir(backend):
+    """Get the DataNode data directory of the nodes with a storage backend.
+
+    Args:
+        backend (:py:class:`StorageBackend`): The storage backend of the nodes.
+
+    Returns:
+        The path of the directory as a :obj:`str`.
+    """
+    return IMAGE_DATANODE_DATA_DIR if backend.kind == 'overlay' else DATANODE_DATA_DIR
+
+
+def create_data_dirs(nodes, dirs):
+    """Create data directories on a group of nodes.
+
+    Args:
+        nodes (:obj:`list`): A list of :py:class:`clusterdock.models.Node` instances.
+        dirs (:obj:`dict`): Directory paths mapped to ``(owner, mode)`` tuples.
+    """
+    command = ' && '.join('mkdir -p {0} && chown -R {1} {0} && chmod {2} {0}'.format(path,
+                                                                                    owner,
+                                                                                    mode)
+                          for path, (owner, mode) in dirs.items())
+    for node in nodes:
+        logger.debug('Creating data directories (%s) on %s ...', ', '.join(dirs), node.fqdn)
+        node.execute(command, quiet=True)
+
+
+def copy_image_data(nodes, dirs):
+    """Copy data the images keep under :py:const:`IMAGE_DATA_PATH` into data directories on a
+    storage backend, e.g. the blocks of files HDFS was loaded with when the images were built.
+
+    Args:
+        nodes (:obj:`list`): A list of :py:class:`clusterdock.models.Node` instances.
+        dirs (:obj:`dict`): Directory paths in the images mapped to the paths to copy them to.
+    """
+    command = ' && '.join('if [ -d {0} ]; then cp -a {0}/. {1}; fi'.format(source, target)
+                          for source, target in dirs.items())
+    for node in nodes:
+        logger.debug('Copying %s on %s ...', ', '.join(dirs), node.fqdn)
+        result = node.execute(command, quiet=True)
+        if result.exit_code != 0:
+            raise Exception('Failed to copy image data on {} ({}).'.format(node.fqdn,
+                                                                          result.output.strip()))
+
+
+def configure_kafka_log_dirs(nodes):
+    """Point Kafka's ``log.dirs`` at :py:const:`KAFKA_LOG_DIR` and restart the brokers.
+
+    Args:
+        nodes (:obj:`list`): A list of :py:class:`clusterdock.models.Node` instances running Kafka.
+    """
+    command = ("sed -i 's#^log.dirs=.*#log.dirs={0}#' {1} "
+               "&& supervisorctl restart kafka").format(KAFKA_LOG_DIR,
+                                                        KAFKA_SERVER_PROPERTIES_PATH)
+    for node in nodes:
+        logger.debug('Changing Kafka log.dirs to %s on %s ...', KAFKA_LOG_DIR, node.fqdn)
+        node.execute(command, quiet=True)
@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Functional checks that a started cluster actually works.
+
+Every enabled service gets one small round trip (e.g. writing a file to HDFS and reading it
+back) and all of them run at the same time. Each check has a timeout of its own, enforced with
+``timeout`` on the node running it, and the whole stage has a budget after which checks that
+are still running count as failed.
+"""
+
+import json
+import logging
+import shlex
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from clusterdock.utils import wait_for_condition
+
+from . import cluster_utils
+from .cm import ClouderaManagerDeployment
+from .extras import KAFKA_ZOOKEEPER_PORT, OPENTSDB_PORT
+from .hosts import HostRegistry
+from .kerberos import KEYTAB_FILE_PATH, KEYTAB_PRINCIPAL
+from .pause import get_client_node, supervisor_program_exists
+
+logger = logging.getLogger('clusterdock.{}'.format(__name__))
+
+DEFAULT_BUDGET = 900
+
+CDH_PARCEL_DIR = '/opt/cloudera/parcels/CDH'
+MAPREDUCE_EXAMPLES_JAR = '{}/lib/hadoop-mapreduce/hadoop-mapreduce-examples.jar'.format(
+    CDH_PARCEL_DIR
+)
+KAFKA_BIN_DIR = '/opt/kafka/bin'
+KAFKA_BROKER = 'localhost:9092'
+OOZIE_PORT = 11000
+HUE_PORT = 8888
+SQOOP_PORT = 12000
+
+# Seconds each check may take.
+CHECK_TIMEOUTS = {
+    'cloudera-manager': 600,
+    'hdfs': 60,
+    'yarn': 300,
+    'hbase': 120,
+    'hive': 300,
+    'oozie': 30,
+    'hue': 30,
+    'sqoop': 30,
+    'kafka': 60,
+    'opentsdb': 60,
+}
+
+# The exit code of ``timeout`` once it had to kill the command.
+TIMEOUT_EXIT_CODE = 124
+
+CheckResult = namedtuple('CheckResult', ['passed', 'seconds', 'detail'])
+
+
+def main(args):
+    cluster = cluster_utils.attach_cluster(args.network)
+    deployment = ClouderaManagerDeployment(cluster_utils.get_server_url(cluster.primary_node))
+    raise_for_failures(validate_cluster(cluster, deployment, budget=args.budget))
+
+
+def validate_cluster(cluster, deployment, cluster_name=cluster_utils.DEFAULT_CLUSTER_NAME,
+                     budget=DEFAULT_BUDGET, hosts=None, kafka_nodes=None, opentsdb_nodes=None,
+                     cm_service=True):
+    """Run the checks of every started service at the same time and log a table of the results.
+
+    Args:
+        cluster (:py:class:`clusterdock.models.Cluster`): The cluster.
+        deployment (:py:class:`cm.ClouderaManagerDeployment`): The CM deployment.
+        cluster_name (:obj:`str`, optional): The name of the cluster.
+            Default: :py:const:`cluster_utils.DEFAULT_CLUSTER_NAME`
+        budget (:obj:`int`, optional): Seconds all checks together may take.
+            Default: :py:const:`DEFAULT_BUDGET`
+        hosts (:py:class:`hosts.HostRegistry`, optional): The hosts of the cluster.
+            Default: ``None`` (load them)
+        kafka_nodes (:obj:`list`, optional): Nodes running Kafka. Default: ``None`` (the secondary
+            nodes with a ``kafka`` supervisord program)
+        opentsdb_nodes (:obj:`list`, optional): Nodes running OpenTSDB. Default: ``None`` (the
+            secondary nodes with an ``opentsdb`` supervisord program)
+        cm_service (:obj:`bool`, optional): Include the Cloudera Management Service in the
+            health check, i.e. unless it was left stopped on purpose. Default: ``True``
+
+    Returns:
+        An :py:class:`collections.OrderedDict` of check names mapped to :py:class:`CheckResult`
+        instances.
+    """
+    if hosts is None:
+        hosts = HostRegistry(deployment, cluster.nodes)
+        hosts.wait_for_hosts()
+    if kafka_nodes is None:
+        kafka_nodes = [node for node in cluster
+                       if node.group == 'secondary' and supervisor_program_exists(node, 'kafka')]
+    if opentsdb_nodes is None:
+        opentsdb_nodes = [node for node in cluster
+                          if node.group == 'secondary'
+                          and supervisor_program_exists(node, 'opentsdb')]
+    client_node = get_client_node(cluster) or cluster.primary_node
+    cluster_utils.execute(client_node, 'kinit -kt {} {}'.format(KEYTAB_FILE_PATH,
+                                                                KEYTAB_PRINCIPAL))
+    run_id = str(int(time.time()))
+
+    def role_fqdns(service_name, role_type):
+        return sorted(hosts.get_fqdn(host_id=role['hostRef']['hostId'])
+                      for role in deployment.get_service_roles(cluster_name=cluster_name,
+                                                               service_name=service_name,
+                                                               fields=['type', 'hostRef.hostId'])
+                      if role['type'] == role_type)
+
+    started_services = {service['name']
+                        for service in deployment.get_cluster_services(cluster_name=cluster_name)
+                        if service.get('serviceState') == 'STARTED'}
+    service_checks = OrderedDict([
+        ('hdfs', lambda: _check_hdfs(client_node, run_id)),
+        ('yarn', lambda: _check_yarn(client_node)),
+        ('hbase', lambda: _check_hbase(client_node, run_id)),
+        ('hive', lambda: _check_hive(client_node, run_id)),
+        ('oozie', lambda: [_check_endpoint(client_node, 'oozie', 'http://{}:{}/oozie/v1/admin/'
+                                                                 'status'.format(fqdn, OOZIE_PORT))
+                           for fqdn in role_fqdns('oozie', 'OOZIE_SERVER')]),
+        ('hue', lambda: [_check_endpoint(client_node, 'hue',
+                                         'http://{}:{}/accounts/login/'.format(fqdn, HUE_PORT))
+                         for fqdn in role_fqdns('hue', 'HUE_SERVER')]),
+        ('sqoop', lambda: [_check_endpoint(client_node, 'sqoop',
+                                           'http://{}:{}/sqoop/version'.format(fqdn, SQOOP_PORT))
+                           for fqdn in role_fqdns('sqoop', 'SQOOP_SERVER')]),
+    ])
+
+    checks = OrderedDict([('cloudera-manager',
+                           lambda: _check_service_health(deployment, cluster_name, cm_service))])
+    checks.update((service_name, check) for service_name, check in service_checks.items()
+                  if service_name in started_services)
+    # The extra services run on secondary nodes outside of CM, and are checked node by node.
+    checks.update(('kafka on {}'.format(node.fqdn), lambda node=node: _check_kafka(node, run_id))
+                  for node in kafka_nodes)
+    checks.update(('opentsdb on {}'.format(node.fqdn),
+                   lambda node=node: _check_opentsdb(client_node, node.fqdn, run_id))
+                  for node in opentsdb_nodes)
+
+    logger.info('Validating %s ...', ', '.join(checks))
+    results = run_checks(checks, budget)
+    logger.info('Validation results:\n%s', format_results(results))
+    return results
+
+
+def run_checks(checks, budget=DEFAULT_BUDGET):
+    """Run checks at the same time.
+
+    Args:
+        checks (:obj:`dict`): Check names mapped to functions that raise if the check fails and
+            may return details to report.
+        budget (:obj:`int`, optional): Seconds all checks together may take. Checks still
+            running after that fail. Default: :py:const:`DEFAULT_BUDGET`
+
+    Returns:
+        An :py:class:`collections.OrderedDict` of check names mapped to :py:class:`CheckResult`
+        instances.
+    """
+    def run_check(check):
+        start_time = time.time()
+        try:
+            detail = check()
+            passed = True
+        except Exception as exception:
+            detail = str(exception).strip().splitlines()[-1:] or [type(exception).__name__]
+            passed = False
+        return CheckResult(passed=passed, seconds=round(time.time() - start_time, 1),
+                           detail=detail)
+
+    if not checks:
+        return OrderedDict()
+    # Not used as a context manager, so that checks over budget aren't waited for. Their
+    # commands are bounded by their own timeouts anyway.
+    executor = ThreadPoolExecutor(max_workers=len(checks))
+    futures = OrderedDict((name, executor.submit(run_check, check))
+                          for name, check in checks.items())
+    wait(futures.values(), timeout=budget)
+    executor.shutdown(wait=False)
+    return OrderedDict((name, future.result() if future.done()
+                        else CheckResult(passed=False, seconds=None,
+                                         detail='Still running after the budget of {} '
+                                                'seconds'.format(budget)))
+                       for name, future in futures.items())
+
+
+def raise_for_failures(results):
+    """Raise an exception naming the failed checks, if any.
+
+    Args:
+        results (:obj:`dict`): Check names mapped to :py:class:`CheckResult` instances.
+    """
+    failed_checks = [name for name, result in results.items() if not result.passed]
+    if failed_checks:
+        raise Exception('Validation failed ({}).'.format(', '.join(failed_checks)))
+
+
+def format_results(results):
+    """Format check results as a table.
+
+    Args:
+        results (:obj:`dict`): Check names mapped to :py:class:`CheckResult` instances.
+
+    Returns:
+        A :obj:`str` of the table.
+    """
+    rows = [('CHECK', 'RESULT', 'SECONDS', 'DETAIL')]
+    for name, result in results.items():
+        detail = result.detail
+        if isinstance(detail, list):
+            detail = '; '.join(str(item) for item in detail if item)
+        rows.append((name, 'PASS' if result.passed else 'FAIL',
+                     '' if result.seconds is None else str(result.seconds), detail or ''))
+    widths = [max(len(row[column]) for row in rows) for column in range(3)]
+    return '\n'.join('  '.join([cell.ljust(width) for cell, width in zip(row, widths)] + [row[3]])
+                     .rstrip()
+                     for row in rows)
+
+
+def _execute(node, command, timeout):
+    result = node.execute('timeout {} bash -c {}'.format(timeout, shlex.quote(command)),
+                          quiet=True)
+    if result.exit_code == TIMEOUT_EXIT_CODE:
+        raise TimeoutError('Timed out after {} seconds'.format(timeout))
+    if result.exit_code != 0:
+        raise Exception(result.output)
+    return result.output
+
+
+def _check_service_health(deployment, cluster_name, cm_service):
+    def condition(deployment, cluster_name):
+        services = (deployment.get_cluster_services(cluster_name=cluster_name)
+                    + ([deployment.get_cm_service()] if cm_service else []))
+        poor_services = [service['name'] for service in services
+                         if service.get('serviceState') != 'NA'
+                         and (service.get('serviceState') != 'STARTED'
+                              or service.get('healthSummary') != 'GOOD')]
+        if poor_services:
+            logger.debug('Services with poor health: %s', ', '.join(poor_services))
+        return not poor_services
+
+    def success(time):
+        logger.debug('Validated service health in %s seconds.', time)
+
+    def failure(timeout):
+        raise TimeoutError('Timed out after {} seconds waiting for every service to be '
+                           'healthy'.format(timeout))
+
+    # Health is only trusted once it stayed good for a while.
+    wait_for_condition(condition=condition, condition_args=[deployment, cluster_name],
+                       time_between_checks=3, timeout=CHECK_TIMEOUTS['cloudera-manager'],
+                       time_to_success=30, success=success, failure=failure)
+
+
+def _check_hdfs(client_node, run_id):
+    path = '/tmp/clusterdock-validate-{}'.format(run_id)
+    output = _execute(client_node, 'echo {0} | hdfs dfs -put -f - {1} && hdfs dfs -cat {1}; '
+                                   'status=$?; hdfs dfs -rm -f -skipTrash {1} >/dev/null; '
+                                   'exit $status'.format(run_id, path),
+                      CHECK_TIMEOUTS['hdfs'])
+    if run_id not in output:
+        raise Exception('Read back {!r} instead of what was written'.format(output.strip()))
+
+
+def _check_yarn(client_node):
+    output = _execute(client_node, 'hadoop jar {} pi 2 10 2>&1'.format(MAPREDUCE_EXAMPLES_JAR),
+                      CHECK_TIMEOUTS['yarn'])
+    if 'Estimated value of Pi is' not in output:
+        raise Exception('The pi job reported no estimate')
+
+
+def _check_hbase(client_node, run_id):
+    # Passed through printf, hence only double quotes.
+    table = 'clusterdock_validate_{}'.format(run_id)
+    commands = ['create "{}", "f"'.format(table),
+                'put "{}", "row", "f:q", "{}"'.format(table, run_id),
+                'get "{}", "row"'.format(table),
+                'disable "{}"'.format(table),
+                'drop "{}"'.format(table)]
+    output = _execute(client_node, "printf '{}' | hbase shell 2>&1".format(
+        ''.join('{}\\n'.format(command) for command in commands)
+    ), CHECK_TIMEOUTS['hbase'])
+    if 'value={}'.format(run_id) not in output:
+        raise Exception('Got no cell back from {}'.format(table))
+
+
+def _check_hive(client_node, run_id):
+    table = 'clusterdock_validate_{}'.format(run_id)
+    output = _execute(client_node, "hive -S -e 'CREATE TABLE {0} (id INT); "
+                                   'INSERT INTO TABLE {0} VALUES (1), (2); '
+                                   'SELECT COUNT(*) FROM {0}; '
+                                   "DROP TABLE {0}'".format(table),
+                      CHECK_TIMEOUTS['hive'])
+    if output.split()[-1:] != ['2']:
+        raise Exception('Counted {!r} rows instead of 2'.format(output.strip()))
+
+
+def _check_endpoint(client_node, service_name, url):
+    # SPNEGO, for the endpoints of Kerberized services.
+    _execute(client_node, 'curl -sf -o /dev/null --negotiate -u : {}'.format(url),
+             CHECK_TIMEOUTS[service_name])
+    return url
+
+
+def _check_kafka(node, run_id):
+    topic = 'clusterdock-validate'
+    output = _execute(node, '{0}/kafka-topics.sh --zookeeper localhost:{4} --create '
+                            '--if-not-exists --topic {1} --partitions 1 --replication-factor 1 '
+                            '&& echo {2} | {0}/kafka-console-producer.sh --broker-list {3} '
+                            '--topic {1}; {0}/kafka-console-consumer.sh '
+                            '--bootstrap-server {3} --topic {1} --from-beginning '
+                            '--timeout-ms 10000 2>/dev/null; true'.format(
+                                KAFKA_BIN_DIR, topic, run_id, KAFKA_BROKER, KAFKA_ZOOKEEPER_PORT
+                            ),
+                      CHECK_TIMEOUTS['kafka'])
+    # The consumer exits with an error once it times out, so only its output tells.
+    if run_id not in output.split():
+        raise Exception('Did not consume the message that was produced')
+
+
+def _check_opentsdb(client_node, fqdn, run_id):
+    url = 'http://{}:{}'.format(fqdn, OPENTSDB_PORT)
+    data_point = {'metric': 'clusterdock.validate', 'timestamp': int(run_id), 'value': 1,
+                  'tags': {'run': run_id}}
+    output = _execute(client_node, "curl -sf -XPOST '{0}/api/put?sync' -d '{1}' && "
+                                   "curl -sfg '{0}/api/query?start={2}&"
+                                   "m=sum:clusterdock.validate{{run={2}}}'".format(
+                                       url, json.dumps(data_point), run_id
+                                   ),
+                      CHECK_TIMEOUTS['opentsdb'])
+    if not json.loads(output.splitlines()[-1]):
+        raise Exception('Queried no data point back')